@@ -88,6 +88,8 @@ def main():
             help="Check each tile on disk and re-render old tiles")
     parser.add_option("--no-tile-checks", dest="notilechecks", action="store_true",
             help="Only render tiles that come from chunks that have changed since the last render (the default)")
+    parser.add_option("--no-texture-cache", dest="notexturecache", action="store_true",
+            help="Generate the block textures again instead of loading them from the cache of earlier runs, and don't cache them")
 
     # Useful one-time debugging options:
     parser.add_option("--check-terrain", dest="check_terrain", action="store_true",
@@ -470,12 +472,15 @@ dir but you forgot to put quotes around the directory, since it contains spaces.
             worldcache[render['world']] = w
 
         # find or create the textures object
-        texopts = util.dict_subset(render, ["texturepath", "bgcolor", "northdirection"])
+        texopts = util.dict_subset(render, ["texturepath", "bgcolor", "northdirection", "texturesize"])
         texopts_key = tuple(texopts.items())
         if texopts_key not in texcache:
             tex = textures.Textures(**texopts)
             logging.info("Generating textures...")
-            tex.generate()
+            cachedir = None
+            if not options.notexturecache:
+                cachedir = textures.get_default_cache_dir()
+            tex.generate(cachedir=cachedir, processes=config['processes'])
             logging.debug("Finished generating textures")
             texcache[texopts_key] = tex
         else:
@@ -525,7 +530,7 @@ dir but you forgot to put quotes around the directory, since it contains spaces.
 
         # only pass to the TileSet the options it really cares about
         render['name'] = render_name # perhaps a hack. This is stored here for the asset manager
-        tileSetOpts = util.dict_subset(render, ["name", "imgformat", "renderchecks", "rerenderprob", "bgcolor", "defaultzoom", "imgquality", "optimizeimg", "rendermode", "worldname_orig", "title", "dimension", "changelist", "showspawn", "overlay", "base", "poititle", "maxzoom", "showlocationmarker", "minzoom"])
+        tileSetOpts = util.dict_subset(render, ["name", "imgformat", "renderchecks", "rerenderprob", "bgcolor", "defaultzoom", "imgquality", "optimizeimg", "rendermode", "worldname_orig", "title", "dimension", "changelist", "showspawn", "overlay", "base", "poititle", "maxzoom", "showlocationmarker", "minzoom", "compositecache", "tilehashes", "texturesize"])
         tileSetOpts.update({"spawn": w.find_true_spawn()}) # TODO find a better way to do this
         for rset in rsets:
             tset = tileset.TileSet(w, rset, assetMrg, tex, tileSetOpts, tileset_dir)
@@ -560,10 +565,19 @@ dir but you forgot to put quotes around the directory, since it contains spaces.
         logging.debug("Closing %s (%s)", out, out.fileno())
         out.close()
 
-    if config['processes'] == 1:
-        logging.debug("Final cache stats:")
-        for c in caches:
-            logging.debug("\t%s: %s hits, %s misses", c.__class__.__name__, c.hits, c.misses)
+    logging.debug("Final cache stats:")
+    totals = {}
+    for procname, stats in dispatch.get_cache_stats():
+        for name, counts in sorted(stats.iteritems()):
+            logging.debug("\t%s %s: %s hits, %s misses, %s evictions", procname, name, *counts)
+            totals[name] = [a + b for a, b in zip(totals.get(name, (0, 0, 0)), counts)]
+    for name, counts in sorted(totals.iteritems()):
+        logging.debug("\tTotal %s: %s hits, %s misses, %s evictions", name, *counts)
+    rendered = skipped = 0
+    for procname, stats in dispatch.get_render_stats():
+        rendered += stats["sections rendered"]
+        skipped += stats["sections skipped"]
+    logging.debug("Skipped %s of %s chunk sections as hidden", skipped, rendered)
     if options.pid:
         os.remove(options.pid)
 
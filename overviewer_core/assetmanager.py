@@ -98,6 +98,8 @@ directory.
 
         # dictionary to hold the overviewerConfig.js settings that we will dumps
         dump = dict()
+        # in map units: the tiles of renders with another texturesize cover
+        # the same area, and are scaled to this
         dump['CONST'] = dict(tileSize=384)
         dump['CONST']['image'] = {
                 'defaultMarker':    'signpost.png',
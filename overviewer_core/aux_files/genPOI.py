@@ -115,7 +115,7 @@ def parseBucketChunks((bucket, rset, filters)):
     cnt = 0
     for b in bucket:
         try:
-            data = rset.get_chunk(b[0],b[1])
+            data = rset.get_chunk(b[0],b[1],entities=True)
             for poi in itertools.chain(data['TileEntities'], data['Entities']):
                 if poi['id'] == 'Sign':
                     poi = signWrangler(poi)
@@ -164,7 +164,7 @@ def handleEntities(rset, config, config_path, filters, markers):
     if numbuckets == 1:
         for (x, z, mtime) in rset.iterate_chunks():
             try:
-                data = rset.get_chunk(x, z)
+                data = rset.get_chunk(x, z, entities=True)
                 for poi in itertools.chain(data['TileEntities'], data['Entities']):
                     if poi['id'] == 'Sign': # kill me
                         poi = signWrangler(poi)
@@ -16,13 +16,37 @@
 """This module has supporting functions for the caching logic used in world.py.
 
 Each cache class should implement the standard container type interface
-(__getitem__ and __setitem__), as well as provide a "hits" and "misses"
-attribute.
+(__getitem__ and __setitem__) and a get() method returning a default instead
+of raising KeyError, as well as provide "hits", "misses" and "evictions"
+attributes.
+
+Keys are tuples. Caches that live outside this process turn them into strings
+themselves, so in-process caches don't pay for hashing them.
 
 """
 import functools
 import logging
 import cPickle
+import hashlib
+import weakref
+
+# every cache object created in this process, for get_stats()
+_caches = weakref.WeakSet()
+
+def get_stats():
+    """Returns the statistics of the caches used in this process, as a dict
+    mapping each cache name to a (hits, misses, evictions) tuple summed over
+    all caches of that name.
+
+    """
+    stats = {}
+    for c in list(_caches):
+        hits, misses, evictions = stats.get(c.name, (0, 0, 0))
+        stats[c.name] = (hits + c.hits, misses + c.misses, evictions + c.evictions)
+    return stats
+
+# marks a miss in LRUCache.get(), since the cached value may be anything
+_missing = object()
 
 class LRUCache(object):
     """A simple, generic, in-memory LRU cache that implements the standard
@@ -49,13 +73,16 @@ class LRUCache(object):
             self.key = k
             self.value = v
 
-    def __init__(self, size=100, destructor=None):
+    def __init__(self, size=100, destructor=None, name=None):
         """Initialize a new LRU cache with the given size.
 
         destructor, if given, is a callable that is called upon an item being
         evicted from the cache. It takes one argument, the value stored in the
         cache.
 
+        name is what get_stats() reports this cache's statistics under, and
+        defaults to the class name.
+
         """
         self.cache = {}
 
@@ -68,23 +95,32 @@ class LRUCache(object):
 
         self.hits = 0
         self.misses = 0
+        self.evictions = 0
 
         self.size = size
 
         self.destructor = destructor
 
+        self.name = name or self.__class__.__name__
+        _caches.add(self)
+
     # Initialize an empty cache of the same size for worker processes
     def __getstate__(self):
-        return self.size
-    def __setstate__(self, size):
-        self.__init__(size)
+        return self.size, self.name
+    def __setstate__(self, state):
+        self.__init__(state[0], name=state[1])
 
     def __getitem__(self, key):
-        try:
-            link = self.cache[key]
-        except KeyError:
+        value = self.get(key, _missing)
+        if value is _missing:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        link = self.cache.get(key)
+        if link is None:
             self.misses += 1
-            raise
+            return default
 
         # Disconnect the link from where it is
         link.left.right = link.right
@@ -112,6 +148,7 @@ class LRUCache(object):
             del cache[link.key]
             link.left.right = link.right
             link.right.left = link.left
+            self.evictions += 1
             d = self.destructor
             if d:
                 d(link.value)
@@ -152,16 +189,37 @@ else:
             self.conn = conn
             self.mc = memcache.Client([conn], debug=0, pickler=cPickle.Pickler, unpickler=cPickle.Unpickler)
 
+            self.hits = 0
+            self.misses = 0
+            # memcached evicts items on the server, without telling us
+            self.evictions = 0
+
+            self.name = self.__class__.__name__
+            _caches.add(self)
+
         def __getstate__(self):
             return self.conn
         def __setstate__(self, conn):
             self.__init__(conn)
 
+        @staticmethod
+        def _server_key(key):
+            # memcached keys are short strings without spaces
+            return hashlib.md5(repr(key)).hexdigest()
+
         def __getitem__(self, key):
-            v = self.mc.get(key)
+            v = self.get(key)
+            if not v:
+                raise KeyError(key)
+            return v
+
+        def get(self, key, default=None):
+            v = self.mc.get(self._server_key(key))
             if not v:
-                raise KeyError()
+                self.misses += 1
+                return default
+            self.hits += 1
             return v
 
         def __setitem__(self, key, value):
-            self.mc.set(key, value)
+            self.mc.set(self._server_key(key), value)
@@ -13,14 +13,24 @@
 #    You should have received a copy of the GNU General Public License along
 #    with the Overviewer.  If not, see <http://www.gnu.org/licenses/>.
 
-import util
+import cache
+import c_overviewer
 import multiprocessing
 import multiprocessing.managers
 import cPickle as pickle
 import Queue
 import time
+import collections
+import uuid
 from signals import Signal
 
+def finish_work(tilesets):
+    """Calls finish_work() on those of the given workers that have it, see
+    the Worker interface"""
+    for tileset in tilesets:
+        if hasattr(tileset, "finish_work"):
+            tileset.finish_work()
+
 class Dispatcher(object):
     """This class coordinates the work of all the TileSet objects
     among one worker process. By subclassing this class and
@@ -31,12 +41,20 @@ class Dispatcher(object):
     def __init__(self):
         super(Dispatcher, self).__init__()
 
-        # list of (tileset, workitem) tuples
-        # keeps track of dispatched but unfinished jobs
-        self._running_jobs = []
-        # list of (tileset, workitem, dependencies) tuples
-        # keeps track of jobs waiting to run after dependencies finish
-        self._pending_jobs = []
+        # set of (tileset, workitem) tuples
+        # keeps track of every added job that hasn't finished yet, whether
+        # it was dispatched or not
+        self._unfinished_jobs = set()
+        # maps each tileset to its number of unfinished jobs
+        self._tileset_jobs = {}
+        # maps (tileset, workitem) to the list of jobs waiting for it
+        self._dependents = {}
+        # maps each job waiting for dependencies to finish to the number
+        # of them still unfinished
+        self._waiting_jobs = {}
+        # (tileset, workitem) tuples with no unfinished dependencies,
+        # in the order they became ready to dispatch
+        self._ready_jobs = collections.deque()
 
     def render_all(self, tilesetlist, observer):
         """Render all of the tilesets in the given
@@ -44,81 +62,126 @@ class Dispatcher(object):
         status. The callback should take the following arguments:
         (phase, items_completed, total_items), where total_items may
         be none if there is no useful estimate.
+
+        There is no barrier between the tilesets: each moves on to its
+        next phase as soon as its own jobs of the current phase are
+        done, and a job is dispatched as soon as its dependencies are,
+        so the workers stay busy until the very last job.
         """
         # TODO use status callback
 
         # setup tilesetlist
         self.setup_tilesets(tilesetlist)
 
-        # iterate through all possible phases
+        # keep track of total jobs over all phases, and how many jobs
+        # are done
         num_phases = [tileset.get_num_phases() for tileset in tilesetlist]
-        for phase in xrange(max(num_phases)):
-            # construct a list of iterators to use for this phase
-            work_iterators = []
-            for i, tileset in enumerate(tilesetlist):
-                if phase < num_phases[i]:
-                    def make_work_iterator(tset, p):
-                        return ((tset, workitem) for workitem in tset.iterate_work_items(p))
-                    work_iterators.append(make_work_iterator(tileset, phase))
-
-            # keep track of total jobs, and how many jobs are done
-            total_jobs = 0
-            for tileset, phases in zip(tilesetlist, num_phases):
-                if phase < phases:
-                    jobs_for_tileset = tileset.get_phase_length(phase)
-                    # if one is unknown, the total is unknown
-                    if jobs_for_tileset is None:
-                        total_jobs = None
-                        break
-                    else:
-                        total_jobs += jobs_for_tileset
-
-            observer.start(total_jobs)
-            # go through these iterators round-robin style
-            for tileset, (workitem, deps) in util.roundrobin(work_iterators):
-                self._pending_jobs.append((tileset, workitem, deps))
-                observer.add(self._dispatch_jobs())
-
-            # after each phase, wait for the work to finish
-            while len(self._pending_jobs) > 0 or len(self._running_jobs) > 0:
-                observer.add(self._dispatch_jobs())
-
-            observer.finish()
+        total_jobs = 0
+        for tileset, phases in zip(tilesetlist, num_phases):
+            for phase in xrange(phases):
+                jobs_for_phase = tileset.get_phase_length(phase)
+                # if one is unknown, the total is unknown
+                if jobs_for_phase is None:
+                    total_jobs = None
+                    break
+                else:
+                    total_jobs += jobs_for_phase
+            if total_jobs is None:
+                break
+        observer.start(total_jobs)
+
+        # (tileset, phase, work iterator) of every tileset still adding
+        # jobs, gone through round-robin style
+        iterators = collections.deque()
+        # (tileset, phase) of every tileset waiting for its jobs to finish
+        # before it can start its next phase
+        waiting = []
+        for tileset, phases in zip(tilesetlist, num_phases):
+            if phases > 0:
+                iterators.append((tileset, 0, tileset.iterate_work_items(0)))
+
+        while iterators or waiting:
+            if iterators:
+                tileset, phase, work_iterator = iterators.popleft()
+                try:
+                    workitem, deps = next(work_iterator)
+                except StopIteration:
+                    waiting.append((tileset, phase))
+                    continue
+                self._add_job(tileset, workitem, deps)
+                iterators.append((tileset, phase, work_iterator))
+            observer.add(self._dispatch_jobs())
+
+            # start the next phase of the tilesets that are done with
+            # this one
+            for tileset, phase in waiting[:]:
+                if self._tileset_jobs.get(tileset):
+                    continue
+                waiting.remove((tileset, phase))
+                phase += 1
+                if phase < tileset.get_num_phases():
+                    iterators.append((tileset, phase, tileset.iterate_work_items(phase)))
+
+        finish_work(tilesetlist)
+        observer.finish()
+
+    def _add_job(self, tileset, workitem, deps):
+        # helper function to add a job, which is ready to dispatch once
+        # none of the given dependencies are pending or running. Jobs are
+        # counted rather than searched for, so this and _finish_job() take
+        # the same time no matter how many jobs are queued.
+        job = (tileset, workitem)
+        waiting = 0
+        for dep in deps:
+            depjob = (tileset, dep)
+            if depjob in self._unfinished_jobs:
+                self._dependents.setdefault(depjob, []).append(job)
+                waiting += 1
+
+        if job not in self._unfinished_jobs:
+            self._unfinished_jobs.add(job)
+            self._tileset_jobs[tileset] = self._tileset_jobs.get(tileset, 0) + 1
+        if waiting:
+            self._waiting_jobs[job] = waiting
+        else:
+            self._ready_jobs.append(job)
+
+    def _finish_job(self, job):
+        # helper function to mark a job as finished, readying the jobs
+        # that were only waiting on it
+        if job in self._unfinished_jobs:
+            self._unfinished_jobs.remove(job)
+            self._tileset_jobs[job[0]] -= 1
+        for dependent in self._dependents.pop(job, ()):
+            self._waiting_jobs[dependent] -= 1
+            if self._waiting_jobs[dependent] == 0:
+                del self._waiting_jobs[dependent]
+                self._ready_jobs.append(dependent)
 
     def _dispatch_jobs(self):
-        # helper function to dispatch pending jobs when their
-        # dependencies are met, and to manage self._running_jobs
-        dispatched_jobs = []
-        finished_jobs = []
-
-        pending_jobs_nodeps = [(j[0], j[1]) for j in self._pending_jobs]
-
-        for pending_job in self._pending_jobs:
-            tileset, workitem, deps = pending_job
-
-            # see if any of the deps are in _running_jobs or _pending_jobs
-            for dep in deps:
-                if (tileset, dep) in self._running_jobs or (tileset, dep) in pending_jobs_nodeps:
-                    # it is! don't dispatch this item yet
-                    break
-            else:
-                # it isn't! all dependencies are finished
-                finished_jobs += self.dispatch(tileset, workitem)
-                self._running_jobs.append((tileset, workitem))
-                dispatched_jobs.append(pending_job)
+        # helper function to dispatch the jobs whose dependencies are
+        # met, and to collect finished jobs. Returns the number of jobs
+        # that finished.
+        num_finished = 0
+        dispatched = False
+
+        while self._ready_jobs:
+            tileset, workitem = self._ready_jobs.popleft()
+            finished_jobs = self.dispatch(tileset, workitem)
+            dispatched = True
+            for job in finished_jobs:
+                self._finish_job(job)
+            num_finished += len(finished_jobs)
 
         # make sure to at least get finished jobs, even if we don't
         # submit any new ones...
-        if len(dispatched_jobs) == 0:
-            finished_jobs += self.dispatch(None, None)
-
-        # clean out the appropriate lists
-        for job in finished_jobs:
-            self._running_jobs.remove(job)
-        for job in dispatched_jobs:
-            self._pending_jobs.remove(job)
+        if not dispatched:
+            finished_jobs = self.dispatch(None, None)
+            for job in finished_jobs:
+                self._finish_job(job)
+            num_finished += len(finished_jobs)
 
-        return len(finished_jobs)
+        return num_finished
 
     def close(self):
         """Close the Dispatcher. This should be called when you are
@@ -127,6 +190,21 @@ class Dispatcher(object):
         """
         pass
 
+    def get_cache_stats(self):
+        """Returns a list of (process name, stats) tuples, one for every
+        process that did work, where stats is the dict returned by
+        cache.get_stats() in that process. For dispatchers with worker
+        processes, this is only complete after close().
+        """
+        return [(multiprocessing.current_process().name, cache.get_stats())]
+
+    def get_render_stats(self):
+        """Returns a list of (process name, stats) tuples like
+        get_cache_stats(), where stats is the dict returned by
+        c_overviewer.get_render_stats() in that process.
+        """
+        return [(multiprocessing.current_process().name, c_overviewer.get_render_stats())]
+
     def setup_tilesets(self, tilesetlist):
         """Called whenever a new list of tilesets are being used. This
         lets subclasses distribute the whole list at once, instead of
@@ -150,8 +228,10 @@ class MultiprocessingDispatcherManager(multiprocessing.managers.BaseManager):
     processes access to the communication Queues, and also gives
     workers access to the current tileset list.
     """
-    def _get_job_queue(self):
-        return self.job_queue
+    def _get_job_queue(self, worker_id):
+        if worker_id not in self.job_queues:
+            self.job_queues[worker_id] = multiprocessing.Queue()
+        return self.job_queues[worker_id]
     def _get_results_queue(self):
         return self.result_queue
     def _get_signal_queue(self):
@@ -160,7 +240,9 @@ class MultiprocessingDispatcherManager(multiprocessing.managers.BaseManager):
         return self.tileset_data
 
     def __init__(self, address=None, authkey=None):
-        self.job_queue = multiprocessing.Queue()
+        # every worker gets a job queue of its own, created when it
+        # first asks for it
+        self.job_queues = {}
         self.result_queue = multiprocessing.Queue()
         self.signal_queue = multiprocessing.Queue()
 
@@ -207,7 +289,10 @@ class MultiprocessingDispatcherProcess(multiprocessing.Process):
         created in MultiprocessingDispatcher.
         """
         super(MultiprocessingDispatcherProcess, self).__init__()
-        self.job_queue = manager.get_job_queue()
+        # a name for us that is unique among all machines, used to get
+        # our own job queue
+        self.worker_id = uuid.uuid4().hex
+        self.job_queue = manager.get_job_queue(self.worker_id)
         self.result_queue = manager.get_result_queue()
         self.signal_queue = manager.get_signal_queue()
         self.tileset_proxy = manager.get_tileset_data()
@@ -216,12 +301,15 @@ class MultiprocessingDispatcherProcess(multiprocessing.Process):
         """A convenience function to update our local tilesets to the
         current version in use by the MultiprocessingDispatcher.
         """
+        if self.tilesets:
+            finish_work(self.tilesets)
         self.tilesets, self.tileset_version = self.tileset_proxy._getvalue()
 
     def run(self):
-        """The main work loop. Jobs are pulled from the job queue and
-        executed, then the result is pushed onto the result
-        queue. Updates to the tilesetlist are recognized and handled
+        """The main work loop. Batches of jobs are pulled from this
+        worker's job queue and executed, then their results are pushed
+        onto the result queue together, with the time the batch
+        took. Updates to the tilesetlist are recognized and handled
         automatically. This is the method that actually runs in the
         new worker process.
         """
@@ -229,6 +317,7 @@ class MultiprocessingDispatcherProcess(multiprocessing.Process):
         timeout = 1.0
 
         # update our tilesets
+        self.tilesets = None
         self.update_tilesets()
 
         # register for all available signals
@@ -240,33 +329,60 @@ class MultiprocessingDispatcherProcess(multiprocessing.Process):
             register_signal(name, sig)
 
         # notify that we're starting up
-        self.result_queue.put(None, False)
+        self.result_queue.put(("start", self.worker_id), False)
         while True:
             try:
                 job = self.job_queue.get(True, timeout)
                 if job == None:
-                    # this is a end-of-jobs sentinel
+                    # this is a end-of-jobs sentinel. Report our cache
+                    # and render stats on the way out
+                    finish_work(self.tilesets)
+                    self.result_queue.put(("exit", self.worker_id, self.name,
+                            cache.get_stats(), c_overviewer.get_render_stats()), False)
                     return
 
-                # unpack job
-                tv, ti, workitem = job
+                # unpack job batch
+                tv, batch = job
 
                 if tv != self.tileset_version:
                     # our tilesets changed!
                     self.update_tilesets()
                     assert tv == self.tileset_version
 
-                # do job
-                ret = self.tilesets[ti].do_work(workitem)
-                result = (ti, workitem, ret,)
-                self.result_queue.put(result, False)
+                # do jobs
+                start = time.time()
+                results = []
+                for ti, workitem in batch:
+                    ret = self.tilesets[ti].do_work(workitem)
+                    results.append((ti, workitem, ret))
+                self.result_queue.put(("done", self.worker_id, time.time() - start, results), False)
             except Queue.Empty:
                 pass
 
 class MultiprocessingDispatcher(Dispatcher):
     """A subclass of Dispatcher that spawns worker processes and
     distributes jobs to them to speed up processing.
+
+    Jobs are sent to the workers in batches, and their results come
+    back the same way, so cheap jobs don't pay for a trip through the
+    manager process each. The batch size follows the measured time
+    per job, aiming for batches that take about batch_time seconds.
+
+    Every worker has a job queue of its own. Jobs that a tileset puts
+    in the same group (see get_work_group() in the Worker interface)
+    all go to the same worker, so neighbouring tiles are rendered by a
+    process that already has their chunks cached. A worker that runs
+    out of jobs steals batches from the one with the most left.
     """
+    # the aimed for time per batch, and the largest batch size
+    batch_time = 0.25
+    max_batch_size = 100
+    # batches sent to a worker's queue at once. The rest are held back
+    # so they can still be stolen by other workers
+    queued_batches = 2
+    # jobs per worker to hold before dispatch() waits for results
+    max_backlog = 1000
+
     def __init__(self, local_procs=-1, address=None, authkey=None):
         """Creates the dispatcher. local_procs should be the number of
         worker processes to spawn. If it's omitted (or negative)
@@ -281,9 +397,30 @@ class MultiprocessingDispatcher(Dispatcher):
 
         self.outstanding_jobs = 0
         self.num_workers = 0
+        # the following are all keyed by worker id
+        # job queue proxies of the running workers
+        self.job_queues = {}
+        # jobs waiting to be put into a batch, as (tileset index,
+        # workitem) tuples
+        self.batches = {}
+        # deques of full batches not yet sent to the worker
+        self.pending_batches = {}
+        # number of batches sent to the worker and not yet finished
+        self.sent_batches = {}
+        # number of unfinished jobs assigned to the worker, wherever
+        # they are
+        self.assigned_jobs = {}
+        # maps (tileset index, work group) to the worker doing that group
+        self.groups = {}
+        self.batch_size = 1
+        # running average of the time per job, or None before the
+        # first results
+        self.job_time = None
+        # (process name, stats) from every worker that has exited
+        self.cache_stats = []
+        self.render_stats = []
         self.manager = MultiprocessingDispatcherManager(address=address, authkey=authkey)
         self.manager.start()
-        self.job_queue = self.manager.get_job_queue()
         self.result_queue = self.manager.get_result_queue()
         self.signal_queue = self.manager.get_signal_queue()
 
@@ -296,41 +433,117 @@ class MultiprocessingDispatcher(Dispatcher):
 
     def close(self):
         # empty the queue
+        self._flush_batches()
         self._handle_messages(timeout=0.0)
         while self.outstanding_jobs > 0:
             self._handle_messages()
 
         # send of the end-of-jobs sentinel
-        for p in xrange(self.num_workers):
-            self.job_queue.put(None, False)
+        for job_queue in self.job_queues.itervalues():
+            job_queue.put(None, False)
 
-        # TODO better way to be sure worker processes get the message
-        time.sleep(1)
+        # wait for the workers to say goodbye with their cache stats, but
+        # don't hang on one that went away without a word
+        deadline = time.time() + 10
+        while self.num_workers > 0 and time.time() < deadline:
+            self._handle_messages()
 
         # and close the manager
         self.manager.shutdown()
         self.manager = None
         self.pool = None
 
+    def get_cache_stats(self):
+        return self.cache_stats
+
+    def get_render_stats(self):
+        return self.render_stats
+
     def setup_tilesets(self, tilesets):
         self.manager.set_tilesets(tilesets)
+        self.groups = {}
 
     def dispatch(self, tileset, workitem):
-        # handle the no-new-work case
+        # handle the no-new-work case. Nothing else is ready to go, so
+        # send off what we have
         if tileset is None:
+            self._flush_batches()
             return self._handle_messages()
 
-        # create and submit the job
+        # we need a worker to give the job to
+        finished_jobs = self._handle_messages(timeout=0.0)
+        while not self.job_queues:
+            finished_jobs += self._handle_messages()
+
+        # find the worker for the job's group, or give the group to the
+        # worker with the least to do
         tileset_index = self.manager.tilesets.index(tileset)
-        self.job_queue.put((self.manager.tileset_version, tileset_index, workitem), False)
+        group = None
+        if hasattr(tileset, "get_work_group"):
+            group = (tileset_index, tileset.get_work_group(workitem))
+        worker = self.groups.get(group)
+        if worker not in self.job_queues:
+            worker = min(self.job_queues, key=self.assigned_jobs.get)
+            if group is not None:
+                self.groups[group] = worker
+
+        # add the job to the worker's batch, and submit it if it's full
+        batch = self.batches[worker]
+        batch.append((tileset_index, workitem))
+        self.assigned_jobs[worker] += 1
         self.outstanding_jobs += 1
-
-        # make sure the queue doesn't fill up too much
-        finished_jobs = self._handle_messages(timeout=0.0)
-        while self.outstanding_jobs > self.num_workers * 10:
+        if len(batch) >= self.batch_size:
+            self.pending_batches[worker].append(batch)
+            self.batches[worker] = []
+            self._send_batches()
+
+        # make sure we don't pile up too much work
+        while self.outstanding_jobs > self.num_workers * self.max_backlog:
+            self._flush_batches()
             finished_jobs += self._handle_messages()
         return finished_jobs
 
+    def _flush_batches(self):
+        # helper function to queue up every unfilled batch
+        for worker, batch in self.batches.iteritems():
+            if batch:
+                self.pending_batches[worker].append(batch)
+                self.batches[worker] = []
+        self._send_batches()
+
+    def _send_batches(self):
+        # helper function to keep the queue of every worker filled,
+        # stealing work for those that have none of their own
+        for worker, job_queue in self.job_queues.iteritems():
+            while self.sent_batches[worker] < self.queued_batches:
+                pending = self.pending_batches[worker]
+                if not pending:
+                    # once this worker has run dry, steal the batch
+                    # furthest from what the busiest worker is doing now
+                    victim = max(self.pending_batches, key=lambda w: len(self.pending_batches[w]))
+                    if self.sent_batches[worker] > 0 or not self.pending_batches[victim]:
+                        break
+                    batch = self.pending_batches[victim].pop()
+                    self.assigned_jobs[victim] -= len(batch)
+                    self.assigned_jobs[worker] += len(batch)
+                    pending.append(batch)
+                job_queue.put((self.manager.tileset_version, pending.popleft()), False)
+                self.sent_batches[worker] += 1
+
+    def _update_batch_size(self, elapsed, num_jobs):
+        # helper function to adapt the batch size to how long the jobs
+        # of a finished batch took
+        job_time = elapsed / num_jobs
+        if self.job_time is None:
+            self.job_time = job_time
+        else:
+            self.job_time = 0.8 * self.job_time + 0.2 * job_time
+        if self.job_time > 0:
+            size = int(self.batch_time / self.job_time)
+        else:
+            size = self.max_batch_size
+        self.batch_size = max(1, min(size, self.max_batch_size))
+
     def _handle_messages(self, timeout=0.01):
         # work function: takes results out of the result queue and
         # keeps track of how many outstanding jobs remain
@@ -343,14 +556,33 @@ class MultiprocessingDispatcher(Dispatcher):
                 try:
                     result = self.result_queue.get(False)
 
-                    if result != None:
-                        # completed job
-                        ti, workitem, ret = result
-                        finished_jobs.append((self.manager.tilesets[ti], workitem))
-                        self.outstanding_jobs -= 1
-                    else:
+                    if result[0] == "start":
                         # new worker
+                        worker = result[1]
+                        self.job_queues[worker] = self.manager.get_job_queue(worker)
+                        self.batches[worker] = []
+                        self.pending_batches[worker] = collections.deque()
+                        self.sent_batches[worker] = 0
+                        self.assigned_jobs[worker] = 0
                         self.num_workers += 1
+                        self._send_batches()
+                    elif result[0] == "exit":
+                        # exiting worker, with its name, cache and
+                        # render stats
+                        del self.job_queues[result[1]]
+                        self.cache_stats.append(result[2:4])
+                        self.render_stats.append((result[2], result[4]))
+                        self.num_workers -= 1
+                    else:
+                        # completed batch of jobs
+                        _, worker, elapsed, results = result
+                        for ti, workitem, ret in results:
+                            finished_jobs.append((self.manager.tilesets[ti], workitem))
+                        self.outstanding_jobs -= len(results)
+                        self.assigned_jobs[worker] -= len(results)
+                        self.sent_batches[worker] -= 1
+                        self._update_batch_size(elapsed, len(results))
+                        self._send_batches()
                 except Queue.Empty:
                     result_empty = True
             if not signal_empty:
@@ -14,34 +14,79 @@
 #    with the Overviewer.  If not, see <http://www.gnu.org/licenses/>.
 
 import gzip, zlib
+import mmap
+import os
 import struct
 import StringIO
 import functools
 
+import numpy
+
+# the compiled decoder is optional; NBTFileReader falls back to parsing in
+# python if the extension is missing or too old to provide it
+try:
+    from c_overviewer import nbt_read as _c_nbt_read
+except ImportError:
+    _c_nbt_read = None
+
 # decorator that turns the first argument from a string into an open file
 # handle
 def _file_loader(func):
     @functools.wraps(func)
-    def wrapper(fileobj, *args):
+    def wrapper(fileobj, *args, **kwargs):
         if isinstance(fileobj, basestring):
             # Is actually a filename
             fileobj = open(fileobj, 'rb', 4096)
-        return func(fileobj, *args)
+        return func(fileobj, *args, **kwargs)
     return wrapper
 
 @_file_loader
-def load(fileobj):
+def load(fileobj, tagpaths=None):
     """Reads in the given file as NBT format, parses it, and returns the
-    result as a (name, data) tuple.    
+    result as a (name, data) tuple. See NBTFileReader.read_all() for
+    tagpaths.
     """
-    return NBTFileReader(fileobj).read_all()
+    return NBTFileReader(fileobj).read_all(tagpaths)
 
 @_file_loader
-def load_region(fileobj):
+def load_region(fileobj, use_mmap=False):
     """Reads in the given file as a MCR region, and returns an object
-    for accessing the chunks inside."""
-    return MCRFileReader(fileobj)
+    for accessing the chunks inside. See MCRFileReader for use_mmap."""
+    return MCRFileReader(fileobj, use_mmap)
+
+
+# compiled projections, keyed by the tuple of tag paths they came from
+_projections = {}
+
+def _compile_tagpaths(tagpaths):
+    """Turns a sequence of tag paths like "Level/Sections" into a nested
+    dict mapping tag names to either another such dict, or None if the
+    whole tag should be read. Paths into a list apply to every compound in
+    it, so "Level/Sections/Y" reads only the Y tag of each section.
+
+    """
+    tagpaths = tuple(tagpaths)
+    try:
+        return _projections[tagpaths]
+    except KeyError:
+        pass
+
+    projection = {}
+    # shorter paths first, so a parent tag that is read whole wins over any
+    # of its children
+    for path in sorted(tagpaths, key=lambda p: p.count("/")):
+        node = projection
+        names = [unicode(name) for name in path.split("/")]
+        for name in names[:-1]:
+            child = node.setdefault(name, {})
+            if child is None:
+                break
+            node = child
+        else:
+            node[names[-1]] = None
 
+    _projections[tagpaths] = projection
+    return projection
 
 class CorruptionError(Exception):
     pass
@@ -71,17 +116,23 @@ class NBTFileReader(object):
     _long   = struct.Struct(">q")
     _float  = struct.Struct(">f")
     _double = struct.Struct(">d") 
+
+    # payload sizes of the fixed-size types, for skipping over them
+    _tag_sizes = {0: 0, 1: 1, 2: 2, 3: 4, 4: 8, 5: 4, 6: 8}
  
     def __init__(self, fileobj, is_gzip=True):
         """Create a NBT parsing object with the given file-like
         object. Setting is_gzip to False parses the file as a zlib
-        stream instead."""
+        stream instead, in which case fileobj may also be a string or
+        buffer holding the stream."""
         if is_gzip:
             self._file = gzip.GzipFile(fileobj=fileobj, mode='rb')
         else:
             # pure zlib stream -- maybe later replace this with
             # a custom zlib file object?
-            data = zlib.decompress(fileobj.read())
+            if hasattr(fileobj, "read"):
+                fileobj = fileobj.read()
+            data = zlib.decompress(fileobj)
             self._file = StringIO.StringIO(data)
 
         # mapping of NBT type ids to functions to read them out
@@ -146,17 +197,20 @@ class NBTFileReader(object):
         # decode it and return
         return string.decode("UTF-8")
 
-    def _read_tag_list(self):
+    def _read_tag_list(self, projection=None):
         tagid = self._read_tag_byte()
         length = self._uint.unpack(self._file.read(4))[0]
 
-        read_method = self._read_tagmap[tagid]
+        if projection is not None and tagid in (9, 10):
+            read_method = lambda: self._read_tagmap[tagid](projection)
+        else:
+            read_method = self._read_tagmap[tagid]
         l = []
         for _ in xrange(length):
             l.append(read_method())
         return l
 
-    def _read_tag_compound(self):
+    def _read_tag_compound(self, projection=None):
         # Build a dictionary of all the tag names mapping to their payloads
         tags = {}
         while True:
@@ -167,26 +221,79 @@ class NBTFileReader(object):
                 break
 
             name = self._read_tag_string()
-            payload = self._read_tagmap[tagtype]()
+            if projection is None:
+                payload = self._read_tagmap[tagtype]()
+            elif name not in projection:
+                self._skip_tag(tagtype)
+                continue
+            elif projection[name] is not None and tagtype in (9, 10):
+                payload = self._read_tagmap[tagtype](projection[name])
+            else:
+                payload = self._read_tagmap[tagtype]()
             tags[name] = payload
 
         return tags
+
+    def _skip_tag(self, tagtype):
+        """Moves past the payload of a tag of the given type without
+        building it"""
+        if tagtype in self._tag_sizes:
+            self._file.seek(self._tag_sizes[tagtype], 1)
+        elif tagtype == 7:
+            length = self._uint.unpack(self._file.read(4))[0]
+            self._file.seek(length, 1)
+        elif tagtype == 8:
+            length = self._ushort.unpack(self._file.read(2))[0]
+            self._file.seek(length, 1)
+        elif tagtype == 9:
+            tagid = self._read_tag_byte()
+            length = self._uint.unpack(self._file.read(4))[0]
+            if tagid in self._tag_sizes:
+                self._file.seek(length * self._tag_sizes[tagid], 1)
+            else:
+                for _ in xrange(length):
+                    self._skip_tag(tagid)
+        elif tagtype == 10:
+            while True:
+                tagtype = ord(self._file.read(1))
+                if tagtype == 0:
+                    break
+                self._skip_tag(8)
+                self._skip_tag(tagtype)
+        elif tagtype == 11:
+            length = self._uint.unpack(self._file.read(4))[0]
+            self._file.seek(length * 4, 1)
+        else:
+            # same error as an unknown tag in _read_tagmap
+            raise KeyError(tagtype)
     
-    def read_all(self):
+    def read_all(self, tagpaths=None):
         """Reads the entire file and returns (name, payload)
         name is the name of the root tag, and payload is a dictionary mapping
         names to their payloads
 
+        If tagpaths is given, it is a sequence of slash-separated paths to
+        the tags that should be read, starting below the root tag (for
+        example "Level/Sections"). Every other tag is skipped over, and
+        does not appear in the payload.
+
         """
-        # Read tag type
+        projection = None
+        if tagpaths is not None:
+            projection = _compile_tagpaths(tagpaths)
+
         try:
+            if _c_nbt_read is not None:
+                return _c_nbt_read(self._file.read(), projection)
+
+            # Read tag type
             tagtype = ord(self._file.read(1))
             if tagtype != 10:
-                raise Exception("Expected a tag compound")
+                raise CorruptNBTError("Expected a tag compound")
             
             # Read the tag name
             name = self._read_tag_string()
-            payload = self._read_tag_compound()
+            payload = self._read_tag_compound(projection)
             
             return (name, payload)
         except (struct.error, ValueError), e:
@@ -199,29 +306,48 @@ class MCRFileReader(object):
     Beta 1.3 update. It provides functions for opening individual
     chunks (as (name, data) tuples), getting chunk timestamps, and for
     listing chunks contained in the file.
+
+    With use_mmap, the file is memory-mapped instead of read through the
+    file object, and chunk payloads are handed to zlib straight out of
+    the mapping. Processes reading the same region then share the page
+    cache instead of each keeping its own copies.
+
+    Mapping a file that is still being written to is not safe: if it is
+    truncated while mapped, touching the pages past its new end kills the
+    process with SIGBUS. Chunks are checked against the size the file had
+    when it was mapped, and the reader falls back to plain reads once it
+    notices the file shrank, but that check can still race with a writer,
+    so don't use use_mmap on the regions of a running server.
     """
     
-    _location_table_format = struct.Struct(">1024I")
-    _timestamp_table_format = struct.Struct(">1024i")
     _chunk_header_format = struct.Struct(">I B")
     
-    def __init__(self, fileobj):
+    def __init__(self, fileobj, use_mmap=False):
         """This creates a region object from the given file-like
         object. Chances are you want to use load_region instead."""
         self._file = fileobj
-        
-        # read in the location table
-        location_data = self._file.read(4096)
-        if not len(location_data) == 4096:
+        self._map = None
+
+        if use_mmap:
+            try:
+                self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # mmap refuses empty files
+                raise CorruptRegionError("invalid location table")
+            # a mapping never grows with its file
+            self._size = len(self._map)
+            header = self._map[:8192]
+        else:
+            header = self._file.read(8192)
+
+        if len(header) < 4096:
             raise CorruptRegionError("invalid location table")
-        # read in the timestamp table
-        timestamp_data = self._file.read(4096)
-        if not len(timestamp_data) == 4096:
+        if len(header) != 8192:
             raise CorruptRegionError("invalid timestamp table")
 
-        # turn this data into a useful list
-        self._locations = self._location_table_format.unpack(location_data)
-        self._timestamps = self._timestamp_table_format.unpack(timestamp_data)
+        # the tables are used as-is, without making 2048 python ints
+        self._locations = numpy.frombuffer(header, dtype=">u4", count=1024)
+        self._timestamps = numpy.frombuffer(header, dtype=">i4", count=1024, offset=4096)
 
     def close(self):
         """Close the region file and free any resources associated
@@ -229,6 +355,9 @@ class MCRFileReader(object):
         results in undefined behaviour.
         """
         
+        if self._map is not None:
+            self._map.close()
+            self._map = None
         self._file.close()
         self._file = None
 
@@ -237,10 +366,18 @@ class MCRFileReader(object):
         file, as (x, z) coordinate tuples. To load these chunks,
         provide these coordinates to load_chunk()."""
         
-        for x in xrange(32): 
-            for z in xrange(32): 
-                if self._locations[x + z * 32] >> 8 != 0:
-                    yield (x,z)
+        xs, zs, _ = self.get_chunk_info()
+        return zip(xs.tolist(), zs.tolist())
+
+    def get_chunk_info(self):
+        """Return (x, z, mtime) numpy arrays covering every chunk in this
+        region file, in the same order as get_chunks(). The coordinates
+        are local to the region, in the range [0, 31]."""
+
+        # the tables are z-major, transpose to keep the x-major order
+        xs, zs = (self._locations >> 8).reshape((32, 32)).T.nonzero()
+        mtimes = self._timestamps[xs + zs * 32].astype(numpy.int64)
+        return xs, zs, mtimes
         
     def get_chunk_timestamp(self, x, z):
         """Return the given chunk's modification time. If the given
@@ -249,35 +386,47 @@ class MCRFileReader(object):
         """
         x = x % 32
         z = z % 32        
-        return self._timestamps[x + z * 32]   
+        return int(self._timestamps[x + z * 32])
     
     def chunk_exists(self, x, z):
         """Determines if a chunk exists."""
         x = x % 32
         z = z % 32
-        return self._locations[x + z * 32] >> 8 != 0
+        return int(self._locations[x + z * 32]) >> 8 != 0
 
-    def load_chunk(self, x, z):
+    def load_chunk(self, x, z, tagpaths=None):
         """Return a (name, data) tuple for the given chunk, or
         None if the given chunk doesn't exist in this region file. If
         you provide an x or z not between 0 and 31, it will be
         modulo'd into this range (x % 32, etc.) This is so you can
         provide chunk coordinates in global coordinates, and still
-        have the chunks load out of regions properly."""
+        have the chunks load out of regions properly. tagpaths limits
+        the tags that are read, see NBTFileReader.read_all()."""
         x = x % 32
         z = z % 32
-        location = self._locations[x + z * 32]
+        location = int(self._locations[x + z * 32])
         offset = (location >> 8) * 4096;
         sectors = location & 0xff;
         
         if offset == 0:
             return None
         
-        # seek to the data
-        self._file.seek(offset)
-        
-        # read in the chunk data header
-        header = self._file.read(5)
+        if self._map is not None and os.fstat(self._file.fileno()).st_size < self._size:
+            # the file was truncated since it was mapped, read it the
+            # slow way from now on rather than risk a SIGBUS
+            self._map.close()
+            self._map = None
+
+        if self._map is not None:
+            if offset + 5 > self._size:
+                raise CorruptChunkError("chunk header is invalid")
+            header = self._map[offset:offset + 5]
+        else:
+            # seek to the data
+            self._file.seek(offset)
+            
+            # read in the chunk data header
+            header = self._file.read(5)
         if len(header) != 5:
             raise CorruptChunkError("chunk header is invalid")
         data_length, compression =  self._chunk_header_format.unpack(header)
@@ -294,15 +443,25 @@ class MCRFileReader(object):
             # unsupported!
             raise CorruptRegionError("unsupported chunk compression type: %i (should be 1 or 2)" % (compression,))
         
-        # turn the rest of the data into a StringIO object
+        # grab the rest of the data
         # (using data_length - 1, as we already read 1 byte for compression)
-        data = self._file.read(data_length - 1)
+        if data_length < 1:
+            raise CorruptRegionError("chunk length is invalid")
+        if self._map is not None:
+            if offset + 4 + data_length > self._size:
+                raise CorruptRegionError("chunk length is invalid")
+            # a zero-copy view, zlib reads it straight from the mapping
+            data = buffer(self._map, offset + 5, data_length - 1)
+        else:
+            data = self._file.read(data_length - 1)
         if len(data) != data_length - 1:
             raise CorruptRegionError("chunk length is invalid")
-        data = StringIO.StringIO(data)
+        if is_gzip:
+            # gzip needs a file object
+            data = StringIO.StringIO(str(data))
         
         try:
-            return NBTFileReader(data, is_gzip=is_gzip).read_all()
+            return NBTFileReader(data, is_gzip=is_gzip).read_all(tagpaths)
         except CorruptionError:
             raise
         except Exception, e:
@@ -13,9 +13,6 @@
 #    You should have received a copy of the GNU General Public License along
 #    with the Overviewer.  If not, see <http://www.gnu.org/licenses/>.
 
-from PIL import Image
-import textures
-
 """The contents of this file are imported into the namespace of config files.
 It also defines the render primitive objects, which are used by the C code.
 Each render primitive has a corresponding section of C code, so both places
@@ -59,9 +56,6 @@ class HeightFading(RenderPrimitive):
         # 128 is *WRONG*, it should be 64. but we're grandfathered in for now
         "sealevel": ("target sea level", 128),
     }
-    
-    black_color = Image.new("RGB", (24,24), (0,0,0))
-    white_color = Image.new("RGB", (24,24), (255,255,255))
 
 class Depth(RenderPrimitive):
     name = "depth"
@@ -127,41 +121,6 @@ class Lighting(RenderPrimitive):
         "color": ("whether to use colored light", False),
     }
 
-    @property
-    def facemasks(self):
-        facemasks = getattr(self, "_facemasks", None)
-        if facemasks:
-            return facemasks
-        
-        white = Image.new("L", (24,24), 255)
-        
-        top = Image.new("L", (24,24), 0)
-        left = Image.new("L", (24,24), 0)
-        whole = Image.new("L", (24,24), 0)
-        
-        toppart = textures.Textures.transform_image_top(white)
-        leftpart = textures.Textures.transform_image_side(white)
-        
-        # using the real PIL paste here (not alpha_over) because there is
-        # no alpha channel (and it's mode "L")
-        top.paste(toppart, (0,0))
-        left.paste(leftpart, (0,6))
-        right = left.transpose(Image.FLIP_LEFT_RIGHT)
-        
-        # Manually touch up 6 pixels that leave a gap, like in
-        # textures._build_block()
-        for x,y in [(13,23), (17,21), (21,19)]:
-            right.putpixel((x,y), 255)
-        for x,y in [(3,4), (7,2), (11,0)]:
-            top.putpixel((x,y), 255)
-    
-        # special fix for chunk boundary stipple
-        for x,y in [(13,11), (17,9), (21,7)]:
-            right.putpixel((x,y), 0)
-        
-        self._facemasks = (top, left, right)
-        return self._facemasks
-
 class SmoothLighting(Lighting):
     name = "smooth-lighting"
 
@@ -175,30 +134,6 @@ class Overlay(RenderPrimitive):
         'overlay_color' : ('a tuple of (r, g, b, a) for coloring the overlay', None),
     }
 
-    @property
-    def whitecolor(self):
-        whitecolor = getattr(self, "_whitecolor", None)
-        if whitecolor:
-            return whitecolor
-        white = Image.new("RGBA", (24,24), (255, 255, 255, 255))
-        self._whitecolor = white
-        return white
-    
-    @property
-    def facemask_top(self):
-        facemask_top = getattr(self, "_facemask_top", None)
-        if facemask_top:
-            return facemask_top
-        
-        white = Image.new("L", (24,24), 255)
-        top = Image.new("L", (24,24), 0)
-        toppart = textures.Textures.transform_image_top(white)
-        top.paste(toppart, (0,0))
-        for x,y in [(3,4), (7,2), (11,0)]:
-            top.putpixel((x,y), 255)
-        self._facemask_top = top
-        return top
-
 class SpawnOverlay(Overlay):
     name = "overlay-spawn"
 
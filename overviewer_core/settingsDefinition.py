@@ -76,10 +76,13 @@ renders = Setting(required=True, default=util.OrderedDict(),
             "optimizeimg": Setting(required=True, validator=validateOptImg, default=[]),
             "nomarkers": Setting(required=False, validator=validateBool, default=None),
             "texturepath": Setting(required=False, validator=validateTexturePath, default=None),
+            "texturesize": Setting(required=True, validator=validateTextureSize, default=24),
             "renderchecks": Setting(required=False, validator=validateInt, default=None),
             "rerenderprob": Setting(required=True, validator=validateRerenderprob, default=0),
             "crop": Setting(required=False, validator=validateCrop, default=None),
             "changelist": Setting(required=False, validator=validateStr, default=None),
+            "compositecache": Setting(required=True, validator=validateInt, default=256),
+            "tilehashes": Setting(required=True, validator=validateBool, default=False),
             "markers": Setting(required=False, validator=validateMarkers, default=[]),
             "overlay": Setting(required=False, validator=validateOverlays, default=[]),
             "showspawn": Setting(required=False, validator=validateBool, default=True),
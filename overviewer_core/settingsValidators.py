@@ -189,6 +189,12 @@ def validateTexturePath(path):
         raise ValidationException("%r does not exist" % path)
     return path
 
+def validateTextureSize(size):
+    val = int(size)
+    if val < 8 or val % 4:
+        raise ValidationException("%r is not a valid texture size. Should be a multiple of 4, and at least 8." % size)
+    return val
+
 
 def validateBool(b):
     return bool(b)
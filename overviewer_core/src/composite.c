@@ -24,6 +24,18 @@
 
 #include "overviewer.h"
 
+/* vector versions of the alpha_over and resize_half loops. They give the
+   same results as the plain loops, which are used for whatever they don't
+   handle, and everywhere when use_simd is off */
+#ifdef __SSE2__
+#include <emmintrin.h>
+#define SIMD_KERNELS "sse2"
+static int use_simd = 1;
+#else
+#define SIMD_KERNELS NULL
+static int use_simd = 0;
+#endif
+
 typedef struct {
     PyObject_HEAD
     Imaging image;
@@ -92,6 +104,78 @@ setup_source_destination(Imaging src, Imaging dest,
         *ysize = dest->ysize - *dy;
 }
 
+/* blends one pixel of src over dest with the given alpha */
+static inline void
+alpha_over_pixel(UINT8 *out, UINT8 *in, UINT8 in_alpha) {
+    /* temporary calculation variables */
+    int tmp1, tmp2, tmp3;
+    int i;
+    UINT8 *outmask = out + 3;
+    
+    /* special cases */
+    if (in_alpha == 255 || (*outmask == 0 && in_alpha > 0)) {
+        *outmask = in_alpha;
+        out[0] = in[0];
+        out[1] = in[1];
+        out[2] = in[2];
+    } else if (in_alpha == 0) {
+        /* do nothing -- source is fully transparent */
+    } else {
+        /* general case */
+        int alpha = in_alpha + MULDIV255(*outmask, 255 - in_alpha, tmp1);
+        for (i = 0; i < 3; i++) {
+            /* general case */
+            *out = MULDIV255(*in, in_alpha, tmp1) +
+                MULDIV255(MULDIV255(*out, *outmask, tmp2), 255 - in_alpha, tmp3);
+            
+            *out = (*out * 255) / alpha;
+            out++, in++;
+        }
+        
+        *outmask = alpha;
+    }
+}
+
+#ifdef __SSE2__
+/* handles the runs of four pixels in a row with a fully opaque or fully
+ * transparent RGBA or L mask, which is most of any block sprite, four
+ * at a time. returns how many pixels were done, leaving the rest of the
+ * row for alpha_over_pixel.
+ */
+static inline unsigned int
+alpha_over_row_sse2(UINT8 *out, UINT8 *in, UINT8 *inmask, int mask_stride,
+                    unsigned int xsize) {
+    const __m128i opaque = _mm_set1_epi32(0xff);
+    const __m128i alpha_byte = _mm_set1_epi32((int)0xff000000);
+    unsigned int x = 0;
+    
+    for (; x + 4 <= xsize; x += 4) {
+        __m128i m;
+        int all_opaque;
+        if (mask_stride == 4) {
+            /* inmask points at the alpha byte of the first pixel */
+            m = _mm_srli_epi32(_mm_loadu_si128((__m128i *)(inmask - 3 + x * 4)), 24);
+        } else {
+            m = _mm_setr_epi32(inmask[x], inmask[x + 1], inmask[x + 2], inmask[x + 3]);
+        }
+        
+        if (_mm_movemask_epi8(_mm_cmpeq_epi32(m, _mm_setzero_si128())) == 0xffff)
+            continue;
+        all_opaque = _mm_movemask_epi8(_mm_cmpeq_epi32(m, opaque)) == 0xffff;
+        if (all_opaque) {
+            __m128i pixels = _mm_loadu_si128((__m128i *)(in + x * 4));
+            pixels = _mm_or_si128(pixels, alpha_byte);
+            _mm_storeu_si128((__m128i *)(out + x * 4), pixels);
+        } else {
+            unsigned int i;
+            for (i = x; i < x + 4; i++)
+                alpha_over_pixel(out + i * 4, in + i * 4, inmask[i * mask_stride]);
+        }
+    }
+    return x;
+}
+#endif
+
 /* convenience alpha_over with 1.0 as overall_alpha */
 inline PyObject* alpha_over(PyObject *dest, PyObject *src, PyObject *mask,
                             int dx, int dy, int xsize, int ysize) {
@@ -113,9 +197,9 @@ alpha_over_full(PyObject *dest, PyObject *src, PyObject *mask, float overall_alp
     /* source position */
     int sx, sy;
     /* iteration variables */
-    unsigned int x, y, i;
+    unsigned int x, y;
     /* temporary calculation variables */
-    int tmp1, tmp2, tmp3;
+    int tmp1;
     /* integer [0, 255] version of overall_alpha */
     UINT8 overall_alpha_int = 255 * overall_alpha;
     
@@ -174,11 +258,20 @@ alpha_over_full(PyObject *dest, PyObject *src, PyObject *mask, float overall_alp
 
     for (y = 0; y < ysize; y++) {
         UINT8 *out = (UINT8 *)imDest->image[dy + y] + dx * 4;
-        UINT8 *outmask = (UINT8 *)imDest->image[dy + y] + dx * 4 + 3;
         UINT8 *in = (UINT8 *)imSrc->image[sy + y] + sx * (imSrc->pixelsize);
         UINT8 *inmask = (UINT8 *)imMask->image[sy + y] + sx * mask_stride + mask_offset;
 
-        for (x = 0; x < xsize; x++) {
+        x = 0;
+#ifdef __SSE2__
+        if (use_simd && src_has_alpha && overall_alpha_int == 255) {
+            x = alpha_over_row_sse2(out, in, inmask, mask_stride, xsize);
+            out += x * 4;
+            in += x * 4;
+            inmask += x * mask_stride;
+        }
+#endif
+
+        for (; x < xsize; x++) {
             UINT8 in_alpha;
             
             /* apply overall_alpha */
@@ -188,39 +281,10 @@ alpha_over_full(PyObject *dest, PyObject *src, PyObject *mask, float overall_alp
                 in_alpha = *inmask;
             }
             
-            /* special cases */
-            if (in_alpha == 255 || (*outmask == 0 && in_alpha > 0)) {
-                *outmask = in_alpha;
-
-                *out = *in;
-                out++, in++;
-                *out = *in;
-                out++, in++;
-                *out = *in;
-                out++, in++;
-            } else if (in_alpha == 0) {
-                /* do nothing -- source is fully transparent */
-                out += 3;
-                in += 3;
-            } else {
-                /* general case */
-                int alpha = in_alpha + MULDIV255(*outmask, 255 - in_alpha, tmp1);
-                for (i = 0; i < 3; i++) {
-                    /* general case */
-                    *out = MULDIV255(*in, in_alpha, tmp1) +
-                        MULDIV255(MULDIV255(*out, *outmask, tmp2), 255 - in_alpha, tmp3);
-                    
-                    *out = (*out * 255) / alpha;
-                    out++, in++;
-                }
-
-                *outmask = alpha;
-            }
+            alpha_over_pixel(out, in, in_alpha);
 
-            out++;
-            if (src_has_alpha)
-                in++;
-            outmask += 4;
+            out += 4;
+            in += src_has_alpha ? 4 : 3;
             inmask += mask_stride;
         }
     }
@@ -490,6 +554,35 @@ draw_triangle(PyObject *dest, int inclusive,
     return dest;
 }
 
+#ifdef __SSE2__
+/* averages the 2x2 blocks of a pair of 4 byte per pixel rows four output
+ * pixels at a time, returning how many output pixels were done
+ */
+static inline unsigned int
+resize_half_row_sse2(UINT8 *out, UINT8 *in_row1, UINT8 *in_row2, unsigned int width) {
+    const __m128i zero = _mm_setzero_si128();
+    unsigned int x = 0;
+    
+    for (; x + 4 <= width; x += 4) {
+        __m128i a1 = _mm_loadu_si128((__m128i *)(in_row1 + x * 8));
+        __m128i a2 = _mm_loadu_si128((__m128i *)(in_row2 + x * 8));
+        __m128i b1 = _mm_loadu_si128((__m128i *)(in_row1 + x * 8 + 16));
+        __m128i b2 = _mm_loadu_si128((__m128i *)(in_row2 + x * 8 + 16));
+        /* the two rows summed per channel, two source pixels per register */
+        __m128i s0 = _mm_add_epi16(_mm_unpacklo_epi8(a1, zero), _mm_unpacklo_epi8(a2, zero));
+        __m128i s1 = _mm_add_epi16(_mm_unpackhi_epi8(a1, zero), _mm_unpackhi_epi8(a2, zero));
+        __m128i s2 = _mm_add_epi16(_mm_unpacklo_epi8(b1, zero), _mm_unpacklo_epi8(b2, zero));
+        __m128i s3 = _mm_add_epi16(_mm_unpackhi_epi8(b1, zero), _mm_unpackhi_epi8(b2, zero));
+        /* then the pairs of columns, one output pixel per 64 bits */
+        __m128i p01 = _mm_add_epi16(_mm_unpacklo_epi64(s0, s1), _mm_unpackhi_epi64(s0, s1));
+        __m128i p23 = _mm_add_epi16(_mm_unpacklo_epi64(s2, s3), _mm_unpackhi_epi64(s2, s3));
+        __m128i result = _mm_packus_epi16(_mm_srli_epi16(p01, 2), _mm_srli_epi16(p23, 2));
+        _mm_storeu_si128((__m128i *)(out + x * 4), result);
+    }
+    return x;
+}
+#endif
+
 /* scales the image to half size
  */
 inline PyObject *
@@ -556,7 +649,17 @@ resize_half(PyObject *dest, PyObject *src) {
         UINT8 *in_row1 = (UINT8 *)imSrc->image[y * 2];
         UINT8 *in_row2 = (UINT8 *)imSrc->image[y * 2 + 1];
         
-        for (x = 0; x < dest_width; x++) {
+        x = 0;
+#ifdef __SSE2__
+        if (use_simd && src_has_alpha && dest_has_alpha) {
+            x = resize_half_row_sse2(out, in_row1, in_row2, dest_width);
+            out += x * 4;
+            in_row1 += x * 8;
+            in_row2 += x * 8;
+        }
+#endif
+        
+        for (; x < dest_width; x++) {
             
             // read first column
             r = *in_row1;    
@@ -640,3 +743,27 @@ resize_half_wrap(PyObject *self, PyObject *args)
     }
     return ret;
 }
+
+/* use_simd([enable]), returns the name of the vector kernels alpha_over and
+ * resize_half use, or None if they use the plain loops. enable turns the
+ * vector kernels on or off, where there are any.
+ */
+PyObject *
+use_simd_wrap(PyObject *self, PyObject *args)
+{
+    PyObject *enable = NULL;
+    
+    if (!PyArg_ParseTuple(args, "|O", &enable))
+        return NULL;
+    
+    if (enable != NULL && SIMD_KERNELS != NULL) {
+        int flag = PyObject_IsTrue(enable);
+        if (flag < 0)
+            return NULL;
+        use_simd = flag;
+    }
+    
+    if (use_simd)
+        return Py_BuildValue("s", SIMD_KERNELS);
+    Py_RETURN_NONE;
+}
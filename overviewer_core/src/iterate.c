@@ -30,6 +30,11 @@ static PyObject *fluid_blocks = NULL;
 static PyObject *nospawn_blocks = NULL;
 static PyObject *nodata_blocks = NULL;
 
+/* sections rendered in this process, and how many of them were skipped
+   because they are hidden behind their neighbours, for get_render_stats */
+static unsigned long sections_rendered = 0;
+static unsigned long sections_skipped = 0;
+
 PyObject *init_chunk_render(void) {
    
     PyObject *tmp = NULL;
@@ -102,6 +107,25 @@ PyObject *init_chunk_render(void) {
     Py_RETURN_NONE;
 }
 
+/* helper for load_chunk_section, returns which of the layers that can hide
+   a neighbouring section (see OPAQUE_BOTTOM and friends) are all opaque */
+static unsigned char get_opaque_layers(PyObject *blocks) {
+    unsigned char layers = OPAQUE_BOTTOM | OPAQUE_X15 | OPAQUE_Z0;
+    int i, j;
+    
+    for (i = 0; i < 16 && layers; i++) {
+        for (j = 0; j < 16 && layers; j++) {
+            if (is_transparent(getArrayShort3D(blocks, i, 0, j)))
+                layers &= ~OPAQUE_BOTTOM;
+            if (is_transparent(getArrayShort3D(blocks, 15, i, j)))
+                layers &= ~OPAQUE_X15;
+            if (is_transparent(getArrayShort3D(blocks, i, j, 0)))
+                layers &= ~OPAQUE_Z0;
+        }
+    }
+    return layers;
+}
+
 /* helper for load_chunk, loads a section into a chunk */
 static inline void load_chunk_section(ChunkData *dest, int i, PyObject *section) {
     dest->sections[i].blocks = PyDict_GetItemString(section, "Blocks");
@@ -112,24 +136,12 @@ static inline void load_chunk_section(ChunkData *dest, int i, PyObject *section)
     Py_INCREF(dest->sections[i].data);
     Py_INCREF(dest->sections[i].skylight);
     Py_INCREF(dest->sections[i].blocklight);
+    dest->sections[i].opaque_layers = get_opaque_layers(dest->sections[i].blocks);
 }
 
-/* loads the given chunk into the chunks[] array in the state
- * returns true on error
- *
- * if required is true, failure to load the chunk will raise a python
- * exception and return true.
- */
-int load_chunk(RenderState* state, int x, int z, unsigned char required) {
-    ChunkData *dest = &(state->chunks[1 + x][1 + z]);
+/* sets every reference in a chunk to NULL */
+static void clear_chunk(ChunkData *dest) {
     int i;
-    PyObject *chunk = NULL;
-    PyObject *sections = NULL;
-    
-    if (dest->loaded)
-        return 0;
-    
-    /* set up reasonable defaults */
     dest->biomes = NULL;
     for (i = 0; i < SECTIONS_PER_CHUNK; i++)
     {
@@ -137,19 +149,35 @@ int load_chunk(RenderState* state, int x, int z, unsigned char required) {
         dest->sections[i].data = NULL;
         dest->sections[i].skylight = NULL;
         dest->sections[i].blocklight = NULL;
+        dest->sections[i].opaque_layers = 0;
     }
-    dest->loaded = 1;
-    
-    x += state->chunkx;
-    z += state->chunkz;
+}
+
+/* releases the references held by a chunk */
+static void release_chunk(ChunkData *dest) {
+    int i;
+    Py_XDECREF(dest->biomes);
+    for (i = 0; i < SECTIONS_PER_CHUNK; i++) {
+        Py_XDECREF(dest->sections[i].blocks);
+        Py_XDECREF(dest->sections[i].data);
+        Py_XDECREF(dest->sections[i].skylight);
+        Py_XDECREF(dest->sections[i].blocklight);
+    }
+}
 
-    chunk = PyObject_CallMethod(state->regionset, "get_chunk", "ii", x, z);
+/* asks the regionset for the chunk at the given absolute coords and fills
+ * in dest, which must be cleared. returns true with a python exception set
+ * on error, leaving dest cleared.
+ */
+static int fetch_chunk(PyObject *regionset, int x, int z, ChunkData *dest) {
+    int i;
+    PyObject *chunk = NULL;
+    PyObject *sections = NULL;
+
+    chunk = PyObject_CallMethod(regionset, "get_chunk", "ii", x, z);
     if (chunk == NULL) {
         // An exception is already set. RegionSet.get_chunk sets
         // ChunkDoesntExist
-        if (!required) {
-            PyErr_Clear();
-        }
         return 1;
     }
 
@@ -160,9 +188,6 @@ int load_chunk(RenderState* state, int x, int z, unsigned char required) {
     if (sections == NULL) {
         // exception set, again
         Py_DECREF(chunk);
-        if (!required) {
-            PyErr_Clear();
-        }
         return 1;
     }
     
@@ -187,20 +212,102 @@ int load_chunk(RenderState* state, int x, int z, unsigned char required) {
     return 0;
 }
 
+/* loads the given chunk into the chunks[] array in the state
+ * returns true on error
+ *
+ * if required is true, failure to load the chunk will raise a python
+ * exception and return true.
+ *
+ * chunks inside the state's chunk cache are only fetched from the regionset
+ * the first time any render_loop call asks for them.
+ */
+int load_chunk(RenderState* state, int x, int z, unsigned char required) {
+    ChunkData *dest = &(state->chunks[1 + x][1 + z]);
+    ChunkCache *cache = state->chunkcache;
+    ChunkData *cached = NULL;
+    int i;
+    
+    if (dest->loaded)
+        return 0;
+    
+    /* set up reasonable defaults */
+    clear_chunk(dest);
+    dest->loaded = 1;
+    
+    x += state->chunkx;
+    z += state->chunkz;
+
+    if (cache && x >= cache->minx && x < cache->minx + cache->width &&
+            z >= cache->minz && z < cache->minz + cache->height) {
+        cached = &(cache->chunks[(x - cache->minx) * cache->height + (z - cache->minz)]);
+    }
+    
+    if (cached && cached->loaded == 0) {
+        if (fetch_chunk(state->regionset, x, z, cached)) {
+            cached->loaded = -1;
+            if (!required) {
+                PyErr_Clear();
+            }
+            return 1;
+        }
+        cached->loaded = 1;
+    }
+    
+    if (cached && cached->loaded > 0) {
+        /* share the cached arrays, unload_all_chunks releases them */
+        *dest = *cached;
+        Py_XINCREF(dest->biomes);
+        for (i = 0; i < SECTIONS_PER_CHUNK; i++) {
+            Py_XINCREF(dest->sections[i].blocks);
+            Py_XINCREF(dest->sections[i].data);
+            Py_XINCREF(dest->sections[i].skylight);
+            Py_XINCREF(dest->sections[i].blocklight);
+        }
+        return 0;
+    }
+    
+    /* a chunk that failed before is only asked for again when the caller
+       needs the error */
+    if (cached && !required)
+        return 1;
+    
+    if (fetch_chunk(state->regionset, x, z, dest)) {
+        if (!required) {
+            PyErr_Clear();
+        }
+        return 1;
+    }
+    
+    return 0;
+}
+
+/* reads the size of the block sprites from the state's textures object
+ * returns true on error, with a python exception set
+ */
+int load_texture_size(RenderState *state) {
+    PyObject *size = PyObject_GetAttrString(state->textures, "texture_size");
+    if (size == NULL)
+        return 1;
+    
+    state->texture_size = PyInt_AsLong(size);
+    Py_DECREF(size);
+    if (state->texture_size == -1 && PyErr_Occurred())
+        return 1;
+    if (state->texture_size < 8 || state->texture_size % 4) {
+        PyErr_SetString(PyExc_ValueError, "texture size must be a multiple of 4, and at least 8");
+        return 1;
+    }
+    return 0;
+}
+
 /* helper to unload all loaded chunks */
 static void
 unload_all_chunks(RenderState *state) {
-    unsigned int i, j, k;
+    unsigned int i, j;
     for (i = 0; i < 3; i++) {
         for (j = 0; j < 3; j++) {
             if (state->chunks[i][j].loaded) {
-                Py_XDECREF(state->chunks[i][j].biomes);
-                for (k = 0; k < SECTIONS_PER_CHUNK; k++) {
-                    Py_XDECREF(state->chunks[i][j].sections[k].blocks);
-                    Py_XDECREF(state->chunks[i][j].sections[k].data);
-                    Py_XDECREF(state->chunks[i][j].sections[k].skylight);
-                    Py_XDECREF(state->chunks[i][j].sections[k].blocklight);
-                }
+                release_chunk(&(state->chunks[i][j]));
                 state->chunks[i][j].loaded = 0;
             }
         }
@@ -574,6 +681,33 @@ generate_pseudo_data(RenderState *state, unsigned short ancilData) {
 }
 
 
+/* returns true if the section being rendered can't be seen at all: the
+ * layers of the sections above it, west of it (x - 1) and south of it (z + 1)
+ * that touch it are all opaque, and all of those are drawn after it. every
+ * block in the section is then covered by blocks drawn later, whatever the
+ * section holds, provided the render mode draws every opaque block.
+ */
+static int section_is_covered(RenderState *state) {
+    int y = state->chunky;
+    
+    if (y + 1 >= SECTIONS_PER_CHUNK ||
+        !(state->chunks[1][1].sections[y + 1].opaque_layers & OPAQUE_BOTTOM))
+        return 0;
+    if (load_chunk(state, -1, 0, 0) ||
+        !(state->chunks[0][1].sections[y].opaque_layers & OPAQUE_X15))
+        return 0;
+    if (load_chunk(state, 0, 1, 0) ||
+        !(state->chunks[1][2].sections[y].opaque_layers & OPAQUE_Z0))
+        return 0;
+    return 1;
+}
+
+PyObject*
+get_render_stats(PyObject *self, PyObject *args) {
+    return Py_BuildValue("{s:k,s:k}", "sections rendered", sections_rendered,
+                         "sections skipped", sections_skipped);
+}
+
 /* TODO triple check this to make sure reference counting is correct */
 PyObject*
 chunk_render(PyObject *self, PyObject *args) {
@@ -593,6 +727,10 @@ chunk_render(PyObject *self, PyObject *args) {
     PyObject *up_right_blocks_py;
 
     RenderMode *rendermode;
+    int own_rendermode;
+    
+    /* the steps between neighbouring blocks on the image */
+    int half, quarter;
     
     int i, j;
 
@@ -601,21 +739,45 @@ chunk_render(PyObject *self, PyObject *args) {
     if (!PyArg_ParseTuple(args, "OOiiiOiiOO",  &state.world, &state.regionset, &state.chunkx, &state.chunky, &state.chunkz, &state.img, &xoff, &yoff, &modeobj, &state.textures))
         return NULL;
     
-    /* set up the render mode */
-    state.rendermode = rendermode = render_mode_create(modeobj, &state);
-    if (rendermode == NULL) {
-        return NULL; // note that render_mode_create will
-                     // set PyErr.  No need to set it here
+    if (load_texture_size(&state))
+        return NULL;
+    
+    /* a chunk cache may be given in place of the regionset */
+    state.chunkcache = NULL;
+    if (PyObject_TypeCheck(state.regionset, &ChunkCacheType)) {
+        state.chunkcache = (ChunkCache *)state.regionset;
+        state.regionset = state.chunkcache->regionset;
+    }
+    
+    /* set up the render mode, unless a prebuilt one was given */
+    if (PyObject_TypeCheck(modeobj, &PyRenderModeType)) {
+        rendermode = ((PyRenderMode *)modeobj)->rendermode;
+        if (rendermode == NULL) {
+            PyErr_SetString(PyExc_RuntimeError, "render mode is not initialized");
+            return NULL;
+        }
+        rendermode->state = &state;
+        own_rendermode = 0;
+    } else {
+        rendermode = render_mode_create(modeobj, &state);
+        if (rendermode == NULL) {
+            return NULL; // note that render_mode_create will
+                         // set PyErr.  No need to set it here
+        }
+        own_rendermode = 1;
     }
+    state.rendermode = rendermode;
 
     /* get the blockmap from the textures object */
     blockmap = PyObject_GetAttrString(state.textures, "blockmap");
     if (blockmap == NULL) {
-        render_mode_destroy(rendermode);
+        if (own_rendermode)
+            render_mode_destroy(rendermode);
         return NULL;
     }
     if (blockmap == Py_None) {
-        render_mode_destroy(rendermode);
+        if (own_rendermode)
+            render_mode_destroy(rendermode);
         PyErr_SetString(PyExc_RuntimeError, "you must call Textures.generate()");
         return NULL;
     }
@@ -641,22 +803,40 @@ chunk_render(PyObject *self, PyObject *args) {
     
     /* get the block data for the center column, erroring out if needed */
     if (load_chunk(&state, 0, 0, 1)) {
-        render_mode_destroy(rendermode);
+        if (own_rendermode)
+            render_mode_destroy(rendermode);
         Py_DECREF(blockmap);
         return NULL;
     }
     if (state.chunks[1][1].sections[state.chunky].blocks == NULL) {
         /* this section doesn't exist, let's skeddadle */
-        render_mode_destroy(rendermode);
+        if (own_rendermode)
+            render_mode_destroy(rendermode);
+        Py_DECREF(blockmap);
+        unload_all_chunks(&state);
+        Py_RETURN_NONE;
+    }
+    
+    sections_rendered++;
+    if (render_mode_draws_all_opaque(rendermode) && section_is_covered(&state)) {
+        /* nothing in this section would make it into the image */
+        sections_skipped++;
+        if (own_rendermode)
+            render_mode_destroy(rendermode);
         Py_DECREF(blockmap);
         unload_all_chunks(&state);
         Py_RETURN_NONE;
     }
     
+    render_mode_start_chunk(rendermode);
+
     /* set blocks_py, state.blocks, and state.blockdatas as convenience */
     blocks_py = state.blocks = state.chunks[1][1].sections[state.chunky].blocks;
     state.blockdatas = state.chunks[1][1].sections[state.chunky].data;
 
+    half = state.texture_size / 2;
+    quarter = state.texture_size / 4;
+
     /* set up the random number generator again for each chunk
        so tallgrass is in the same place, no matter what mode is used */
     srand(1);
@@ -665,14 +845,14 @@ chunk_render(PyObject *self, PyObject *args) {
         for (state.z = 0; state.z < 16; state.z++) {
 
             /* set up the render coordinates */
-            state.imgx = xoff + state.x*12 + state.z*12;
-            /* 16*12 -- offset for y direction, 15*6 -- offset for x */
-            state.imgy = yoff - state.x*6 + state.z*6 + 16*12 + 15*6;
+            state.imgx = xoff + state.x*half + state.z*half;
+            /* 16*half -- offset for y direction, 15*quarter -- offset for x */
+            state.imgy = yoff - state.x*quarter + state.z*quarter + 16*half + 15*quarter;
             
             for (state.y = 0; state.y < 16; state.y++) {
                 unsigned short ancilData;
                 
-                state.imgy -= 12;
+                state.imgy -= half;
 		
                 /* get blockid */
                 state.block = getArrayShort3D(blocks_py, state.x, state.y, state.z);
@@ -681,10 +861,10 @@ chunk_render(PyObject *self, PyObject *args) {
                 }
                 
                 /* make sure we're rendering inside the image boundaries */
-                if ((state.imgx >= imgsize0 + 24) || (state.imgx <= -24)) {
+                if ((state.imgx >= imgsize0 + state.texture_size) || (state.imgx <= -state.texture_size)) {
                     continue;
                 }
-                if ((state.imgy >= imgsize1 + 24) || (state.imgy <= -24)) {
+                if ((state.imgy >= imgsize1 + state.texture_size) || (state.imgy <= -state.texture_size)) {
                     continue;
                 }
                 
@@ -758,8 +938,8 @@ chunk_render(PyObject *self, PyObject *args) {
 
                     if (do_rand) {
                         /* add a random offset to the postion of the tall grass to make it more wild */
-                        randx = rand() % 6 + 1 - 3;
-                        randy = rand() % 6 + 1 - 3;
+                        randx = (rand() % 6 + 1 - 3) * state.texture_size / 24;
+                        randy = (rand() % 6 + 1 - 3) * state.texture_size / 24;
                         state.imgx += randx;
                         state.imgy += randy;
                     }
@@ -777,10 +957,111 @@ chunk_render(PyObject *self, PyObject *args) {
     }
 
     /* free up the rendermode info */
-    render_mode_destroy(rendermode);
+    if (own_rendermode)
+        render_mode_destroy(rendermode);
     
     Py_DECREF(blockmap);
     unload_all_chunks(&state);
 
     Py_RETURN_NONE;
 }
+
+/*
+ * ChunkCache(regionset, minx, minz, maxx, maxz)
+ *
+ * Holds the chunks of regionset with minx <= x <= maxx and minz <= z <= maxz
+ * once they are loaded. Passing it to render_loop in place of the regionset
+ * lets every render_loop call for a tile share the chunks loaded by the
+ * previous ones, instead of each going back through regionset.get_chunk for
+ * its chunk and all the neighbours. Chunks outside the rectangle are still
+ * loaded from the regionset each time.
+ */
+
+static int
+chunk_cache_init(ChunkCache *self, PyObject *args, PyObject *kwargs) {
+    PyObject *regionset;
+    int minx, minz, maxx, maxz;
+    
+    if (!PyArg_ParseTuple(args, "Oiiii", &regionset, &minx, &minz, &maxx, &maxz))
+        return -1;
+    
+    if (maxx < minx || maxz < minz || (long)(maxx - minx + 1) * (maxz - minz + 1) > 65536) {
+        PyErr_SetString(PyExc_ValueError, "invalid chunk cache bounds");
+        return -1;
+    }
+    if (self->chunks) {
+        PyErr_SetString(PyExc_RuntimeError, "chunk cache is already initialized");
+        return -1;
+    }
+    
+    self->minx = minx;
+    self->minz = minz;
+    self->width = maxx - minx + 1;
+    self->height = maxz - minz + 1;
+    /* all zero: nothing is loaded yet */
+    self->chunks = calloc(self->width * self->height, sizeof(ChunkData));
+    if (self->chunks == NULL) {
+        PyErr_NoMemory();
+        return -1;
+    }
+    
+    Py_INCREF(regionset);
+    self->regionset = regionset;
+    return 0;
+}
+
+static void
+chunk_cache_dealloc(ChunkCache *self) {
+    int i;
+    
+    if (self->chunks) {
+        for (i = 0; i < self->width * self->height; i++) {
+            if (self->chunks[i].loaded > 0)
+                release_chunk(&(self->chunks[i]));
+        }
+        free(self->chunks);
+    }
+    Py_XDECREF(self->regionset);
+    Py_TYPE(self)->tp_free((PyObject *)self);
+}
+
+PyTypeObject ChunkCacheType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "c_overviewer.ChunkCache",      /* tp_name */
+    sizeof(ChunkCache),             /* tp_basicsize */
+    0,                              /* tp_itemsize */
+    (destructor)chunk_cache_dealloc, /* tp_dealloc */
+    0,                              /* tp_print */
+    0,                              /* tp_getattr */
+    0,                              /* tp_setattr */
+    0,                              /* tp_compare */
+    0,                              /* tp_repr */
+    0,                              /* tp_as_number */
+    0,                              /* tp_as_sequence */
+    0,                              /* tp_as_mapping */
+    0,                              /* tp_hash */
+    0,                              /* tp_call */
+    0,                              /* tp_str */
+    0,                              /* tp_getattro */
+    0,                              /* tp_setattro */
+    0,                              /* tp_as_buffer */
+    Py_TPFLAGS_DEFAULT,             /* tp_flags */
+    "chunks of a regionset shared between render_loop calls", /* tp_doc */
+    0,                              /* tp_traverse */
+    0,                              /* tp_clear */
+    0,                              /* tp_richcompare */
+    0,                              /* tp_weaklistoffset */
+    0,                              /* tp_iter */
+    0,                              /* tp_iternext */
+    0,                              /* tp_methods */
+    0,                              /* tp_members */
+    0,                              /* tp_getset */
+    0,                              /* tp_base */
+    0,                              /* tp_dict */
+    0,                              /* tp_descr_get */
+    0,                              /* tp_descr_set */
+    0,                              /* tp_dictoffset */
+    (initproc)chunk_cache_init,     /* tp_init */
+    0,                              /* tp_alloc */
+    PyType_GenericNew,              /* tp_new */
+};
@@ -29,9 +29,18 @@ static PyMethodDef COverviewerMethods[] = {
     {"resize_half", resize_half_wrap, METH_VARARGS,
      "downscale image to half size"},
     
+    {"use_simd", use_simd_wrap, METH_VARARGS,
+     "turn the vector kernels of alpha_over and resize_half on or off"},
+    
     {"render_loop", chunk_render, METH_VARARGS,
      "Renders stuffs"},
     
+    {"get_render_stats", get_render_stats, METH_VARARGS,
+     "returns a dict of counts of the sections render_loop was given"},
+    
+    {"nbt_read", nbt_read, METH_VARARGS,
+     "parse uncompressed nbt data into a (name, payload) tuple"},
+    
     {"extension_version", get_extension_version, METH_VARARGS, 
         "Returns the extension version"},
     
@@ -60,5 +69,15 @@ initc_overviewer(void)
         return;
     }
 
+    if (PyType_Ready(&ChunkCacheType) < 0)
+        return;
+    Py_INCREF(&ChunkCacheType);
+    PyModule_AddObject(mod, "ChunkCache", (PyObject *)&ChunkCacheType);
+
+    if (PyType_Ready(&PyRenderModeType) < 0)
+        return;
+    Py_INCREF(&PyRenderModeType);
+    PyModule_AddObject(mod, "RenderMode", (PyObject *)&PyRenderModeType);
+
     init_endian();
 }
@@ -0,0 +1,438 @@
+/*
+ * This file is part of the Minecraft Overviewer.
+ *
+ * Minecraft Overviewer is free software: you can redistribute it and/or
+ * modify it under the terms of the GNU General Public License as published
+ * by the Free Software Foundation, either version 3 of the License, or (at
+ * your option) any later version.
+ *
+ * Minecraft Overviewer is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+ * Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License along
+ * with the Overviewer.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+/*
+ * This file implements a decoder for uncompressed NBT data. It's designed
+ * to be used through nbt.py, which falls back to the pure-python
+ * NBTFileReader if this function is not available. The tree it builds
+ * must match NBTFileReader.read_all() exactly.
+ *
+ * An optional projection (a nested dict of tag names, see nbt.py) limits
+ * which tags are built; everything else is skipped without creating any
+ * python objects for it.
+ */
+
+#include "overviewer.h"
+
+/* deeper than this and we assume the data is garbage */
+#define NBT_MAX_DEPTH 512
+
+enum {
+    TAG_END = 0,
+    TAG_BYTE = 1,
+    TAG_SHORT = 2,
+    TAG_INT = 3,
+    TAG_LONG = 4,
+    TAG_FLOAT = 5,
+    TAG_DOUBLE = 6,
+    TAG_BYTE_ARRAY = 7,
+    TAG_STRING = 8,
+    TAG_LIST = 9,
+    TAG_COMPOUND = 10,
+    TAG_INT_ARRAY = 11,
+};
+
+typedef struct {
+    const unsigned char *data;
+    unsigned int length;
+    unsigned int pos;
+} NBTBuffer;
+
+/* payload sizes of the fixed-size tags, or 0 if the size varies */
+static const unsigned int nbt_tag_sizes[] = {0, 1, 2, 4, 8, 4, 8, 0, 0, 0, 0, 0};
+
+static PyObject *nbt_read_payload(NBTBuffer *buf, unsigned char tagtype, int depth, PyObject *proj);
+
+/* makes sure there are at least n bytes left, sets an error if not */
+static inline int
+nbt_require(NBTBuffer *buf, unsigned int n) {
+    if (buf->length - buf->pos < n) {
+        PyErr_SetString(PyExc_ValueError, "unexpected end of nbt data");
+        return 0;
+    }
+    return 1;
+}
+
+/* these assume nbt_require() has already been checked */
+static inline unsigned short
+nbt_get_ushort(NBTBuffer *buf) {
+    const unsigned char *p = buf->data + buf->pos;
+    buf->pos += 2;
+    return (p[0] << 8) | p[1];
+}
+
+static inline unsigned int
+nbt_get_uint(NBTBuffer *buf) {
+    const unsigned char *p = buf->data + buf->pos;
+    buf->pos += 4;
+    return ((unsigned int)p[0] << 24) | ((unsigned int)p[1] << 16) |
+        ((unsigned int)p[2] << 8) | (unsigned int)p[3];
+}
+
+static inline PY_LONG_LONG
+nbt_get_long(NBTBuffer *buf) {
+    unsigned PY_LONG_LONG hi, lo;
+    hi = nbt_get_uint(buf);
+    lo = nbt_get_uint(buf);
+    return (PY_LONG_LONG)((hi << 32) | lo);
+}
+
+/* reads a string payload, decoded like str.decode("UTF-8") */
+static PyObject *
+nbt_read_string(NBTBuffer *buf) {
+    unsigned short length;
+    PyObject *ret;
+
+    if (!nbt_require(buf, 2))
+        return NULL;
+    length = nbt_get_ushort(buf);
+    if (!nbt_require(buf, length))
+        return NULL;
+
+    ret = PyUnicode_DecodeUTF8((const char *)(buf->data + buf->pos), length, NULL);
+    buf->pos += length;
+    return ret;
+}
+
+/* sets the KeyError the python reader raises for an unknown tag type */
+static void
+nbt_unknown_tag(unsigned char tagtype) {
+    PyObject *key = PyInt_FromLong(tagtype);
+    if (key) {
+        PyErr_SetObject(PyExc_KeyError, key);
+        Py_DECREF(key);
+    }
+}
+
+/* moves past a payload without building anything. returns 0 on error */
+static int
+nbt_skip_payload(NBTBuffer *buf, unsigned char tagtype, int depth) {
+    unsigned int length, i;
+
+    if (depth > NBT_MAX_DEPTH) {
+        PyErr_SetString(PyExc_ValueError, "nbt data is nested too deeply");
+        return 0;
+    }
+
+    switch (tagtype) {
+    case TAG_END:
+        return 1;
+    case TAG_BYTE:
+    case TAG_SHORT:
+    case TAG_INT:
+    case TAG_LONG:
+    case TAG_FLOAT:
+    case TAG_DOUBLE:
+        length = nbt_tag_sizes[tagtype];
+        break;
+    case TAG_BYTE_ARRAY:
+        if (!nbt_require(buf, 4))
+            return 0;
+        length = nbt_get_uint(buf);
+        break;
+    case TAG_INT_ARRAY:
+        if (!nbt_require(buf, 4))
+            return 0;
+        length = nbt_get_uint(buf);
+        if (length > (buf->length - buf->pos) / 4) {
+            PyErr_SetString(PyExc_ValueError, "unexpected end of nbt data");
+            return 0;
+        }
+        length *= 4;
+        break;
+    case TAG_STRING:
+        if (!nbt_require(buf, 2))
+            return 0;
+        length = nbt_get_ushort(buf);
+        break;
+    case TAG_LIST:
+        {
+            unsigned char subtype;
+            if (!nbt_require(buf, 5))
+                return 0;
+            subtype = buf->data[buf->pos++];
+            length = nbt_get_uint(buf);
+            if (subtype <= TAG_DOUBLE) {
+                if (subtype != TAG_END && length > (buf->length - buf->pos) / nbt_tag_sizes[subtype]) {
+                    PyErr_SetString(PyExc_ValueError, "unexpected end of nbt data");
+                    return 0;
+                }
+                length *= nbt_tag_sizes[subtype];
+                break;
+            }
+            for (i = 0; i < length; i++) {
+                if (!nbt_skip_payload(buf, subtype, depth + 1))
+                    return 0;
+            }
+            return 1;
+        }
+    case TAG_COMPOUND:
+        while (1) {
+            unsigned char subtype;
+            if (!nbt_require(buf, 1))
+                return 0;
+            subtype = buf->data[buf->pos++];
+            if (subtype == TAG_END)
+                return 1;
+            if (!nbt_skip_payload(buf, TAG_STRING, depth + 1))
+                return 0;
+            if (!nbt_skip_payload(buf, subtype, depth + 1))
+                return 0;
+        }
+    default:
+        nbt_unknown_tag(tagtype);
+        return 0;
+    }
+
+    if (!nbt_require(buf, length))
+        return 0;
+    buf->pos += length;
+    return 1;
+}
+
+static PyObject *
+nbt_read_list(NBTBuffer *buf, int depth, PyObject *proj) {
+    unsigned char tagtype;
+    unsigned int length, i;
+    PyObject *ret;
+
+    if (!nbt_require(buf, 5))
+        return NULL;
+    tagtype = buf->data[buf->pos++];
+    length = nbt_get_uint(buf);
+
+    /* every tag but TAG_End takes at least one byte, so this catches
+       absurd lengths before we try to allocate them */
+    if (tagtype != TAG_END && !nbt_require(buf, length))
+        return NULL;
+
+    ret = PyList_New(length);
+    if (!ret)
+        return NULL;
+
+    for (i = 0; i < length; i++) {
+        PyObject *item = nbt_read_payload(buf, tagtype, depth + 1, proj);
+        if (!item) {
+            Py_DECREF(ret);
+            return NULL;
+        }
+        PyList_SET_ITEM(ret, i, item);
+    }
+
+    return ret;
+}
+
+static PyObject *
+nbt_read_compound(NBTBuffer *buf, int depth, PyObject *proj) {
+    PyObject *ret = PyDict_New();
+    if (!ret)
+        return NULL;
+
+    while (1) {
+        unsigned char tagtype;
+        PyObject *name, *payload, *subproj = NULL;
+        int err;
+
+        if (!nbt_require(buf, 1))
+            goto error;
+        tagtype = buf->data[buf->pos++];
+        if (tagtype == TAG_END)
+            break;
+
+        name = nbt_read_string(buf);
+        if (!name)
+            goto error;
+
+        if (proj) {
+            /* only tags named in the projection get built */
+            subproj = PyDict_GetItem(proj, name);
+            if (!subproj) {
+                Py_DECREF(name);
+                if (!nbt_skip_payload(buf, tagtype, depth + 1))
+                    goto error;
+                continue;
+            }
+            if (subproj == Py_None)
+                subproj = NULL;
+        }
+
+        payload = nbt_read_payload(buf, tagtype, depth + 1, subproj);
+        if (!payload) {
+            Py_DECREF(name);
+            goto error;
+        }
+
+        err = PyDict_SetItem(ret, name, payload);
+        Py_DECREF(name);
+        Py_DECREF(payload);
+        if (err < 0)
+            goto error;
+    }
+
+    return ret;
+
+ error:
+    Py_DECREF(ret);
+    return NULL;
+}
+
+static PyObject *
+nbt_read_payload(NBTBuffer *buf, unsigned char tagtype, int depth, PyObject *proj) {
+    unsigned int length, i;
+    PyObject *ret;
+
+    if (depth > NBT_MAX_DEPTH) {
+        PyErr_SetString(PyExc_ValueError, "nbt data is nested too deeply");
+        return NULL;
+    }
+
+    switch (tagtype) {
+    case TAG_END:
+        return PyInt_FromLong(0);
+    case TAG_BYTE:
+        if (!nbt_require(buf, 1))
+            return NULL;
+        return PyInt_FromLong((signed char)buf->data[buf->pos++]);
+    case TAG_SHORT:
+        if (!nbt_require(buf, 2))
+            return NULL;
+        return PyInt_FromLong((short)nbt_get_ushort(buf));
+    case TAG_INT:
+        if (!nbt_require(buf, 4))
+            return NULL;
+        return PyInt_FromLong((int)nbt_get_uint(buf));
+    case TAG_LONG:
+        {
+            PY_LONG_LONG value;
+            if (!nbt_require(buf, 8))
+                return NULL;
+            value = nbt_get_long(buf);
+            /* struct gives back ints whenever the value fits */
+            if (value >= LONG_MIN && value <= LONG_MAX)
+                return PyInt_FromLong((long)value);
+            return PyLong_FromLongLong(value);
+        }
+    case TAG_FLOAT:
+        {
+            double value;
+            if (!nbt_require(buf, 4))
+                return NULL;
+            value = _PyFloat_Unpack4(buf->data + buf->pos, 0);
+            buf->pos += 4;
+            if (value == -1.0 && PyErr_Occurred())
+                return NULL;
+            return PyFloat_FromDouble(value);
+        }
+    case TAG_DOUBLE:
+        {
+            double value;
+            if (!nbt_require(buf, 8))
+                return NULL;
+            value = _PyFloat_Unpack8(buf->data + buf->pos, 0);
+            buf->pos += 8;
+            if (value == -1.0 && PyErr_Occurred())
+                return NULL;
+            return PyFloat_FromDouble(value);
+        }
+    case TAG_BYTE_ARRAY:
+        if (!nbt_require(buf, 4))
+            return NULL;
+        length = nbt_get_uint(buf);
+        if (!nbt_require(buf, length))
+            return NULL;
+        ret = PyString_FromStringAndSize((const char *)(buf->data + buf->pos), length);
+        buf->pos += length;
+        return ret;
+    case TAG_STRING:
+        return nbt_read_string(buf);
+    case TAG_LIST:
+        return nbt_read_list(buf, depth, proj);
+    case TAG_COMPOUND:
+        return nbt_read_compound(buf, depth, proj);
+    case TAG_INT_ARRAY:
+        if (!nbt_require(buf, 4))
+            return NULL;
+        length = nbt_get_uint(buf);
+        if (length > (buf->length - buf->pos) / 4) {
+            PyErr_SetString(PyExc_ValueError, "unexpected end of nbt data");
+            return NULL;
+        }
+        ret = PyTuple_New(length);
+        if (!ret)
+            return NULL;
+        for (i = 0; i < length; i++) {
+            PyObject *item = PyInt_FromLong((int)nbt_get_uint(buf));
+            if (!item) {
+                Py_DECREF(ret);
+                return NULL;
+            }
+            PyTuple_SET_ITEM(ret, i, item);
+        }
+        return ret;
+    }
+
+    /* the python reader fails on its tag map lookup here, so match it */
+    nbt_unknown_tag(tagtype);
+    return NULL;
+}
+
+/* takes a string of uncompressed nbt data and an optional projection, and
+   returns (name, payload) for the root compound tag. Malformed data raises
+   ValueError. */
+PyObject *
+nbt_read(PyObject *self, PyObject *args) {
+    const char *data;
+    int length;
+    NBTBuffer buf;
+    PyObject *proj = Py_None;
+    PyObject *name, *payload, *ret;
+
+    if (!PyArg_ParseTuple(args, "s#|O:nbt_read", &data, &length, &proj))
+        return NULL;
+    if (proj == Py_None) {
+        proj = NULL;
+    } else if (!PyDict_Check(proj)) {
+        PyErr_SetString(PyExc_TypeError, "projection must be a dict or None");
+        return NULL;
+    }
+
+    buf.data = (const unsigned char *)data;
+    buf.length = length;
+    buf.pos = 0;
+
+    if (!nbt_require(&buf, 1))
+        return NULL;
+    if (buf.data[buf.pos++] != TAG_COMPOUND) {
+        PyErr_SetString(PyExc_ValueError, "Expected a tag compound");
+        return NULL;
+    }
+
+    name = nbt_read_string(&buf);
+    if (!name)
+        return NULL;
+
+    payload = nbt_read_compound(&buf, 0, proj);
+    if (!payload) {
+        Py_DECREF(name);
+        return NULL;
+    }
+
+    ret = PyTuple_Pack(2, name, payload);
+    Py_DECREF(name);
+    Py_DECREF(payload);
+    return ret;
+}
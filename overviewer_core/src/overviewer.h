@@ -26,7 +26,7 @@
 
 // increment this value if you've made a change to the c extesion
 // and want to force users to rebuild
-#define OVERVIEWER_EXTENSION_VERSION 51
+#define OVERVIEWER_EXTENSION_VERSION 59
 
 /* Python PIL, and numpy headers */
 #include <Python.h>
@@ -73,12 +73,22 @@ PyObject *draw_triangle(PyObject *dest, int inclusive,
                         int tux, int tuy, int *touchups, unsigned int num_touchups);
 PyObject *resize_half(PyObject *dest, PyObject *src);
 PyObject *resize_half_wrap(PyObject *self, PyObject *args);
+PyObject *use_simd_wrap(PyObject *self, PyObject *args);
+
+/* in nbt.c */
+PyObject *nbt_read(PyObject *self, PyObject *args);
 
 /* forward declaration of RenderMode object */
 typedef struct _RenderMode RenderMode;
 
 /* in iterate.c */
 #define SECTIONS_PER_CHUNK 16
+/* bits of opaque_layers: the bottom layer (y = 0), the x = 15 layer and
+   the z = 0 layer, which are the layers that hide the section below, the
+   section at x + 1 and the section at z - 1 from the viewer */
+#define OPAQUE_BOTTOM 1
+#define OPAQUE_X15 2
+#define OPAQUE_Z0 4
 typedef struct {
     /* whether this chunk is loaded: use load_chunk to load */
     int loaded;
@@ -88,12 +98,28 @@ typedef struct {
     struct {
         /* all there is to know about each section */
         PyObject *blocks, *data, *skylight, *blocklight;
+        /* which of the layers below are all opaque blocks, worked out
+           once when the chunk is fetched */
+        unsigned char opaque_layers;
     } sections[SECTIONS_PER_CHUNK];
 } ChunkData;
+/* a rectangle of chunks, loaded on demand and kept across render_loop
+   calls; see ChunkCache in iterate.c */
+typedef struct {
+    PyObject_HEAD
+    PyObject *regionset;
+    int minx, minz, width, height;
+    /* width * height chunks, x-major. loaded is 0 until the chunk is first
+       requested, then 1 if it was loaded or -1 if it could not be */
+    ChunkData *chunks;
+} ChunkCache;
+extern PyTypeObject ChunkCacheType;
 typedef struct {
     /* the regionset object, and chunk coords */
     PyObject *world;
     PyObject *regionset;
+    /* the cache chunks are taken from, or NULL */
+    ChunkCache *chunkcache;
     int chunkx, chunky, chunkz;
     
     /* the tile image and destination */
@@ -103,8 +129,11 @@ typedef struct {
     /* the current render mode in use */
     RenderMode *rendermode;
     
-    /* the Texture object */
+    /* the Texture object, and the size of its block sprites: a block is
+       texture_size / 2 pixels across each side of its top face, and
+       texture_size / 2 pixels high */
     PyObject *textures;
+    int texture_size;
     
     /* the block position and type, and the block array */
     int x, y, z;
@@ -122,7 +151,10 @@ typedef struct {
 PyObject *init_chunk_render(void);
 /* returns true on error, x,z relative */
 int load_chunk(RenderState* state, int x, int z, unsigned char required);
+/* sets state->texture_size from state->textures, returns true on error */
+int load_texture_size(RenderState *state);
 PyObject *chunk_render(PyObject *self, PyObject *args);
+PyObject *get_render_stats(PyObject *self, PyObject *args);
 typedef enum
 {
     KNOWN,
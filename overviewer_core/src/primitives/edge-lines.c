@@ -39,12 +39,13 @@ edge_lines_draw(void *data, RenderState *state, PyObject *src, PyObject *mask, P
         unsigned char ink[] = {0, 0, 0, 255 * self->opacity};
         unsigned short side_block;
         int x = state->x, y = state->y, z = state->z;
+        int half = state->texture_size / 2, quarter = state->texture_size / 4;
 
         int increment=0;
         if ((state->block == 44 || state->block == 126) && ((state->block_data & 0x8) == 0 ))  // half-steps BUT no upsidown half-steps
-            increment=6;
+            increment=quarter;
         else if ((state->block == 78) || (state->block == 93) || (state->block == 94)) // snow, redstone repeaters (on and off)
-            increment=9;
+            increment=state->texture_size * 3 / 8;
         
         /* +X side */
         side_block = get_data(state, BLOCKS, x+1, y, z);
@@ -54,8 +55,8 @@ edge_lines_draw(void *data, RenderState *state, PyObject *src, PyObject *mask, P
             !((state->block == 44 || state->block == 126) && ((side_block == 53) || (side_block == 67) || (side_block == 108) ||
             (side_block == 109) || (side_block == 114) || (side_block == 128) || (side_block == 134) || (side_block == 135) ||
             (side_block == 136)))) {
-            ImagingDrawLine(img_i, state->imgx+12, state->imgy+1+increment, state->imgx+22+1, state->imgy+5+1+increment, &ink, 1);
-            ImagingDrawLine(img_i, state->imgx+12, state->imgy+increment, state->imgx+22+1, state->imgy+5+increment, &ink, 1);
+            ImagingDrawLine(img_i, state->imgx+half, state->imgy+1+increment, state->imgx+2*half-2+1, state->imgy+quarter-1+1+increment, &ink, 1);
+            ImagingDrawLine(img_i, state->imgx+half, state->imgy+increment, state->imgx+2*half-2+1, state->imgy+quarter-1+increment, &ink, 1);
         }
         
         /* -Z side */
@@ -66,8 +67,8 @@ edge_lines_draw(void *data, RenderState *state, PyObject *src, PyObject *mask, P
             !((state->block == 44 || state->block == 126) && ((side_block == 53) || (side_block == 67) || (side_block == 108) ||
             (side_block == 109) || (side_block == 114) || (side_block == 128) || (side_block == 134) || (side_block == 135) ||
             (side_block == 136)))) {
-            ImagingDrawLine(img_i, state->imgx, state->imgy+6+1+increment, state->imgx+12+1, state->imgy+1+increment, &ink, 1);
-            ImagingDrawLine(img_i, state->imgx, state->imgy+6+increment, state->imgx+12+1, state->imgy+increment, &ink, 1);
+            ImagingDrawLine(img_i, state->imgx, state->imgy+quarter+1+increment, state->imgx+half+1, state->imgy+1+increment, &ink, 1);
+            ImagingDrawLine(img_i, state->imgx, state->imgy+quarter+increment, state->imgx+half+1, state->imgy+increment, &ink, 1);
         }
     }
 }
@@ -30,8 +30,10 @@ height_fading_start(void *data, RenderState *state, PyObject *support) {
     if (!render_mode_parse_option(support, "sealevel", "I", &(self->sealevel)))
         return 1;
     
-    self->black_color = PyObject_GetAttrString(support, "black_color");
-    self->white_color = PyObject_GetAttrString(support, "white_color");
+    self->black_color = PyObject_CallMethod(state->textures, "get_color_sprite", "((iiii))", 0, 0, 0, 255);
+    self->white_color = PyObject_CallMethod(state->textures, "get_color_sprite", "((iiii))", 255, 255, 255, 255);
+    if (self->black_color == NULL || self->white_color == NULL)
+        return 1;
     
     return 0;
 }
@@ -258,7 +258,9 @@ lighting_start(void *data, RenderState *state, PyObject *support) {
     if (!render_mode_parse_option(support, "color", "i", &(self->color)))
         return 1;
     
-    self->facemasks_py = PyObject_GetAttrString(support, "facemasks");
+    self->facemasks_py = PyObject_CallMethod(state->textures, "get_face_masks", "");
+    if (self->facemasks_py == NULL)
+        return 1;
     // borrowed references, don't need to be decref'd
     self->facemasks[0] = PyTuple_GetItem(self->facemasks_py, 0);
     self->facemasks[1] = PyTuple_GetItem(self->facemasks_py, 1);
@@ -45,6 +45,15 @@ walk_chunk(RenderState *state, RenderPrimitiveNether *data) {
     data->walked_chunk = 1;
 }
 
+static void
+nether_start_chunk(void *data, RenderState *state) {
+    RenderPrimitiveNether* self = (RenderPrimitiveNether *)data;
+    if (self->walked_chunk) {
+        memset(self->remove_block, 0, sizeof(self->remove_block));
+        self->walked_chunk = 0;
+    }
+}
+
 static int
 nether_hidden(void *data, RenderState *state, int x, int y, int z) {
     RenderPrimitiveNether* self;
@@ -66,4 +75,5 @@ RenderPrimitiveInterface primitive_nether = {
     NULL,
     nether_hidden,
     NULL,
+    nether_start_chunk,
 };
@@ -30,11 +30,19 @@ static void get_color(void *data, RenderState *state,
 static int
 overlay_start(void *data, RenderState *state, PyObject *support) {
     PyObject *opt = NULL;
+    PyObject *facemasks;
     OverlayColor *color = NULL;
     RenderPrimitiveOverlay *self = (RenderPrimitiveOverlay *)data;
     
-    self->facemask_top = PyObject_GetAttrString(support, "facemask_top");
-    self->white_color = PyObject_GetAttrString(support, "whitecolor");
+    facemasks = PyObject_CallMethod(state->textures, "get_face_masks", "");
+    if (facemasks == NULL)
+        return 1;
+    self->facemask_top = PyTuple_GetItem(facemasks, 0);
+    Py_XINCREF(self->facemask_top);
+    Py_DECREF(facemasks);
+    self->white_color = PyObject_CallMethod(state->textures, "get_color_sprite", "((iiii))", 255, 255, 255, 255);
+    if (self->facemask_top == NULL || self->white_color == NULL)
+        return 1;
     self->get_color = get_color;
     
     color = self->color = calloc(1, sizeof(OverlayColor));
@@ -86,9 +94,9 @@ overlay_draw(void *data, RenderState *state, PyObject *src, PyObject *mask, PyOb
     // exactly analogous to edge-line code for these special blocks
     int increment=0;
     if (state->block == 44)  // half-step
-        increment=6;
+        increment=state->texture_size / 4;
     else if (state->block == 78) // snow
-        increment=9;
+        increment=state->texture_size * 3 / 8;
     
     /* skip rendering the overlay if we can't see it */
     top_block = get_data(state, BLOCKS, state->x, state->y+1, state->z);
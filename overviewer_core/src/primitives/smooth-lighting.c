@@ -22,11 +22,17 @@
 typedef struct {
     /* inherits from lighting */
     RenderPrimitiveLighting parent;
+    
+    /* pairs of (x,y) touch-up points on the top face for the sprite size,
+       pulled from textures.py (_touchup_points) */
+    int *touchups;
+    unsigned int num_touchups;
 } RenderPrimitiveSmoothLighting;
 
 /* structure representing one corner of a face (see below) */
 struct SmoothLightingCorner {
-    /* where this corner shows up on each block texture */
+    /* where this corner shows up on each block texture, for 24 pixel
+       sprites */
     int imgx, imgy;
     
     /* the two block offsets that (together) determine the 4 blocks to use */
@@ -43,14 +49,10 @@ struct SmoothLightingFace {
     /* the points that form the corners of this face */
     struct SmoothLightingCorner corners[4];
     
-    /* pairs of (x,y) in order, as touch-up points, or NULL for none */
-    int *touch_up_points;
-    unsigned int num_touch_up_points;
+    /* whether the top face touch-up points are drawn */
+    int touch_up;
 };
 
-/* top face touchups, pulled from textures.py (_build_block) */
-static int top_touchups[] = {3, 4, 7, 2, 11, 0};
-
 /* the lighting face rule list! */
 static struct SmoothLightingFace lighting_rules[] = {
     /* since this is getting a little insane, here's the general layout:
@@ -62,7 +64,7 @@ static struct SmoothLightingFace lighting_rules[] = {
              x2, y2, z2}, // blocks neighboring this corner
             // ...
         },
-     {x, y, x, y}, 2}, // touch-up points, and how many there are (may be NULL)
+     1}, // whether to draw the touch-up points
      
     // ...
     
@@ -83,7 +85,7 @@ static struct SmoothLightingFace lighting_rules[] = {
              -1, 0, 0,
              0, 0, 1},
         },
-     top_touchups, 3},
+     1},
     
     /* left */
     {-1, 0, 0, {
@@ -100,7 +102,7 @@ static struct SmoothLightingFace lighting_rules[] = {
              0, 0, 1,
              0, -1, 0},
         },
-     NULL, 0},
+     0},
     
     /* right */
     {0, 0, 1, {
@@ -117,7 +119,7 @@ static struct SmoothLightingFace lighting_rules[] = {
              1, 0, 0,
              0, -1, 0},
         },
-     NULL, 0},
+     0},
 };
 
 /* helpers for indexing the rule list */
@@ -133,6 +135,7 @@ do_shading_with_rule(RenderPrimitiveSmoothLighting *self, RenderState *state, st
     int i;
     RenderPrimitiveLighting *lighting = (RenderPrimitiveLighting *)self;
     int x = state->imgx, y = state->imgy;
+    int size = state->texture_size;
     struct SmoothLightingCorner *pts = face.corners;
     float comp_shade_strength = 1.0 - lighting->strength;
     unsigned char pts_r[4] = {0, 0, 0, 0};
@@ -181,31 +184,49 @@ do_shading_with_rule(RenderPrimitiveSmoothLighting *self, RenderState *state, st
         pts_b[i] = bgather / 4;
     }
     
-    /* draw the face */
+    /* draw the face, with the corners scaled to the sprite size */
     draw_triangle(state->img, 1,
-                  x+pts[0].imgx, y+pts[0].imgy, pts_r[0], pts_g[0], pts_b[0],
-                  x+pts[1].imgx, y+pts[1].imgy, pts_r[1], pts_g[1], pts_b[1],
-                  x+pts[2].imgx, y+pts[2].imgy, pts_r[2], pts_g[2], pts_b[2],
-                  x, y, face.touch_up_points, face.num_touch_up_points);
+                  x+pts[0].imgx*size/24, y+pts[0].imgy*size/24, pts_r[0], pts_g[0], pts_b[0],
+                  x+pts[1].imgx*size/24, y+pts[1].imgy*size/24, pts_r[1], pts_g[1], pts_b[1],
+                  x+pts[2].imgx*size/24, y+pts[2].imgy*size/24, pts_r[2], pts_g[2], pts_b[2],
+                  x, y, face.touch_up ? self->touchups : NULL, face.touch_up ? self->num_touchups : 0);
     draw_triangle(state->img, 0,
-                  x+pts[0].imgx, y+pts[0].imgy, pts_r[0], pts_g[0], pts_b[0],
-                  x+pts[2].imgx, y+pts[2].imgy, pts_r[2], pts_g[2], pts_b[2],
-                  x+pts[3].imgx, y+pts[3].imgy, pts_r[3], pts_g[3], pts_b[3],
+                  x+pts[0].imgx*size/24, y+pts[0].imgy*size/24, pts_r[0], pts_g[0], pts_b[0],
+                  x+pts[2].imgx*size/24, y+pts[2].imgy*size/24, pts_r[2], pts_g[2], pts_b[2],
+                  x+pts[3].imgx*size/24, y+pts[3].imgy*size/24, pts_r[3], pts_g[3], pts_b[3],
                   x, y, NULL, 0);
 }
 
 static int
 smooth_lighting_start(void *data, RenderState *state, PyObject *support) {
+    RenderPrimitiveSmoothLighting *self = (RenderPrimitiveSmoothLighting *)data;
+    unsigned int i;
+    
     /* first, chain up */
     int ret = primitive_lighting.start(data, state, support);
     if (ret != 0)
-        return ret;    
+        return ret;
+    
+    /* the pixels along the upper left edge of the top face that the
+       shearing leaves out, every 4 pixels */
+    self->num_touchups = (state->texture_size + 4) / 8;
+    self->touchups = calloc(2 * self->num_touchups, sizeof(int));
+    if (self->touchups == NULL) {
+        primitive_lighting.finish(data, state);
+        return 1;
+    }
+    for (i = 0; i < self->num_touchups; i++) {
+        self->touchups[2 * i] = state->texture_size / 2 - 1 - 4 * i;
+        self->touchups[2 * i + 1] = 2 * i;
+    }
     return 0;
 }
 
 static void
 smooth_lighting_finish(void *data, RenderState *state) {
-    /* nothing special to do */
+    RenderPrimitiveSmoothLighting *self = (RenderPrimitiveSmoothLighting *)data;
+    
+    free(self->touchups);
     primitive_lighting.finish(data, state);
 }
 
@@ -159,6 +159,31 @@ int render_mode_hidden(RenderMode *self, int x, int y, int z) {
     return hidden;
 }
 
+/* returns true if every opaque block is drawn as is: the mode has the base
+   primitive, and no primitive hides any blocks */
+int render_mode_draws_all_opaque(RenderMode *self) {
+    unsigned int i;
+    int has_base = 0;
+    for (i = 0; i < self->num_primitives; i++) {
+        RenderPrimitive *prim = self->primitives[i];
+        if (prim->iface->hidden)
+            return 0;
+        if (prim->iface == &primitive_base)
+            has_base = 1;
+    }
+    return has_base;
+}
+
+void render_mode_start_chunk(RenderMode *self) {
+    unsigned int i;
+    for (i = 0; i < self->num_primitives; i++) {
+        RenderPrimitive *prim = self->primitives[i];
+        if (prim->iface->start_chunk) {
+            prim->iface->start_chunk(prim->primitive, self->state);
+        }
+    }
+}
+
 void render_mode_draw(RenderMode *self, PyObject *img, PyObject *mask, PyObject *mask_light) {
     unsigned int i;
     for (i = 0; i < self->num_primitives; i++) {
@@ -169,6 +194,94 @@ void render_mode_draw(RenderMode *self, PyObject *img, PyObject *mask, PyObject
     }
 }
 
+/*
+ * RenderMode(mode, world, textures)
+ *
+ * Builds the render mode for the given list of primitives once, running
+ * every primitive's start function, so render_loop doesn't have to create
+ * and destroy it again for each chunk section it renders. The primitives
+ * only look at the world and textures when starting, so the result can be
+ * used with any chunk of that world rendered with those textures. Anything
+ * a primitive keeps about the section it's rendering is reset by its
+ * start_chunk function.
+ */
+
+static int
+py_render_mode_init(PyRenderMode *self, PyObject *args, PyObject *kwargs) {
+    RenderState state;
+    PyObject *mode;
+    
+    memset(&state, 0, sizeof(RenderState));
+    if (!PyArg_ParseTuple(args, "OOO", &mode, &state.world, &state.textures))
+        return -1;
+    
+    if (self->rendermode) {
+        PyErr_SetString(PyExc_RuntimeError, "render mode is already initialized");
+        return -1;
+    }
+    if (load_texture_size(&state))
+        return -1;
+    
+    self->rendermode = render_mode_create(mode, &state);
+    if (self->rendermode == NULL)
+        return -1;
+    /* render_loop points this at its own state for each call */
+    self->rendermode->state = NULL;
+    
+    Py_INCREF(mode);
+    self->mode = mode;
+    return 0;
+}
+
+static void
+py_render_mode_dealloc(PyRenderMode *self) {
+    if (self->rendermode)
+        render_mode_destroy(self->rendermode);
+    Py_XDECREF(self->mode);
+    Py_TYPE(self)->tp_free((PyObject *)self);
+}
+
+PyTypeObject PyRenderModeType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "c_overviewer.RenderMode",      /* tp_name */
+    sizeof(PyRenderMode),           /* tp_basicsize */
+    0,                              /* tp_itemsize */
+    (destructor)py_render_mode_dealloc, /* tp_dealloc */
+    0,                              /* tp_print */
+    0,                              /* tp_getattr */
+    0,                              /* tp_setattr */
+    0,                              /* tp_compare */
+    0,                              /* tp_repr */
+    0,                              /* tp_as_number */
+    0,                              /* tp_as_sequence */
+    0,                              /* tp_as_mapping */
+    0,                              /* tp_hash */
+    0,                              /* tp_call */
+    0,                              /* tp_str */
+    0,                              /* tp_getattro */
+    0,                              /* tp_setattro */
+    0,                              /* tp_as_buffer */
+    Py_TPFLAGS_DEFAULT,             /* tp_flags */
+    "a render mode built once for many render_loop calls", /* tp_doc */
+    0,                              /* tp_traverse */
+    0,                              /* tp_clear */
+    0,                              /* tp_richcompare */
+    0,                              /* tp_weaklistoffset */
+    0,                              /* tp_iter */
+    0,                              /* tp_iternext */
+    0,                              /* tp_methods */
+    0,                              /* tp_members */
+    0,                              /* tp_getset */
+    0,                              /* tp_base */
+    0,                              /* tp_dict */
+    0,                              /* tp_descr_get */
+    0,                              /* tp_descr_set */
+    0,                              /* tp_dictoffset */
+    (initproc)py_render_mode_init,  /* tp_init */
+    0,                              /* tp_alloc */
+    PyType_GenericNew,              /* tp_new */
+};
+
 /* options parse helper */
 int render_mode_parse_option(PyObject *support, const char *name, const char *format, ...) {
     va_list ap;
@@ -61,6 +61,10 @@ typedef struct {
     int (*hidden)(void *, RenderState *, int, int, int);
     /* last two arguments are img and mask, from texture lookup */
     void (*draw)(void *, RenderState *, PyObject *, PyObject *, PyObject *);
+    /* called before each chunk section is rendered, to forget anything the
+     * primitive worked out for the previous one. A RenderMode is used for
+     * many sections, see py_render_mode_init() */
+    void (*start_chunk)(void *, RenderState *);
 } RenderPrimitiveInterface;
 
 /* A quick note about the difference between occluded and hidden:
@@ -96,7 +100,19 @@ RenderMode *render_mode_create(PyObject *mode, RenderState *state);
 void render_mode_destroy(RenderMode *self);
 int render_mode_occluded(RenderMode *self, int x, int y, int z);
 int render_mode_hidden(RenderMode *self, int x, int y, int z);
+int render_mode_draws_all_opaque(RenderMode *self);
 void render_mode_draw(RenderMode *self, PyObject *img, PyObject *mask, PyObject *mask_light);
+void render_mode_start_chunk(RenderMode *self);
+
+/* a python wrapper around a RenderMode, so one can be built once and then
+   given to any number of render_loop calls in place of the mode list */
+typedef struct {
+    PyObject_HEAD
+    RenderMode *rendermode;
+    /* the mode list the rendermode was built from */
+    PyObject *mode;
+} PyRenderMode;
+extern PyTypeObject PyRenderModeType;
 
 /* helper function for reading in rendermode options
    works like PyArg_ParseTuple on a support object */
@@ -25,8 +25,17 @@ import numpy
 from PIL import Image, ImageEnhance, ImageOps, ImageDraw
 import logging
 import functools
+import mmap
+import struct
+import tempfile
+import atexit
+import cPickle as pickle
+import hashlib
+import multiprocessing
 
 import util
+import c_overviewer
+from files import FileReplacer
 from c_overviewer import alpha_over
 
 class TextureException(Exception):
@@ -37,22 +46,108 @@ class TextureException(Exception):
 color_map = ["white", "orange", "magenta", "light_blue", "yellow", "lime", "pink", "gray",
              "silver", "cyan", "purple", "blue", "brown", "green", "red", "black"]
 
+# atlas files start with this, followed by the length of the pickled index
+# of the images in them, the index, and the image data
+_atlas_magic = "OVERVIEWER-ATLAS-1"
+
+# maps the path of every atlas loaded in this process to its (biome grass
+# texture, blockmap)
+_atlases = {}
+
+def _get_file_stamp(path):
+    # the modification time and size of a file, or None if it's gone
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size)
+
+_generator_version = None
+def _get_generator_version():
+    # a hash of this module's source, standing in for the version of the
+    # code that generates the block sprites
+    global _generator_version
+    if _generator_version is None:
+        path = os.path.splitext(__file__)[0] + ".py"
+        if not os.path.isfile(path):
+            path = __file__
+        try:
+            with open(path, "rb") as f:
+                _generator_version = hashlib.sha1(f.read()).hexdigest()
+        except IOError:
+            # frozen builds have no source to hash
+            _generator_version = util.findGitVersion()
+    return _generator_version
+
+def get_default_cache_dir():
+    """Returns the directory generated textures are cached in between runs,
+    inside the user's cache directory."""
+    if sys.platform.startswith("win") and "LOCALAPPDATA" in os.environ:
+        base = os.environ["LOCALAPPDATA"]
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "overviewer", "textures")
+
+# the Textures object generating blocks in a pool process
+_pool_textures = None
+
+def _init_generator_pool(textures):
+    global _pool_textures
+    _pool_textures = textures
+    # resource packs and jars opened before the fork can't be read from
+    # several processes, they'd mix up the file position
+    textures.jar = None
+    textures.reset_file_index()
+
+def _generate_blocks(keys):
+    # generates the block sprites for the given (blockid, data) keys in a
+    # pool process. Returns their blockmap indexes and sprites, and the
+    # texture files they were made from
+    textures = _pool_textures
+    textures.sources = set()
+    results = []
+    for blockid, data in keys:
+        results.append((blockid * max_data + data, textures.generate_block(blockid, data)))
+    return results, textures.sources
+
+def _touchup_points(size):
+    # the pixels the shearing leaves out of a block sprite of the given size,
+    # on the upper left edge of the top face and the lower edge of the right
+    # face. They are filled in from their neighbour towards the middle
+    top = [(size // 2 - 1 - 4 * i, 2 * i) for i in xrange((size + 4) // 8)]
+    right = [(size // 2 + 1 + 4 * i, size - 1 - 2 * i) for i in xrange((size + 4) // 8)]
+    return top, right
+
+def _remove_atlas(path, pid):
+    # only the process that wrote the atlas removes it
+    if os.getpid() == pid:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
 ##
 ## Textures object
 ##
 class Textures(object):
     """An object that generates a set of block sprites to use while
-    rendering. It accepts a background color, north direction, and
-    local textures path.
+    rendering. It accepts a background color, north direction, local
+    textures path and the size of the block sprites, which must be a
+    multiple of 4.
     """
-    def __init__(self, texturepath=None, bgcolor=(26, 26, 26, 0), northdirection=0):
+    def __init__(self, texturepath=None, bgcolor=(26, 26, 26, 0), northdirection=0, texturesize=24):
+        if texturesize < 8 or texturesize % 4:
+            raise ValueError("texture size must be a multiple of 4, and at least 8")
         self.bgcolor = bgcolor
         self.rotation = northdirection
         self.find_file_local_path = texturepath
         
-        # not yet configurable
-        self.texture_size = 24
+        self.texture_size = texturesize
         self.texture_dimensions = (self.texture_size, self.texture_size)
+
+        # the size the build_* functions draw at. Generators that are not
+        # scalable still draw at 24 pixels, see generate_block()
+        self.sprite_size = self.texture_size
         
         # this is set in in generate()
         self.generated = False
@@ -60,18 +155,33 @@ class Textures(object):
         # see load_image_texture()
         self.texture_cache = {}
 
+        # every file find_file() found a texture in, the resource pack or
+        # jar for textures inside one
+        self.sources = set()
+
         # once we find a jarfile that contains a texture, we cache the ZipFile object here
         self.jar = None
         self.jarpath = ""
+
+        # the index find_file() builds as it goes, see reset_file_index()
+        self.reset_file_index()
+
+        # the atlas file our copies in other processes load the block
+        # sprites from, see share_atlas()
+        self.atlas_path = None
     
     ##
     ## pickle support
     ##
     
     def __getstate__(self):
-        # we must get rid of the huge image lists, and other images
+        # we must get rid of the huge image lists, and other images. The
+        # block sprites are handed over through an atlas file instead
+        if self.generated and self.atlas_path is None:
+            self.share_atlas()
         attributes = self.__dict__.copy()
-        for attr in ['blockmap', 'biome_grass_texture', 'watertexture', 'lavatexture', 'firetexture', 'portaltexture', 'lightcolor', 'grasscolor', 'foliagecolor', 'watercolor', 'texture_cache']:
+        for attr in ['blockmap', 'biome_grass_texture', 'watertexture', 'lavatexture', 'firetexture', 'portaltexture', 'lightcolor', 'grasscolor', 'foliagecolor', 'watercolor', 'texture_cache',
+                     '_found_files', '_dir_listings', '_zips', '_client_jar', '_face_masks']:
             try:
                 del attributes[attr]
             except KeyError:
@@ -82,14 +192,116 @@ class Textures(object):
         for attr, val in attrs.iteritems():
             setattr(self, attr, val)
         self.texture_cache = {}
-        if self.generated:
+        self.reset_file_index()
+        if self.generated and not self.load_atlas(self.atlas_path):
             self.generate()
+
+    ##
+    ## Atlas files: the block sprites, all in one file
+    ##
+
+    def save_atlas(self, path):
+        """Writes the generated block sprites and their opaque masks, and
+        the biome grass texture, to a single atlas file at path. See
+        load_atlas()."""
+        data = []
+        # offset of the next image from the start of the image data
+        offset = [0]
+        def add(img):
+            entry = (img.mode, img.size, offset[0])
+            raw = img.tobytes()
+            data.append(raw)
+            offset[0] += len(raw)
+            return entry
+
+        grass = add(self.biome_grass_texture)
+        blocks = []
+        for i, tex in enumerate(self.blockmap):
+            if tex is not None:
+                blocks.append((i, add(tex[0]), add(tex[1])))
+        # the directories a texture file could be added to, to stand in for
+        # one found further down the search, count as sources too
+        sources = [(source, _get_file_stamp(source))
+                   for source in sorted(self.sources.union(self.get_override_dirs()))]
+        index = pickle.dumps((len(self.blockmap), grass, blocks, sources), 2)
+
+        with FileReplacer(path) as tmppath:
+            with open(tmppath, "wb") as f:
+                f.write(_atlas_magic + struct.pack(">I", len(index)) + index)
+                for raw in data:
+                    f.write(raw)
+
+    def load_atlas(self, path):
+        """Replaces the block sprites with those in the atlas file at path,
+        written by save_atlas(). Returns False if there is no usable atlas
+        there, or if any of the texture files it was made from changed.
+
+        The images aren't read in, but mapped copy-on-write straight from
+        the file, so every process using the atlas shares one copy of them.
+        An atlas is only mapped once per process.
+        """
+        if path is None:
+            return False
+        atlas = _atlases.get(path)
+        if atlas is None:
+            try:
+                with open(path, "rb") as f:
+                    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+                header = len(_atlas_magic) + 4
+                if data[:len(_atlas_magic)] != _atlas_magic:
+                    return False
+                length, = struct.unpack(">I", data[len(_atlas_magic):header])
+                size, grass, blocks, sources = pickle.loads(data[header:header + length])
+            except (IOError, OSError, ValueError, struct.error, pickle.UnpicklingError, EOFError):
+                return False
+            for source, stamp in sources:
+                if _get_file_stamp(source) != stamp:
+                    return False
+
+            def get(entry):
+                mode, imgsize, offset = entry
+                start = header + length + offset
+                nbytes = imgsize[0] * imgsize[1] * len(mode)
+                return Image.frombuffer(mode, imgsize, buffer(data, start, nbytes), "raw", mode, 0, 1)
+
+            blockmap = [None] * size
+            for i, img, mask in blocks:
+                blockmap[i] = (get(img), get(mask))
+            atlas = _atlases[path] = (get(grass), blockmap, set(source for source, stamp in sources))
+
+        self.biome_grass_texture, self.blockmap, sources = atlas
+        self.sources = set(sources)
+        return True
+
+    def share_atlas(self):
+        """Saves the block sprites to a temporary atlas file, removed when
+        this process exits, and remembers it so that copies of this object
+        made by pickling load it instead of generating everything again."""
+        fd, path = tempfile.mkstemp(prefix="overviewer-", suffix=".atlas")
+        os.close(fd)
+        self.save_atlas(path)
+        atexit.register(_remove_atlas, path, os.getpid())
+        self.atlas_path = path
     
     ##
     ## The big one: generate()
     ##
     
-    def generate(self):
+    def generate(self, cachedir=None, processes=1):
+        """Generates the block sprites. If cachedir is given, they're
+        loaded from an atlas file there instead if one was saved for the
+        same options and texture files, and saved there otherwise.
+
+        With more than one process (or a negative number, for one per
+        CPU), the blocks are split up between a pool of processes.
+        """
+        if cachedir:
+            cachepath = os.path.join(cachedir, "textures-%s.atlas" % self.get_cache_key())
+            if self.load_atlas(cachepath):
+                logging.debug("Loaded textures from %s", cachepath)
+                self.atlas_path = cachepath
+                self.generated = True
+                return
         
         # generate biome grass mask
         self.biome_grass_texture = self.build_block(self.load_image_texture("assets/minecraft/textures/blocks/grass_top.png"), self.load_image_texture("assets/minecraft/textures/blocks/grass_side_overlay.png"))
@@ -99,27 +311,87 @@ class Textures(object):
         global known_blocks, used_datas
         self.blockmap = [None] * max_blockid * max_data
         
-        for (blockid, data), texgen in blockmap_generators.iteritems():
-            tex = texgen(self, blockid, data)
-            self.blockmap[blockid * max_data + data] = self.generate_texture_tuple(tex)
-        
-        if self.texture_size != 24:
-            # rescale biome grass
-            self.biome_grass_texture = self.biome_grass_texture.resize(self.texture_dimensions, Image.ANTIALIAS)
-            
-            # rescale the rest
-            for i, tex in enumerate(blockmap):
-                if tex is None:
-                    continue
-                block = tex[0]
-                scaled_block = block.resize(self.texture_dimensions, Image.ANTIALIAS)
-                blockmap[i] = self.generate_texture_tuple(scaled_block)
+        if processes < 0:
+            processes = multiprocessing.cpu_count()
+        if processes > 1:
+            # hand out runs of neighbouring blocks, so each process gets to
+            # reuse the textures in its texture_cache a lot
+            keys = sorted(blockmap_generators.iterkeys())
+            step = len(keys) // (processes * 4) + 1
+            pool = multiprocessing.Pool(processes, _init_generator_pool, (self,))
+            try:
+                for results, sources in pool.imap_unordered(_generate_blocks, [keys[i:i + step] for i in xrange(0, len(keys), step)]):
+                    for i, tex in results:
+                        self.blockmap[i] = tex
+                    self.sources.update(sources)
+            finally:
+                pool.terminate()
+        else:
+            for blockid, data in blockmap_generators.iterkeys():
+                self.blockmap[blockid * max_data + data] = self.generate_block(blockid, data)
         
         self.generated = True
+
+        if cachedir:
+            try:
+                if not os.path.isdir(cachedir):
+                    os.makedirs(cachedir)
+                self.save_atlas(cachepath)
+                self.atlas_path = cachepath
+            except (IOError, OSError), e:
+                logging.warning("Could not save the textures to the cache at %s: %s", cachedir, e)
+
+    def generate_block(self, blockid, data):
+        """Returns the blockmap entry for the given block: its sprite and
+        opaque mask, or None."""
+        generator = blockmap_generators[(blockid, data)]
+        if generator.scalable or self.texture_size == 24:
+            return self.generate_texture_tuple(generator(self, blockid, data))
+
+        # this one places things at fixed 24 pixel positions, so it is drawn
+        # at that size and then scaled
+        self.sprite_size = 24
+        try:
+            tex = generator(self, blockid, data)
+        finally:
+            self.sprite_size = self.texture_size
+        if tex is not None:
+            tex = tex.resize(self.texture_dimensions, Image.ANTIALIAS)
+        return self.generate_texture_tuple(tex)
+
+    def get_cache_key(self):
+        """Returns a hash of everything that goes into generating the block
+        sprites, besides the contents of the texture files: the code
+        generating them, the options given to this object, and the client
+        jar that would be searched for textures."""
+        key = hashlib.sha1()
+        for data in (_get_generator_version(), c_overviewer.extension_version(),
+                     self.find_file_local_path and os.path.abspath(self.find_file_local_path),
+                     self.find_client_jar(), self.bgcolor, self.rotation, self.texture_size):
+            key.update(repr(data))
+        return key.hexdigest()
     
     ##
     ## Helpers for opening textures
     ##
+
+    # a list of subdirectories find_file() searches for a given file, after
+    # the obvious '.'
+    search_dirs = ['anim', 'misc', 'environment', 'item', 'item/chests', 'entity', 'entity/chest']
+
+    def get_override_dirs(self):
+        """Returns the directories find_file() looks in for texture files
+        before it looks in the client jar: the texture path, the program dir
+        and, on Darwin, /Applications/Minecraft, with their subdirectories in
+        search_dirs. A file added to any of them takes the place of one from
+        the jar or the bundled textures."""
+        bases = []
+        if self.find_file_local_path and os.path.isdir(self.find_file_local_path):
+            bases.append(self.find_file_local_path)
+        bases.append(util.get_program_path())
+        if sys.platform.startswith("darwin"):
+            bases.append("/Applications/Minecraft")
+        return [os.path.abspath(os.path.join(base, d)) for base in bases for d in [''] + self.search_dirs]
     
     def find_file(self, filename, mode="rb", verbose=False):
         """Searches for the given file and returns an open handle to it.
@@ -147,15 +419,19 @@ class Textures(object):
         """
         if verbose: logging.info("Starting search for {0}".format(filename))
 
-        # a list of subdirectories to search for a given file,
-        # after the obvious '.'
-        search_dirs = ['anim', 'misc', 'environment', 'item', 'item/chests', 'entity', 'entity/chest']
+        # we've found this one before
+        found = self._found_files.get(filename)
+        if found:
+            if verbose: logging.info("Found (cached) %s in '%s'", filename, found[0])
+            return self._open_found(filename, found[0], found[1], mode)
+
+        search_dirs = self.search_dirs
         search_zip_paths = [filename,] + [d + '/' + filename for d in search_dirs]
         def search_dir(base):
             """Search the given base dir for filename, in search_dirs."""
             for path in [os.path.join(base, d, filename) for d in ['',] + search_dirs]:
                 if verbose: logging.info('filename: ' + filename + ' ; path: ' + path)
-                if os.path.isfile(path):
+                if self._isfile(path):
                     return path
 
             return None
@@ -168,19 +444,19 @@ class Textures(object):
                 path = search_dir(self.find_file_local_path)
                 if path:
                     if verbose: logging.info("Found %s in '%s'", filename, path)
-                    return open(path, mode)
+                    return self._open_found(filename, path, None, mode)
             elif os.path.isfile(self.find_file_local_path):
                 # Must be a resource pack. Look for the requested file within
                 # it.
                 try:
-                    pack = zipfile.ZipFile(self.find_file_local_path)
+                    pack = self._open_zip(self.find_file_local_path)
                     for packfilename in search_zip_paths:
                         try:
                             # pack.getinfo() will raise KeyError if the file is
                             # not found.
                             pack.getinfo(packfilename)
                             if verbose: logging.info("Found %s in '%s'", packfilename, self.find_file_local_path)
-                            return pack.open(packfilename)
+                            return self._open_found(filename, self.find_file_local_path, packfilename, mode)
                         except (KeyError, IOError):
                             pass
                         
@@ -189,7 +465,7 @@ class Textures(object):
                             packfilename = 'assets/minecraft/textures/' + packfilename
                             pack.getinfo(packfilename)
                             if verbose: logging.info("Found %s in '%s'", packfilename, self.find_file_local_path)
-                            return pack.open(packfilename)
+                            return self._open_found(filename, self.find_file_local_path, packfilename, mode)
                         except (KeyError, IOError):
                             pass
                 except (zipfile.BadZipfile, IOError):
@@ -205,13 +481,13 @@ class Textures(object):
         path = search_dir(programdir)
         if path:
             if verbose: logging.info("Found %s in '%s'", filename, path)
-            return open(path, mode)
+            return self._open_found(filename, path, None, mode)
 
         if sys.platform.startswith("darwin"):
             path = search_dir("/Applications/Minecraft")
             if path:
                 if verbose: logging.info("Found %s in '%s'", filename, path)
-                return open(path, mode)
+                return self._open_found(filename, path, None, mode)
 
         if verbose: logging.info("Did not find the file in overviewer executable directory")
         if verbose: logging.info("Looking for installed minecraft jar files...")
@@ -223,12 +499,98 @@ class Textures(object):
                 try:
                     self.jar.getinfo(jarfilename)
                     if verbose: logging.info("Found (cached) %s in '%s'", jarfilename, self.jarpath)
-                    return self.jar.open(jarfilename)
+                    return self._open_found(filename, self.jarpath, jarfilename, mode)
                 except (KeyError, IOError), e:
                     pass
 
         # Find an installed minecraft client jar and look in it for the texture
         # file we need.
+        if self._client_jar is None:
+            self._client_jar = (self.find_client_jar(verbose),)
+        jarpath, = self._client_jar
+        if jarpath:
+            if os.path.isfile(jarpath):
+                jar = self._open_zip(jarpath)
+                for jarfilename in search_zip_paths:
+                    try:
+                        jar.getinfo(jarfilename)
+                        if verbose: logging.info("Found %s in '%s'", jarfilename, jarpath)
+                        self.jar, self.jarpath = jar, jarpath
+                        return self._open_found(filename, jarpath, jarfilename, mode)
+                    except (KeyError, IOError), e:
+                        pass
+
+            if verbose: logging.info("Did not find file {0} in jar {1}".format(filename, jarpath))
+            
+        # Last ditch effort: look for the file is stored in with the overviewer
+        # installation. We include a few files that aren't included with Minecraft
+        # textures. This used to be for things such as water and lava, since
+        # they were generated by the game and not stored as images. Nowdays I
+        # believe that's not true, but we still have a few files distributed
+        # with overviewer.
+        if verbose: logging.info("Looking for texture in overviewer_core/data/textures")
+        path = search_dir(os.path.join(programdir, "overviewer_core", "data", "textures"))
+        if path:
+            if verbose: logging.info("Found %s in '%s'", filename, path)
+            return self._open_found(filename, path, None, mode)
+        elif hasattr(sys, "frozen") or imp.is_frozen("__main__"):
+            # windows special case, when the package dir doesn't exist
+            path = search_dir(os.path.join(programdir, "textures"))
+            if path:
+                if verbose: logging.info("Found %s in '%s'", filename, path)
+                return self._open_found(filename, path, None, mode)
+
+        raise TextureException("Could not find the textures while searching for '{0}'. Try specifying the 'texturepath' option in your config file.\nSet it to the path to a Minecraft Resource pack.\nAlternately, install the Minecraft client (which includes textures)\nAlso see <http://docs.overviewer.org/en/latest/running/#installing-the-textures>\n(Remember, this version of Overviewer requires a 1.10-compatible resource pack)\n(Also note that I won't automatically use snapshots; you'll have to use the texturepath option to use a snapshot jar)".format(filename))
+
+    def reset_file_index(self):
+        """Forgets everything find_file() learned about where the texture
+        files are, to pick up added or removed files."""
+        # maps every filename found to the (path, zip member or None) it
+        # was found at
+        self._found_files = {}
+        # maps directories to the set of names in them
+        self._dir_listings = {}
+        # maps the paths of resource packs and jars to their ZipFiles
+        self._zips = {}
+        # the result of find_client_jar() in a tuple, once it was called
+        self._client_jar = None
+
+    def _open_found(self, filename, path, member, mode):
+        # remembers where filename was found, and opens it: the file at
+        # path, or the given member of the zip at path
+        self._found_files[filename] = (path, member)
+        self.sources.add(path)
+        if member is None:
+            return open(path, mode)
+        return self._open_zip(path).open(member)
+
+    def _open_zip(self, path):
+        # opens a resource pack or jar only once, instead of reading its
+        # table of contents for every file
+        if path not in self._zips:
+            self._zips[path] = zipfile.ZipFile(path)
+        return self._zips[path]
+
+    def _isfile(self, path):
+        # os.path.isfile(), but reading each directory just once instead of
+        # asking about every path in it. That's a lot less work on network
+        # storage, with all the places find_file() looks in
+        dirname, name = os.path.split(path)
+        names = self._dir_listings.get(dirname)
+        if names is None:
+            try:
+                names = set(os.listdir(dirname))
+            except OSError:
+                names = set()
+            self._dir_listings[dirname] = names
+        return name in names and os.path.isfile(path)
+
+    def find_client_jar(self, verbose=False):
+        """Returns the path of the installed minecraft client jar that
+        find_file() looks for textures in, or None if there is no
+        suitable one.
+
+        """
         versiondir = ""
         if "APPDATA" in os.environ and sys.platform.startswith("win"):
             versiondir = os.path.join(os.environ['APPDATA'], ".minecraft", "versions")
@@ -245,9 +607,8 @@ class Textures(object):
             versions = os.listdir(versiondir)
             if verbose: logging.info("Found these versions: {0}".format(versions))
         except OSError:
-            # Directory doesn't exist? Ignore it. It will find no versions and
-            # fall through the checks below to the error at the bottom of the
-            # method.
+            # Directory doesn't exist? Ignore it. It will find no versions,
+            # and find_file() falls through to the checks after the jar.
             versions = []
 
         most_recent_version = [0,0,0]
@@ -271,46 +632,13 @@ class Textures(object):
             if versionparts > most_recent_version:
                 most_recent_version = versionparts
 
-        if most_recent_version != [0,0,0]:
-            if verbose: logging.info("Most recent version >=1.8.0: {0}. Searching it for the file...".format(most_recent_version))
-
-            jarname = ".".join(str(x) for x in most_recent_version)
-            jarpath = os.path.join(versiondir, jarname, jarname + ".jar")
-
-            if os.path.isfile(jarpath):
-                jar = zipfile.ZipFile(jarpath)
-                for jarfilename in search_zip_paths:
-                    try:
-                        jar.getinfo(jarfilename)
-                        if verbose: logging.info("Found %s in '%s'", jarfilename, jarpath)
-                        self.jar, self.jarpath = jar, jarpath
-                        return jar.open(jarfilename)
-                    except (KeyError, IOError), e:
-                        pass
-
-            if verbose: logging.info("Did not find file {0} in jar {1}".format(filename, jarpath))
-        else:
+        if most_recent_version == [0,0,0]:
             if verbose: logging.info("Did not find any non-snapshot minecraft jars >=1.8.0")
-            
-        # Last ditch effort: look for the file is stored in with the overviewer
-        # installation. We include a few files that aren't included with Minecraft
-        # textures. This used to be for things such as water and lava, since
-        # they were generated by the game and not stored as images. Nowdays I
-        # believe that's not true, but we still have a few files distributed
-        # with overviewer.
-        if verbose: logging.info("Looking for texture in overviewer_core/data/textures")
-        path = search_dir(os.path.join(programdir, "overviewer_core", "data", "textures"))
-        if path:
-            if verbose: logging.info("Found %s in '%s'", filename, path)
-            return open(path, mode)
-        elif hasattr(sys, "frozen") or imp.is_frozen("__main__"):
-            # windows special case, when the package dir doesn't exist
-            path = search_dir(os.path.join(programdir, "textures"))
-            if path:
-                if verbose: logging.info("Found %s in '%s'", filename, path)
-                return open(path, mode)
+            return None
+        if verbose: logging.info("Most recent version >=1.8.0: {0}. Searching it for the file...".format(most_recent_version))
 
-        raise TextureException("Could not find the textures while searching for '{0}'. Try specifying the 'texturepath' option in your config file.\nSet it to the path to a Minecraft Resource pack.\nAlternately, install the Minecraft client (which includes textures)\nAlso see <http://docs.overviewer.org/en/latest/running/#installing-the-textures>\n(Remember, this version of Overviewer requires a 1.10-compatible resource pack)\n(Also note that I won't automatically use snapshots; you'll have to use the texturepath option to use a snapshot jar)".format(filename))
+        jarname = ".".join(str(x) for x in most_recent_version)
+        return os.path.join(versiondir, jarname, jarname + ".jar")
 
     def load_image_texture(self, filename):
         # Textures may be animated or in a different resolution than 16x16.  
@@ -464,41 +792,44 @@ class Textures(object):
     ##
 
     @staticmethod
-    def transform_image_top(img):
+    def transform_image_top(img, size=24):
         """Takes a PIL image and rotates it left 45 degrees and shrinks the y axis
-        by a factor of 2. Returns the resulting image, which will be 24x12 pixels
+        by a factor of 2. Returns the resulting image, which will be size by
+        size/2 pixels, 24x12 by default
 
         """
 
-        # Resize to 17x17, since the diagonal is approximately 24 pixels, a nice
-        # even number that can be split in half twice
-        img = img.resize((17, 17), Image.ANTIALIAS)
+        # Resize so the diagonal is approximately size pixels: 17x17 for 24
+        # pixels, a nice even number that can be split in half twice
+        side = int(round(size / math.sqrt(2)))
+        img = img.resize((side, side), Image.ANTIALIAS)
 
         # Build the Affine transformation matrix for this perspective
         transform = numpy.matrix(numpy.identity(3))
         # Translate up and left, since rotations are about the origin
-        transform *= numpy.matrix([[1,0,8.5],[0,1,8.5],[0,0,1]])
+        transform *= numpy.matrix([[1,0,side/2.],[0,1,side/2.],[0,0,1]])
         # Rotate 45 degrees
         ratio = math.cos(math.pi/4)
         #transform *= numpy.matrix("[0.707,-0.707,0;0.707,0.707,0;0,0,1]")
         transform *= numpy.matrix([[ratio,-ratio,0],[ratio,ratio,0],[0,0,1]])
         # Translate back down and right
-        transform *= numpy.matrix([[1,0,-12],[0,1,-12],[0,0,1]])
+        transform *= numpy.matrix([[1,0,-size/2],[0,1,-size/2],[0,0,1]])
         # scale the image down by a factor of 2
         transform *= numpy.matrix("[1,0,0;0,2,0;0,0,1]")
 
         transform = numpy.array(transform)[:2,:].ravel().tolist()
 
-        newimg = img.transform((24,12), Image.AFFINE, transform)
+        newimg = img.transform((size,size/2), Image.AFFINE, transform)
         return newimg
 
     @staticmethod
-    def transform_image_side(img):
+    def transform_image_side(img, size=24):
         """Takes an image and shears it for the left side of the cube (reflect for
-        the right side)"""
+        the right side). Returns an image of size/2 by size*3/4 pixels, 12x18
+        by default"""
 
         # Size of the cube side before shear
-        img = img.resize((12,12), Image.ANTIALIAS)
+        img = img.resize((size/2,size/2), Image.ANTIALIAS)
 
         # Apply shear
         transform = numpy.matrix(numpy.identity(3))
@@ -506,7 +837,7 @@ class Textures(object):
 
         transform = numpy.array(transform)[:2,:].ravel().tolist()
 
-        newimg = img.transform((12,18), Image.AFFINE, transform)
+        newimg = img.transform((size/2,size*3/4), Image.AFFINE, transform)
         return newimg
 
     @staticmethod
@@ -570,19 +901,21 @@ class Textures(object):
 
     def build_block(self, top, side):
         """From a top texture and a side texture, build a block image.
-        top and side should be 16x16 image objects. Returns a 24x24 image
+        top and side should be 16x16 image objects. Returns an image of
+        sprite_size, 24x24 by default
 
         """
-        img = Image.new("RGBA", (24,24), self.bgcolor)
+        size = self.sprite_size
+        img = Image.new("RGBA", (size,size), self.bgcolor)
 
         original_texture = top.copy()
-        top = self.transform_image_top(top)
+        top = self.transform_image_top(top, size)
 
         if not side:
             alpha_over(img, top, (0,0), top)
             return img
 
-        side = self.transform_image_side(side)
+        side = self.transform_image_side(side, size)
         otherside = side.transpose(Image.FLIP_LEFT_RIGHT)
 
         # Darken the sides slightly. These methods also affect the alpha layer,
@@ -596,15 +929,16 @@ class Textures(object):
         otherside.putalpha(othersidealpha)
 
         alpha_over(img, top, (0,0), top)
-        alpha_over(img, side, (0,6), side)
-        alpha_over(img, otherside, (12,6), otherside)
+        alpha_over(img, side, (0,size/4), side)
+        alpha_over(img, otherside, (size/2,size/4), otherside)
 
-        # Manually touch up 6 pixels that leave a gap because of how the
+        # Manually touch up the pixels that leave a gap because of how the
         # shearing works out. This makes the blocks perfectly tessellate-able
-        for x,y in [(13,23), (17,21), (21,19)]:
+        top_touchups, right_touchups = _touchup_points(size)
+        for x,y in right_touchups:
             # Copy a pixel to x,y from x-1,y
             img.putpixel((x,y), img.getpixel((x-1,y)))
-        for x,y in [(3,4), (7,2), (11,0)]:
+        for x,y in top_touchups:
             # Copy a pixel to x,y from x+1,y
             img.putpixel((x,y), img.getpixel((x+1,y)))
 
@@ -612,17 +946,20 @@ class Textures(object):
 
     def build_slab_block(self, top, side, upper):
         """From a top texture and a side texture, build a slab block image.
-        top and side should be 16x16 image objects. Returns a 24x24 image
+        top and side should be 16x16 image objects. Returns an image of
+        sprite_size, 24x24 by default
 
         """
+        size = self.sprite_size
+
         # cut the side texture in half
         mask = side.crop((0,8,16,16))
         side = Image.new(side.mode, side.size, self.bgcolor)
         alpha_over(side, mask,(0,0,16,8), mask)
 
         # plain slab
-        top = self.transform_image_top(top)
-        side = self.transform_image_side(side)
+        top = self.transform_image_top(top, size)
+        side = self.transform_image_side(side, size)
         otherside = side.transpose(Image.FLIP_LEFT_RIGHT)
 
         sidealpha = side.split()[3]
@@ -635,36 +972,33 @@ class Textures(object):
         # upside down slab
         delta = 0
         if upper:
-            delta = 6
-
-        img = Image.new("RGBA", (24,24), self.bgcolor)
-        alpha_over(img, side, (0,12 - delta), side)
-        alpha_over(img, otherside, (12,12 - delta), otherside)
-        alpha_over(img, top, (0,6 - delta), top)
-
-        # Manually touch up 6 pixels that leave a gap because of how the
-        # shearing works out. This makes the blocks perfectly tessellate-able
-        if upper:
-            for x,y in [(3,4), (7,2), (11,0)]:
-                # Copy a pixel to x,y from x+1,y
-                img.putpixel((x,y), img.getpixel((x+1,y)))
-            for x,y in [(13,17), (17,15), (21,13)]:
-                # Copy a pixel to x,y from x-1,y
-                img.putpixel((x,y), img.getpixel((x-1,y)))
-        else:
-            for x,y in [(3,10), (7,8), (11,6)]:
-                # Copy a pixel to x,y from x+1,y
-                img.putpixel((x,y), img.getpixel((x+1,y)))
-            for x,y in [(13,23), (17,21), (21,19)]:
-                # Copy a pixel to x,y from x-1,y
-                img.putpixel((x,y), img.getpixel((x-1,y)))
+            delta = size/4
+
+        img = Image.new("RGBA", (size,size), self.bgcolor)
+        alpha_over(img, side, (0,size/2 - delta), side)
+        alpha_over(img, otherside, (size/2,size/2 - delta), otherside)
+        alpha_over(img, top, (0,size/4 - delta), top)
+
+        # Manually touch up the pixels that leave a gap because of how the
+        # shearing works out. This makes the blocks perfectly tessellate-able.
+        # The top face of a lower slab, and the right face of an upper slab,
+        # are a quarter of the block lower and higher than for a full block
+        top_touchups, right_touchups = _touchup_points(size)
+        top_shift, right_shift = (0, -size/4) if upper else (size/4, 0)
+        for x,y in top_touchups:
+            # Copy a pixel to x,y from x+1,y
+            img.putpixel((x,y + top_shift), img.getpixel((x+1,y + top_shift)))
+        for x,y in right_touchups:
+            # Copy a pixel to x,y from x-1,y
+            img.putpixel((x,y + right_shift), img.getpixel((x-1,y + right_shift)))
 
         return img
 
     def build_full_block(self, top, side1, side2, side3, side4, bottom=None):
         """From a top texture, a bottom texture and 4 different side textures,
         build a full block with four differnts faces. All images should be 16x16 
-        image objects. Returns a 24x24 image. Can be used to render any block.
+        image objects. Returns an image of sprite_size, 24x24 by default. Can
+        be used to render any block.
 
         side1 is in the -y face of the cube     (top left, east)
         side2 is in the +x                      (top right, south)
@@ -684,10 +1018,13 @@ class Textures(object):
 
         """
 
+        size = self.sprite_size
         increment = 0
         if isinstance(top, tuple):
-            increment = int(round((top[1] / 16.)*12.)) # range increment in the block height in pixels (half texture size)
-            crop_height = increment
+            increment = int(round((top[1] / 16.)*(size/2))) # range increment in the block height in pixels (half texture size)
+            # the sides are cropped by the increment at 24 pixels, whatever
+            # the sprite size
+            crop_height = int(round((top[1] / 16.)*12.))
             top = top[0]
             if side1 is not None:
                 side1 = side1.copy()
@@ -702,11 +1039,11 @@ class Textures(object):
                 side4 = side4.copy()
                 ImageDraw.Draw(side4).rectangle((0, 0,16,crop_height),outline=(0,0,0,0),fill=(0,0,0,0))
 
-        img = Image.new("RGBA", (24,24), self.bgcolor)
+        img = Image.new("RGBA", (size,size), self.bgcolor)
 
         # first back sides
         if side1 is not None :
-            side1 = self.transform_image_side(side1)
+            side1 = self.transform_image_side(side1, size)
             side1 = side1.transpose(Image.FLIP_LEFT_RIGHT)
 
             # Darken this side.
@@ -718,32 +1055,32 @@ class Textures(object):
 
 
         if side2 is not None :
-            side2 = self.transform_image_side(side2)
+            side2 = self.transform_image_side(side2, size)
 
             # Darken this side.
             sidealpha2 = side2.split()[3]
             side2 = ImageEnhance.Brightness(side2).enhance(0.8)
             side2.putalpha(sidealpha2)
 
-            alpha_over(img, side2, (12,0), side2)
+            alpha_over(img, side2, (size/2,0), side2)
 
         if bottom is not None :
-            bottom = self.transform_image_top(bottom)
-            alpha_over(img, bottom, (0,12), bottom)
+            bottom = self.transform_image_top(bottom, size)
+            alpha_over(img, bottom, (0,size/2), bottom)
 
         # front sides
         if side3 is not None :
-            side3 = self.transform_image_side(side3)
+            side3 = self.transform_image_side(side3, size)
 
             # Darken this side
             sidealpha = side3.split()[3]
             side3 = ImageEnhance.Brightness(side3).enhance(0.9)
             side3.putalpha(sidealpha)
 
-            alpha_over(img, side3, (0,6), side3)
+            alpha_over(img, side3, (0,size/4), side3)
 
         if side4 is not None :
-            side4 = self.transform_image_side(side4)
+            side4 = self.transform_image_side(side4, size)
             side4 = side4.transpose(Image.FLIP_LEFT_RIGHT)
 
             # Darken this side
@@ -751,18 +1088,19 @@ class Textures(object):
             side4 = ImageEnhance.Brightness(side4).enhance(0.8)
             side4.putalpha(sidealpha)
 
-            alpha_over(img, side4, (12,6), side4)
+            alpha_over(img, side4, (size/2,size/4), side4)
 
         if top is not None :
-            top = self.transform_image_top(top)
+            top = self.transform_image_top(top, size)
             alpha_over(img, top, (0, increment), top)
 
-        # Manually touch up 6 pixels that leave a gap because of how the
+        # Manually touch up the pixels that leave a gap because of how the
         # shearing works out. This makes the blocks perfectly tessellate-able
-        for x,y in [(13,23), (17,21), (21,19)]:
+        top_touchups, right_touchups = _touchup_points(size)
+        for x,y in right_touchups:
             # Copy a pixel to x,y from x-1,y
             img.putpixel((x,y), img.getpixel((x-1,y)))
-        for x,y in [(3,4), (7,2), (11,0)]:
+        for x,y in top_touchups:
             # Copy a pixel to x,y from x+1,y
             img.putpixel((x,y), img.getpixel((x+1,y)))
 
@@ -771,23 +1109,25 @@ class Textures(object):
     def build_sprite(self, side):
         """From a side texture, create a sprite-like texture such as those used
         for spiderwebs or flowers."""
-        img = Image.new("RGBA", (24,24), self.bgcolor)
+        size = self.sprite_size
+        img = Image.new("RGBA", (size,size), self.bgcolor)
 
-        side = self.transform_image_side(side)
+        side = self.transform_image_side(side, size)
         otherside = side.transpose(Image.FLIP_LEFT_RIGHT)
 
-        alpha_over(img, side, (6,3), side)
-        alpha_over(img, otherside, (6,3), otherside)
+        alpha_over(img, side, (size/4,size/8), side)
+        alpha_over(img, otherside, (size/4,size/8), otherside)
         return img
 
     def build_billboard(self, tex):
         """From a texture, create a billboard-like texture such as
         those used for tall grass or melon stems.
         """
-        img = Image.new("RGBA", (24,24), self.bgcolor)
+        size = self.sprite_size
+        img = Image.new("RGBA", (size,size), self.bgcolor)
 
-        front = tex.resize((14, 12), Image.ANTIALIAS)
-        alpha_over(img, front, (5,9))
+        front = tex.resize((size*7/12, size/2), Image.ANTIALIAS)
+        alpha_over(img, front, (size*5/24,size*3/8))
         return img
 
     def generate_opaque_mask(self, img):
@@ -811,6 +1151,48 @@ class Textures(object):
             return None
         return (img, self.generate_opaque_mask(img))
 
+    def get_face_masks(self):
+        """Returns masks of the top, left and right faces of a block
+        sprite, used by the render primitives to shade the faces
+        separately."""
+        if getattr(self, "_face_masks", None):
+            return self._face_masks
+        size = self.texture_size
+
+        white = Image.new("L", self.texture_dimensions, 255)
+        
+        top = Image.new("L", self.texture_dimensions, 0)
+        left = Image.new("L", self.texture_dimensions, 0)
+        
+        toppart = self.transform_image_top(white, size)
+        leftpart = self.transform_image_side(white, size)
+        
+        # using the real PIL paste here (not alpha_over) because there is
+        # no alpha channel (and it's mode "L")
+        top.paste(toppart, (0,0))
+        left.paste(leftpart, (0,size/4))
+        right = left.transpose(Image.FLIP_LEFT_RIGHT)
+        
+        # Manually touch up the pixels that leave a gap, like in
+        # build_block()
+        top_touchups, right_touchups = _touchup_points(size)
+        for x,y in right_touchups:
+            right.putpixel((x,y), 255)
+        for x,y in top_touchups:
+            top.putpixel((x,y), 255)
+    
+        # special fix for chunk boundary stipple
+        for x,y in right_touchups:
+            right.putpixel((x,y - size/2), 0)
+        
+        self._face_masks = (top, left, right)
+        return self._face_masks
+
+    def get_color_sprite(self, color):
+        """Returns a block sprite sized image filled with the given
+        color, for render primitives to blend in through a mask."""
+        return Image.new("RGBA", self.texture_dimensions, color)
+
 ##
 ## The other big one: @material and associated framework
 ##
@@ -829,7 +1211,8 @@ fluid_blocks = set()
 nospawn_blocks = set()
 nodata_blocks = set()
 
-# the material registration decorator
+# the material registration decorator. Generators that are scalable draw
+# their sprites with the build_* functions alone, at any sprite_size
 def material(blockid=[], data=[0], **kwargs):
     # mapping from property name to the set to store them in
     properties = {"transparent" : transparent_blocks, "solid" : solid_blocks, "fluid" : fluid_blocks, "nospawn" : nospawn_blocks, "nodata" : nodata_blocks}
@@ -852,6 +1235,7 @@ def material(blockid=[], data=[0], **kwargs):
         @functools.wraps(func)
         def func_wrapper(texobj, blockid, data):
             return func(texobj, blockid, data)
+        func_wrapper.scalable = kwargs.get("scalable", False)
         
         used_datas.update(data)
         if max(data) >= max_data:
@@ -879,7 +1263,7 @@ def material(blockid=[], data=[0], **kwargs):
 
 # shortcut function for pure blocks, default to solid, nodata
 def block(blockid=[], top_image=None, side_image=None, **kwargs):
-    new_kwargs = {'solid' : True, 'nodata' : True}
+    new_kwargs = {'solid' : True, 'nodata' : True, 'scalable' : True}
     new_kwargs.update(kwargs)
     
     if top_image is None:
@@ -895,7 +1279,7 @@ def block(blockid=[], top_image=None, side_image=None, **kwargs):
 
 # shortcut function for sprite blocks, defaults to transparent, nodata
 def sprite(blockid=[], imagename=None, **kwargs):
-    new_kwargs = {'transparent' : True, 'nodata' : True}
+    new_kwargs = {'transparent' : True, 'nodata' : True, 'scalable' : True}
     new_kwargs.update(kwargs)
     
     if imagename is None:
@@ -908,7 +1292,7 @@ def sprite(blockid=[], imagename=None, **kwargs):
 
 # shortcut function for billboard blocks, defaults to transparent, nodata
 def billboard(blockid=[], imagename=None, **kwargs):
-    new_kwargs = {'transparent' : True, 'nodata' : True}
+    new_kwargs = {'transparent' : True, 'nodata' : True, 'scalable' : True}
     new_kwargs.update(kwargs)
     
     if imagename is None:
@@ -924,7 +1308,7 @@ def billboard(blockid=[], imagename=None, **kwargs):
 ##
 
 # stone
-@material(blockid=1, data=range(7), solid=True)
+@material(blockid=1, data=range(7), solid=True, scalable=True)
 def stone(self, blockid, data):
     if data == 0: # regular old-school stone
         img = self.load_image_texture("assets/minecraft/textures/blocks/stone.png")
@@ -942,7 +1326,7 @@ def stone(self, blockid, data):
         img = self.load_image_texture("assets/minecraft/textures/blocks/stone_andesite_smooth.png")
     return self.build_block(img, img)
 
-@material(blockid=2, data=range(11)+[0x10,], solid=True)
+@material(blockid=2, data=range(11)+[0x10,], solid=True, scalable=True)
 def grass(self, blockid, data):
     # 0x10 bit means SNOW
     side_img = self.load_image_texture("assets/minecraft/textures/blocks/grass_side.png")
@@ -954,7 +1338,7 @@ def grass(self, blockid, data):
     return img
 
 # dirt
-@material(blockid=3, data=range(3), solid=True)
+@material(blockid=3, data=range(3), solid=True, scalable=True)
 def dirt_blocks(self, blockid, data):
     side_img = self.load_image_texture("assets/minecraft/textures/blocks/dirt.png")
     if data == 0: # normal
@@ -970,7 +1354,7 @@ def dirt_blocks(self, blockid, data):
 block(blockid=4, top_image="assets/minecraft/textures/blocks/cobblestone.png")
 
 # wooden planks
-@material(blockid=5, data=range(6), solid=True)
+@material(blockid=5, data=range(6), solid=True, scalable=True)
 def wooden_planks(self, blockid, data):
     if data == 0: # normal
         return self.build_block(self.load_image_texture("assets/minecraft/textures/blocks/planks_oak.png"), self.load_image_texture("assets/minecraft/textures/blocks/planks_oak.png"))
@@ -985,7 +1369,7 @@ def wooden_planks(self, blockid, data):
     if data == 5: # dark oak
         return self.build_block(self.load_image_texture("assets/minecraft/textures/blocks/planks_big_oak.png"),self.load_image_texture("assets/minecraft/textures/blocks/planks_big_oak.png"))
 
-@material(blockid=6, data=range(16), transparent=True)
+@material(blockid=6, data=range(16), transparent=True, scalable=True)
 def saplings(self, blockid, data):
     # usual saplings
     tex = self.load_image_texture("assets/minecraft/textures/blocks/sapling_oak.png")
@@ -1005,14 +1389,14 @@ def saplings(self, blockid, data):
 # bedrock
 block(blockid=7, top_image="assets/minecraft/textures/blocks/bedrock.png")
 
-@material(blockid=8, data=range(16), fluid=True, transparent=True, nospawn=True)
+@material(blockid=8, data=range(16), fluid=True, transparent=True, nospawn=True, scalable=True)
 def water(self, blockid, data):
     watertex = self.load_water()
     return self.build_block(watertex, watertex)
 
 # other water, glass, and ice (no inner surfaces)
 # uses pseudo-ancildata found in iterate.c
-@material(blockid=[9, 20, 79, 95], data=range(512), fluid=(9,), transparent=True, nospawn=True, solid=(79, 20, 95))
+@material(blockid=[9, 20, 79, 95], data=range(512), fluid=(9,), transparent=True, nospawn=True, solid=(79, 20, 95), scalable=True)
 def no_inner_surfaces(self, blockid, data):
     if blockid == 9:
         texture = self.load_water()
@@ -1059,13 +1443,13 @@ def no_inner_surfaces(self, blockid, data):
     img = self.build_full_block(top,None,None,side3,side4)
     return img
 
-@material(blockid=[10, 11], data=range(16), fluid=True, transparent=False, nospawn=True)
+@material(blockid=[10, 11], data=range(16), fluid=True, transparent=False, nospawn=True, scalable=True)
 def lava(self, blockid, data):
     lavatex = self.load_lava()
     return self.build_block(lavatex, lavatex)
 
 # sand
-@material(blockid=12, data=range(2), solid=True)
+@material(blockid=12, data=range(2), solid=True, scalable=True)
 def sand_blocks(self, blockid, data):
     if data == 0: # normal
         img = self.build_block(self.load_image_texture("assets/minecraft/textures/blocks/sand.png"), self.load_image_texture("assets/minecraft/textures/blocks/sand.png"))
@@ -1082,7 +1466,7 @@ block(blockid=15, top_image="assets/minecraft/textures/blocks/iron_ore.png")
 # coal ore
 block(blockid=16, top_image="assets/minecraft/textures/blocks/coal_ore.png")
 
-@material(blockid=[17,162], data=range(12), solid=True)
+@material(blockid=[17,162], data=range(12), solid=True, scalable=True)
 def wood(self, blockid, data):
     # extract orientation and wood type frorm data bits
     wood_type = data & 3
@@ -1127,7 +1511,7 @@ def wood(self, blockid, data):
     elif wood_orientation == 8: # north-south orientation
         return self.build_full_block(side, None, None, side.rotate(270), top)
 
-@material(blockid=[18, 161], data=range(16), transparent=True, solid=True)
+@material(blockid=[18, 161], data=range(16), transparent=True, solid=True, scalable=True)
 def leaves(self, blockid, data):
     # mask out the bits 4 and 8
     # they are used for player placed and check-for-decay blocks
@@ -1153,7 +1537,7 @@ block(blockid=21, top_image="assets/minecraft/textures/blocks/lapis_ore.png")
 block(blockid=22, top_image="assets/minecraft/textures/blocks/lapis_block.png")
 
 # dispensers, dropper, furnaces, and burning furnaces
-@material(blockid=[23, 61, 62, 158], data=range(6), solid=True)
+@material(blockid=[23, 61, 62, 158], data=range(6), solid=True, scalable=True)
 def furnaces(self, blockid, data):
     # first, do the rotation if needed
     if self.rotation == 1:
@@ -1202,7 +1586,7 @@ def furnaces(self, blockid, data):
         return self.build_full_block(top, None, None, side, side)
 
 # sandstone
-@material(blockid=24, data=range(3), solid=True)
+@material(blockid=24, data=range(3), solid=True, scalable=True)
 def sandstone(self, blockid, data):
     top = self.load_image_texture("assets/minecraft/textures/blocks/sandstone_top.png")
     if data == 0: # normal
@@ -1213,7 +1597,7 @@ def sandstone(self, blockid, data):
         return self.build_block(top, self.load_image_texture("assets/minecraft/textures/blocks/sandstone_smooth.png"))
         
 # red sandstone
-@material(blockid=179, data=range(3), solid=True)
+@material(blockid=179, data=range(3), solid=True, scalable=True)
 def sandstone(self, blockid, data):
     top = self.load_image_texture("assets/minecraft/textures/blocks/red_sandstone_top.png")
     if data == 0: # normal
@@ -1227,7 +1611,7 @@ def sandstone(self, blockid, data):
 # note block
 block(blockid=25, top_image="assets/minecraft/textures/blocks/noteblock.png")
 
-@material(blockid=26, data=range(12), transparent=True, nospawn=True)
+@material(blockid=26, data=range(12), transparent=True, nospawn=True, scalable=True)
 def bed(self, blockid, data):
     # first get rotation done
     # Masked to not clobber block head/foot info
@@ -1573,7 +1957,7 @@ def piston_extension(self, blockid, data):
 # cobweb
 sprite(blockid=30, imagename="assets/minecraft/textures/blocks/web.png", nospawn=True)
 
-@material(blockid=31, data=range(3), transparent=True)
+@material(blockid=31, data=range(3), transparent=True, scalable=True)
 def tall_grass(self, blockid, data):
     if data == 0: # dead shrub
         texture = self.load_image_texture("assets/minecraft/textures/blocks/deadbush.png")
@@ -1587,7 +1971,7 @@ def tall_grass(self, blockid, data):
 # dead bush
 billboard(blockid=32, imagename="assets/minecraft/textures/blocks/deadbush.png")
 
-@material(blockid=35, data=range(16), solid=True)
+@material(blockid=35, data=range(16), solid=True, scalable=True)
 def wool(self, blockid, data):
     texture = self.load_image_texture("assets/minecraft/textures/blocks/wool_colored_%s.png" % color_map[data])
     
@@ -1597,7 +1981,7 @@ def wool(self, blockid, data):
 sprite(blockid=37, imagename="assets/minecraft/textures/blocks/flower_dandelion.png")
 
 # flowers
-@material(blockid=38, data=range(10), transparent=True)
+@material(blockid=38, data=range(10), transparent=True, scalable=True)
 def flower(self, blockid, data):
     flower_map = ["rose", "blue_orchid", "allium", "houstonia", "tulip_red", "tulip_orange",
                   "tulip_white", "tulip_pink", "oxeye_daisy", "dandelion"]
@@ -1617,7 +2001,7 @@ block(blockid=42, top_image="assets/minecraft/textures/blocks/iron_block.png")
 # double slabs and slabs
 # these wooden slabs are unobtainable without cheating, they are still
 # here because lots of pre-1.3 worlds use this blocks
-@material(blockid=[43, 44, 181, 182, 204, 205], data=range(16), transparent=(44,182,205), solid=True)
+@material(blockid=[43, 44, 181, 182, 204, 205], data=range(16), transparent=(44,182,205), solid=True, scalable=True)
 def slabs(self, blockid, data):
     if blockid == 44 or blockid == 182: 
         texture = data & 7
@@ -2180,7 +2564,7 @@ block(blockid=57, top_image="assets/minecraft/textures/blocks/diamond_block.png"
 
 # crafting table
 # needs two different sides
-@material(blockid=58, solid=True, nodata=True)
+@material(blockid=58, solid=True, nodata=True, scalable=True)
 def crafting_table(self, blockid, data):
     top = self.load_image_texture("assets/minecraft/textures/blocks/crafting_table_top.png")
     side3 = self.load_image_texture("assets/minecraft/textures/blocks/crafting_table_side.png")
@@ -2204,7 +2588,7 @@ def crops8(self, blockid, data):
     return img
 
 # farmland and grass path (15/16 blocks)
-@material(blockid=[60,208], data=range(9), solid=True)
+@material(blockid=[60,208], data=range(9), solid=True, scalable=True)
 def farmland(self, blockid, data):
     if blockid == 60:
         side = self.load_image_texture("assets/minecraft/textures/blocks/dirt.png")
@@ -2835,13 +3219,13 @@ def cactus(self, blockid, data):
 block(blockid=82, top_image="assets/minecraft/textures/blocks/clay.png")
 
 # sugar cane
-@material(blockid=83, data=range(16), transparent=True)
+@material(blockid=83, data=range(16), transparent=True, scalable=True)
 def sugar_cane(self, blockid, data):
     tex = self.load_image_texture("assets/minecraft/textures/blocks/reeds.png")
     return self.build_sprite(tex)
 
 # jukebox
-@material(blockid=84, data=range(16), solid=True)
+@material(blockid=84, data=range(16), solid=True, scalable=True)
 def jukebox(self, blockid, data):
     return self.build_block(self.load_image_texture("assets/minecraft/textures/blocks/jukebox_top.png"), self.load_image_texture("assets/minecraft/textures/blocks/noteblock.png"))
 
@@ -2963,7 +3347,7 @@ def fence(self, blockid, data):
     return img
 
 # pumpkin
-@material(blockid=[86, 91], data=range(4), solid=True)
+@material(blockid=[86, 91], data=range(4), solid=True, scalable=True)
 def pumpkin(self, blockid, data): # pumpkins, jack-o-lantern
     # rotation
     if self.rotation == 1:
@@ -3408,7 +3792,7 @@ def trapdoor(self, blockid, data):
     return img
 
 # block with hidden silverfish (stone, cobblestone and stone brick)
-@material(blockid=97, data=range(3), solid=True)
+@material(blockid=97, data=range(3), solid=True, scalable=True)
 def hidden_silverfish(self, blockid, data):
     if data == 0: # stone
         t = self.load_image_texture("assets/minecraft/textures/blocks/stone.png")
@@ -3422,7 +3806,7 @@ def hidden_silverfish(self, blockid, data):
     return img
 
 # stone brick
-@material(blockid=98, data=range(4), solid=True)
+@material(blockid=98, data=range(4), solid=True, scalable=True)
 def stone_brick(self, blockid, data):
     if data == 0: # normal
         t = self.load_image_texture("assets/minecraft/textures/blocks/stonebrick.png")
@@ -3438,7 +3822,7 @@ def stone_brick(self, blockid, data):
     return img
 
 # huge brown and red mushroom
-@material(blockid=[99,100], data= range(11) + [14,15], solid=True)
+@material(blockid=[99,100], data= range(11) + [14,15], solid=True, scalable=True)
 def huge_mushroom(self, blockid, data):
     # rotation
     if self.rotation == 1:
@@ -3594,7 +3978,7 @@ def stem(self, blockid, data):
     
 
 # vines
-@material(blockid=106, data=range(16), transparent=True)
+@material(blockid=106, data=range(16), transparent=True, scalable=True)
 def vines(self, blockid, data):
     # rotation
     # vines data is bit coded. decode it first.
@@ -3739,7 +4123,7 @@ block(blockid=110, top_image="assets/minecraft/textures/blocks/mycelium_top.png"
 # At the moment of writing this lilypads has no ancil data and their
 # orientation depends on their position on the map. So it uses pseudo
 # ancildata.
-@material(blockid=111, data=range(4), transparent=True)
+@material(blockid=111, data=range(4), transparent=True, scalable=True)
 def lilypad(self, blockid, data):
     t = self.load_image_texture("assets/minecraft/textures/blocks/waterlily.png").copy()
     if data == 0:
@@ -3757,7 +4141,7 @@ def lilypad(self, blockid, data):
 block(blockid=112, top_image="assets/minecraft/textures/blocks/nether_brick.png")
 
 # nether wart
-@material(blockid=115, data=range(4), transparent=True)
+@material(blockid=115, data=range(4), transparent=True, scalable=True)
 def nether_wart(self, blockid, data):
     if data == 0: # just come up
         t = self.load_image_texture("assets/minecraft/textures/blocks/nether_wart_stage_0.png")
@@ -3773,7 +4157,7 @@ def nether_wart(self, blockid, data):
 
 # enchantment table
 # TODO there's no book at the moment
-@material(blockid=116, transparent=True, nodata=True)
+@material(blockid=116, transparent=True, nodata=True, scalable=True)
 def enchantment_table(self, blockid, data):
     # no book at the moment
     top = self.load_image_texture("assets/minecraft/textures/blocks/enchanting_table_top.png")
@@ -3912,7 +4296,7 @@ def daylight_sensor(self, blockid, data):
 # wooden double and normal slabs
 # these are the new wooden slabs, blockids 43 44 still have wooden
 # slabs, but those are unobtainable without cheating
-@material(blockid=[125, 126], data=range(16), transparent=(44,), solid=True)
+@material(blockid=[125, 126], data=range(16), transparent=(44,), solid=True, scalable=True)
 def wooden_slabs(self, blockid, data):
     texture = data & 7
     if texture== 0: # oak 
@@ -4023,7 +4407,7 @@ def cocoa_plant(self, blockid, data):
     return img
 
 # command block
-@material(blockid=[137,210,211], solid=True, nodata=True)
+@material(blockid=[137,210,211], solid=True, nodata=True, scalable=True)
 def command_block(self, blockid, data):
     if blockid == 210:
         front = self.load_image_texture("assets/minecraft/textures/blocks/repeating_command_block_front.png")
@@ -4313,7 +4697,7 @@ block(blockid=152, top_image="assets/minecraft/textures/blocks/redstone_block.pn
 block(blockid=153, top_image="assets/minecraft/textures/blocks/quartz_ore.png")
 
 # block of quartz
-@material(blockid=155, data=range(5), solid=True)
+@material(blockid=155, data=range(5), solid=True, scalable=True)
 def quartz_block(self, blockid, data):
     
     if data in (0,1): # normal and chiseled quartz block
@@ -4368,7 +4752,7 @@ def hopper(self, blockid, data):
 block(blockid=165, top_image="assets/minecraft/textures/blocks/slime.png")
 
 # prismarine block
-@material(blockid=168, data=range(3), solid=True)
+@material(blockid=168, data=range(3), solid=True, scalable=True)
 def prismarine_block(self, blockid, data):
 
    if data == 0: # prismarine
@@ -4386,7 +4770,7 @@ def prismarine_block(self, blockid, data):
 block(blockid=169, top_image="assets/minecraft/textures/blocks/sea_lantern.png")
 
 # hay block
-@material(blockid=170, data=range(9), solid=True)
+@material(blockid=170, data=range(9), solid=True, scalable=True)
 def hayblock(self, blockid, data):
     top = self.load_image_texture("assets/minecraft/textures/blocks/hay_block_top.png")
     side = self.load_image_texture("assets/minecraft/textures/blocks/hay_block_side.png")
@@ -4408,7 +4792,7 @@ def hayblock(self, blockid, data):
 
 
 # carpet - wool block that's small?
-@material(blockid=171, data=range(16), transparent=True)
+@material(blockid=171, data=range(16), transparent=True, scalable=True)
 def carpet(self, blockid, data):
     texture = self.load_image_texture("assets/minecraft/textures/blocks/wool_colored_%s.png" % color_map[data])
 
@@ -4418,7 +4802,7 @@ def carpet(self, blockid, data):
 block(blockid=172, top_image="assets/minecraft/textures/blocks/hardened_clay.png")
 
 #stained hardened clay
-@material(blockid=159, data=range(16), solid=True)
+@material(blockid=159, data=range(16), solid=True, scalable=True)
 def stained_clay(self, blockid, data):
     texture = self.load_image_texture("assets/minecraft/textures/blocks/hardened_clay_stained_%s.png" % color_map[data])
 
@@ -4452,7 +4836,7 @@ def flower(self, blockid, data):
     return img
 
 # chorus flower
-@material(blockid=200, data=range(6), solid=True)
+@material(blockid=200, data=range(6), solid=True, scalable=True)
 def chorus_flower(self, blockid, data):
     # aged 5, dead
     if data == 5:
@@ -4466,7 +4850,7 @@ def chorus_flower(self, blockid, data):
 block(blockid=201, top_image="assets/minecraft/textures/blocks/purpur_block.png")
 
 # purpur pilar
-@material(blockid=202, data=range(12) , solid=True)
+@material(blockid=202, data=range(12) , solid=True, scalable=True)
 def purpur_pillar(self, blockid, data):
     pillar_orientation = data & 12
     top=self.load_image_texture("assets/minecraft/textures/blocks/purpur_pillar_top.png")
@@ -4483,7 +4867,7 @@ def purpur_pillar(self, blockid, data):
 block(blockid=206, top_image="assets/minecraft/textures/blocks/end_bricks.png")
 
 # frosted ice
-@material(blockid=212, data=range(4), solid=True)
+@material(blockid=212, data=range(4), solid=True, scalable=True)
 def frosted_ice(self, blockid, data):
     img = self.load_image_texture("assets/minecraft/textures/blocks/frosted_ice_%d.png" % data)
     return self.build_block(img, img)
@@ -4497,7 +4881,7 @@ block(blockid=214, top_image="assets/minecraft/textures/blocks/nether_wart_block
 # red nether brick
 block(blockid=215, top_image="assets/minecraft/textures/blocks/red_nether_brick.png")
 
-@material(blockid=216, data=range(12), solid=True)
+@material(blockid=216, data=range(12), solid=True, scalable=True)
 def boneblock(self, blockid, data):
     # extract orientation
     boneblock_orientation = data & 12
@@ -4520,7 +4904,7 @@ def boneblock(self, blockid, data):
         return self.build_full_block(side, None, None, side.rotate(270), top)
 
 # structure block
-@material(blockid=255, data=range(4), solid=True)
+@material(blockid=255, data=range(4), solid=True, scalable=True)
 def structure_block(self, blockid, data):
     if data == 0:
         img = self.load_image_texture("assets/minecraft/textures/blocks/structure_block_save.png")
@@ -19,20 +19,25 @@ import os
 import os.path
 import sys
 import shutil
-import random
 import functools
 import time
 import errno
 import stat
 import platform
+import hashlib
+import cPickle
+import glob
 from collections import namedtuple
 from itertools import product, izip, chain
 
+import numpy
 from PIL import Image
 
 from .util import roundrobin
 from . import nbt
-from .files import FileReplacer, get_fs_caps
+from . import world
+from . import cache
+from .files import FileReplacer, get_fs_caps, default_caps
 from .optimizeimages import optimize_image
 import rendermodes
 import c_overviewer
@@ -57,7 +62,8 @@ get_num_phases()
     This method returns an integer indicating how many phases of work this
     worker has to perform. Each phase of work is completed serially with the
     other phases... all work done by one phase is done before the next phase is
-    started.
+    started. This only holds within one worker; other workers may still be
+    busy with an earlier phase of their own.
 
 get_phase_length(phase)
     This method returns an integer indicating how many work items there are in
@@ -86,6 +92,17 @@ do_work(workobj)
     return anything, so the results of its work should be reflected on the
     filesystem or by sending signals.
 
+get_work_group(workobj)
+    This method is optional. It returns a hashable key for the given work
+    object. Dispatchers with several worker processes try to do all the work
+    objects with the same key in the same process, so they can share what
+    that process has cached.
+
+finish_work()
+    This method is optional. It is called in every process that may have
+    called do_work(), once it has done all its work for this worker, to write
+    out anything it held on to.
+
 
 """
 
@@ -98,6 +115,11 @@ def iterate_base4(d):
 # world
 Bounds = namedtuple("Bounds", ("mincol", "maxcol", "minrow", "maxrow"))
 
+# The work item for the upper-tiles of one subtree that are rendered together:
+# root is the path of the subtree's top tile, and tiles the paths of the tiles
+# to render, children before their parents
+CompositeJob = namedtuple("CompositeJob", ("root", "tiles"))
+
 # A note about the implementation of the different rendercheck modes:
 #
 # For reference, here's what the rendercheck modes are:
@@ -178,6 +200,11 @@ class TileSet(object):
 
     """
 
+    # How many levels of upper-tiles a single CompositeJob renders. The tiles
+    # of a job are built from each other in memory, so each one is encoded
+    # once and never decoded again
+    composite_levels = 3
+
     def __init__(self, worldobj, regionsetobj, assetmanagerobj, texturesobj, options, outputdir):
         """Construct a new TileSet object with the given configuration options
         dictionary.
@@ -279,6 +306,17 @@ class TileSet(object):
             changelist output: each tile written will get outputted to the
             specified fd.
 
+        compositecache
+            Optional: The number of tiles each process keeps in memory, at
+            half size, after writing them, so their parent tile can be built
+            without reading them back from disk. 0 turns this off. Defaults
+            to 256.
+
+        tilehashes
+            Optional: If True, a hash of each tile is kept between renders,
+            and tiles that come out the same as last time aren't written
+            again. See TileHashStore. Defaults to False.
+
         Other options that must be specified but aren't really documented
         (oops. consider it a TODO):
         * worldname_orig
@@ -388,6 +426,51 @@ class TileSet(object):
         # This sets self.treedepth, self.xradius, and self.yradius
         self._set_map_size()
 
+        # The size of the tiles in pixels. Whatever the size of the block
+        # sprites, a render-tile covers the same chunks, 16 sprites across
+        self.tilesize = 16 * self.options.get('texturesize', 24)
+
+        # The c_overviewer.RenderMode for this tileset's rendermode. Built by
+        # the first render-tile in each process, see _render_rendertile()
+        self.rendermode = None
+
+        # Maps the colors of single color tiles to (the bytes of the file
+        # _save_tile() wrote for them, the color that file reads back as)
+        self.uniform_tiles = {}
+
+        # Maps the image paths of tiles written by this process to their
+        # mtime and the quadrant their parent needs of them, see
+        # _render_compositetile()
+        self.quadrants = None
+        if self.options.get('compositecache', 256) > 0:
+            self.quadrants = cache.LRUCache(size=self.options.get('compositecache', 256),
+                    name="composite quadrants")
+
+        # The hashes of the tiles as they were last written, see
+        # TileHashStore
+        self.hashes = None
+        if self.options.get('tilehashes', False):
+            self.hashes = TileHashStore(os.path.join(self.outputdir, "tilehashes"),
+                    self._get_hash_settings())
+
+    def _get_hash_settings(self):
+        """Returns everything besides the tiles' pixels that the tile files
+        depend on, for the TileHashStore"""
+        rendermode = self.options.get('rendermode')
+        if not isinstance(rendermode, basestring):
+            # a list of RenderPrimitives
+            rendermode = [(p.name, repr(sorted(p.option_values.items())))
+                    for p in rendermode or []]
+        return dict(treedepth=self.treedepth,
+                imgformat=self.imgextension,
+                imgquality=self.options.get('imgquality'),
+                bgcolor=self.options.get('bgcolor'),
+                optimizeimg=[(o.__class__.__name__, repr(sorted(vars(o).items())))
+                        for o in self.options.get('optimizeimg') or []],
+                rendermode=rendermode,
+                textures=self.textures and self.textures.get_cache_key(),
+                northdirection=getattr(self.regionset, "north_dir", 0))
+
     # Only pickle the initial state. Don't pickle anything resulting from the
     # do_preprocessing step
     def __getstate__(self):
@@ -434,16 +517,64 @@ class TileSet(object):
     def get_phase_length(self, phase):
         """Returns the number of work items in a given phase.
         """
+        # Each render-tile is a work item, and so is each subtree of
+        # upper-tiles with a dirty tile at its root
+        def count_jobs():
+            return self.dirtytree.count() + \
+                    sum(self.dirtytree.count_level(level) for level in self._get_job_levels())
         # Yeah functional programming!
         # and by functional we mean a bastardized python switch statement
         return {
-                0: lambda: self.dirtytree.count_all(),
-                #there is no good way to guess this so just give total count
-                1: lambda: (4**(self.treedepth+1)-1)/3,
-                2: lambda: self.dirtytree.count_all(),
+                0: count_jobs,
+                #there is no good way to guess this so just give total count:
+                #every render-tile, and every job root
+                1: lambda: 4**self.treedepth + sum(4**level for level in self._get_job_levels()),
+                2: count_jobs,
                 3: lambda: 0,
                 }[self.options['renderchecks']]()
 
+    def _get_job_levels(self):
+        """Returns the levels the CompositeJob roots are at, counted up from
+        the render-tiles in steps of composite_levels, and always including
+        the base tile's.
+
+        """
+        levels = range(self.treedepth - self.composite_levels, 0, -self.composite_levels)
+        return levels + [0]
+
+    def _get_job_root(self, tilepath):
+        """Returns the root of the CompositeJob the given upper-tile is
+        rendered in"""
+        offset = -(self.treedepth - len(tilepath)) % self.composite_levels
+        return tilepath[:max(len(tilepath) - offset, 0)]
+
+    def _group_composite_jobs(self, tilepaths):
+        """Takes an iterator over the paths of the tiles to render, with
+        children before their parents, and returns an iterator over
+        (work item, [dependencies, ...]) for them. Render-tiles are work items
+        on their own, while upper-tiles are gathered into a CompositeJob per
+        subtree, which waits for the work items below it.
+
+        """
+        # maps each job root to the upper-tiles of the job seen so far, and
+        # to the work items the job waits for
+        jobtiles = {}
+        jobdeps = {}
+        for tilepath in tilepaths:
+            if len(tilepath) == self.treedepth:
+                yield tilepath, []
+                jobdeps.setdefault(self._get_job_root(tilepath[:-1]), []).append(tilepath)
+                continue
+
+            root = self._get_job_root(tilepath)
+            jobtiles.setdefault(root, []).append(tilepath)
+            if tilepath == root:
+                # the root comes after everything below it
+                job = CompositeJob(root, tuple(jobtiles.pop(root)))
+                yield job, jobdeps.pop(root, [])
+                if root:
+                    jobdeps.setdefault(self._get_job_root(root[:-1]), []).append(job)
+
     def iterate_work_items(self, phase):
         """Iterates over the dirty tiles in the tree and return them in the
         appropriate order with the appropriate dependencies.
@@ -484,53 +615,90 @@ class TileSet(object):
         #
         # For modes 0 and 2, self.dirtytree holds exactly the tiles we need to
         # render. Iterate over the tiles in using the posttraversal() method.
-        # Yield each item. Easy.
+        # Easy.
         if self.options['renderchecks'] in (0,2):
-            for tilepath in self.dirtytree.posttraversal(robin=True):
-                dependencies = []
-                # These tiles may or may not exist, but the dispatcher won't
-                # care according to the worker interface protocol It will only
-                # wait for the items that do exist and are in the queue.
-                for i in range(4):
-                    dependencies.append( tilepath + (i,) )
-                if fd:
-                    write_out(tilepath)
-                yield tilepath, dependencies
+            tilepaths = self.dirtytree.posttraversal(robin=True)
 
         else:
             # For mode 1, self.dirtytree holds every tile that should exist,
             # but invoke _iterate_and_check_tiles() to determine which tiles
             # need rendering.
-            for tilepath, mtime, needs_rendering in self._iterate_and_check_tiles(()):
-                if needs_rendering:
-                    dependencies = []
-                    for i in range(4):
-                        dependencies.append( tilepath + (i,) )
-                    if fd:
-                        write_out(tilepath)
-                    yield tilepath, dependencies
+            tilepaths = (tilepath for tilepath, mtime, needs_rendering
+                    in self._iterate_and_check_tiles(()) if needs_rendering)
+
+        if fd:
+            def write_all(tilepaths):
+                for tilepath in tilepaths:
+                    write_out(tilepath)
+                    yield tilepath
+            tilepaths = write_all(tilepaths)
+
+        # The upper-tiles are rendered a subtree at a time, see
+        # _group_composite_jobs()
+        for item in self._group_composite_jobs(tilepaths):
+            yield item
 
     def do_work(self, tilepath):
         """Renders the given tile.
 
-        tilepath is yielded by iterate_work_items and is an iterable of
-        integers representing the path of the tile to render.
+        tilepath is yielded by iterate_work_items and is either an iterable
+        of integers representing the path of the tile to render, or a
+        CompositeJob.
 
         """
-        if len(tilepath) == self.treedepth:
+        if isinstance(tilepath, CompositeJob):
+            # A subtree of composite-tiles. Its tiles are built from each
+            # other's quadrants, even with no compositecache to keep them in
+            quadrants = self.quadrants
+            if quadrants is None:
+                quadrants = {}
+            group = self.get_work_group(tilepath)
+            for path in tilepath.tiles:
+                self._render_compositetile(*self._get_composite_dest(path),
+                        quadrants=quadrants, group=group)
+            # This is the last work item of its group, so the group's hashes
+            # are all in, but for those of render-tiles another process took
+            if self.hashes is not None:
+                self.hashes.save(group, self.fs_caps)
+        elif len(tilepath) == self.treedepth:
             # A render-tile
             self._render_rendertile(RenderTile.from_path(tilepath))
         else:
             # A composite-tile
-            if len(tilepath) == 0:
-                # The base tile
-                dest = self.outputdir
-                name = "base"
-            else:
-                # All others
-                dest = os.path.join(self.outputdir, *(str(x) for x in tilepath[:-1]))
-                name = str(tilepath[-1])
-            self._render_compositetile(dest, name)
+            self._render_compositetile(*self._get_composite_dest(tilepath))
+
+    def finish_work(self):
+        """Saves the hashes of the tiles this process rendered for work
+        groups whose CompositeJob ran somewhere else"""
+        if self.hashes is not None:
+            self.hashes.flush(self.fs_caps)
+
+    def _get_composite_dest(self, tilepath):
+        """Returns the (dest, name) arguments of _render_compositetile() for
+        the given upper-tile"""
+        if len(tilepath) == 0:
+            # The base tile
+            return self.outputdir, "base"
+        # All others
+        return os.path.join(self.outputdir, *(str(x) for x in tilepath[:-1])), str(tilepath[-1])
+
+    def get_work_group(self, tilepath):
+        """Groups tiles by their ancestor composite_levels levels above the
+        render-tiles, so each block of neighbouring render-tiles (8x8 of them
+        by default) is rendered by one process.
+        Neighbouring render-tiles share many of their chunks, so this way
+        they're loaded from that process's chunk cache instead of being read
+        and decoded again somewhere else.
+
+        The upper-tiles in the block go to the same process, so they can be
+        built from the quadrants it kept of their children. They make up one
+        CompositeJob, which is the last work item of the group, and every
+        other CompositeJob is a group of its own.
+
+        """
+        if isinstance(tilepath, CompositeJob):
+            tilepath = tilepath.root
+        return tilepath[:max(self.treedepth - self.composite_levels, 0)]
 
     def get_initial_data(self):
         """This is called similarly to get_persistent_data, but is called after
@@ -807,7 +975,7 @@ class TileSet(object):
         xradius = self.xradius
         yradius = self.yradius
 
-        dirty = RendertileSet(depth)
+        dirty = ArrayRendertileSet(depth)
 
         chunkcount = 0
         stime = time.time()
@@ -821,49 +989,55 @@ class TileSet(object):
 
         max_chunk_mtime = 0
 
+        # The index remembers the region headers from the last scan, so
+        # region files that haven't changed since aren't read again
+        scanindex = world.ChunkScanIndex(os.path.join(self.outputdir, "chunkscan.dat"), last_rendertime)
+
+        if markall or platform.system() == 'Windows':
+            chunk_arrays = self.regionset.iterate_chunk_arrays(scanindex)
+        else:
+            chunk_arrays = self.regionset.iterate_newer_chunk_arrays(last_rendertime, scanindex)
+            if scanindex.trusted:
+                # regions skipped because of the index held nothing newer
+                # than the last render
+                max_chunk_mtime = last_rendertime
+
 
         # For each chunk, do this:
         #   For each tile that the chunk touches, do this:
         #       Compare the last modified time of the chunk and tile. If the
         #       tile is older, mark it in a RendertileSet object as dirty.
+        #
+        # This is done with arrays, a region at a time: every chunk/tile pair
+        # of the region is computed at once, and the tiles that need marking
+        # are packed into keys and inserted into the set in one go at the end.
+        dirty_keys = []
 
-
-        for chunkx, chunkz, chunkmtime in self.regionset.iterate_chunks() if (markall or platform.system() == 'Windows') else self.regionset.iterate_newer_chunks(last_rendertime): 
-            chunkcount += 1
-
-            if chunkmtime > max_chunk_mtime:
-                max_chunk_mtime = chunkmtime
+        for chunkxs, chunkzs, chunkmtimes in chunk_arrays:
+            if not len(chunkxs):
+                continue
+            chunkcount += len(chunkxs)
+            max_chunk_mtime = max(max_chunk_mtime, int(chunkmtimes.max()))
 
             # Convert to diagonal coordinates
-            chunkcol, chunkrow = convert_coords(chunkx, chunkz)
-
-            for c, r in get_tiles_by_chunk(chunkcol, chunkrow):
-
-                # Make sure the tile is in the boundary we're rendering.
-                # This can happen when rendering at lower treedepth than
-                # can contain the entire map, but shouldn't happen if the
-                # treedepth is correctly calculated.
-                if (
-                        c < -xradius or
-                        c >= xradius or
-                        r < -yradius or
-                        r >= yradius
-                        ):
-                    continue
+            chunkcols, chunkrows = convert_coords(
+                    numpy.asarray(chunkxs, dtype=numpy.int64),
+                    numpy.asarray(chunkzs, dtype=numpy.int64))
 
-                # Computes the path in the quadtree from the col,row coordinates
-                tile = RenderTile.compute_path(c, r, depth)
+            index, cols, rows = get_tiles_by_chunks(chunkcols, chunkrows)
 
-                if markall:
-                    # markall mode: Skip all other checks, mark tiles
-                    # as dirty unconditionally
-                    dirty.add(tile.path)
-                    continue
+            # Make sure the tile is in the boundary we're rendering.
+            # This can happen when rendering at lower treedepth than
+            # can contain the entire map, but shouldn't happen if the
+            # treedepth is correctly calculated.
+            wanted = (cols >= -xradius) & (cols < xradius) & \
+                     (rows >= -yradius) & (rows < yradius)
 
-                # Check if this tile has already been marked dirty. If so,
-                # no need to do any of the below.
-                if dirty.query_path(tile.path):
-                    continue
+            if not markall:
+                # Check mtimes and conditionally add tile to the set. In
+                # markall mode, skip this and mark tiles as dirty
+                # unconditionally
+                touched = chunkmtimes[index] > last_rendertime
 
                 # Stochastic check. Since we're scanning by chunks and not
                 # by tiles, and the tiles get checked multiple times for
@@ -872,13 +1046,17 @@ class TileSet(object):
                 # rendering, but since a tile gets touched up to 32 times
                 # (once for each chunk in it), divide the probability by
                 # 32.
-                if rerender_prob and rerender_prob/32 > random.random():
-                    dirty.add(tile.path)
-                    continue
+                if rerender_prob:
+                    touched |= numpy.random.random_sample(len(index)) < rerender_prob/32
+
+                wanted &= touched
 
-                # Check mtimes and conditionally add tile to the set
-                if chunkmtime > last_rendertime:
-                    dirty.add(tile.path)
+            # Computes the paths in the quadtree from the col,row coordinates
+            keys = compute_tile_keys(cols[wanted], rows[wanted], depth)
+            dirty_keys.append(numpy.unique(keys))
+
+        if dirty_keys:
+            dirty.add_keys(numpy.concatenate(dirty_keys))
 
         t = int(time.time()-stime)
         logging.debug("Finished chunk scan for %s. %s chunks scanned in %s second%s",
@@ -886,50 +1064,75 @@ class TileSet(object):
                 "s" if t != 1 else "")
 
         self.max_chunk_mtime = max_chunk_mtime
+        scanindex.save(max_chunk_mtime, self.fs_caps)
         return dirty
 
     def __str__(self):
         return "<TileSet for %s>" % os.path.basename(self.outputdir)
 
-    def _render_compositetile(self, dest, name):
+    def _render_compositetile(self, dest, name, quadrants=None, group=None):
         """
         Renders a tile at os.path.join(dest, name)+".ext" by taking tiles from
         os.path.join(dest, name, "{0,1,2,3}.png")
 
         If name is "base" then render tile at os.path.join(dest, "base.png") by
         taking tiles from os.path.join(dest, "{0,1,2,3}.png")
+
+        Children found in quadrants, which defaults to self.quadrants, are
+        taken from there instead.
+
+        group is the work group of the tile, under which its hash is kept in
+        self.hashes. Without it the tile is rendered whether or not its
+        children changed.
         """
+        if quadrants is None:
+            quadrants = self.quadrants
         imgformat = self.imgextension
         imgpath = os.path.join(dest, name) + "." + imgformat
+        half = self.tilesize // 2
 
         if name == "base":
             # Special case for the base tile. Its children are in the same
             # directory instead of in a sub-directory
             quadPath = [
                     ((0,0),os.path.join(dest, "0." + imgformat)),
-                    ((192,0),os.path.join(dest, "1." + imgformat)),
-                    ((0, 192),os.path.join(dest, "2." + imgformat)),
-                    ((192,192),os.path.join(dest, "3." + imgformat)),
+                    ((half,0),os.path.join(dest, "1." + imgformat)),
+                    ((0, half),os.path.join(dest, "2." + imgformat)),
+                    ((half,half),os.path.join(dest, "3." + imgformat)),
                     ]
         else:
             quadPath = [
                     ((0,0),os.path.join(dest, name, "0." + imgformat)),
-                    ((192,0),os.path.join(dest, name, "1." + imgformat)),
-                    ((0, 192),os.path.join(dest, name, "2." + imgformat)),
-                    ((192,192),os.path.join(dest, name, "3." + imgformat)),
+                    ((half,0),os.path.join(dest, name, "1." + imgformat)),
+                    ((0, half),os.path.join(dest, name, "2." + imgformat)),
+                    ((half,half),os.path.join(dest, name, "3." + imgformat)),
                     ]
 
         # Check each of the 4 child tiles, getting their existance and mtime
-        # infomation. Also keep track of the max mtime of all children
+        # infomation. Also keep track of the max mtime of all children.
+        # Children this process just wrote are taken from self.quadrants
+        # instead, and don't need to be read again
         max_mtime = 0
         quadPath_filtered = []
+        quads = {}
+        sizes = {}
         for path in quadPath:
-            try:
-                quad_mtime = os.stat(path[1])[stat.ST_MTIME]
-            except OSError:
-                # This tile doesn't exist or some other error with the stat
-                # call. Move on.
-                continue
+            buffered = None
+            if quadrants is not None:
+                buffered = quadrants.get(path[1])
+            if buffered:
+                # each tile only has the one parent
+                del quadrants[path[1]]
+                quad_mtime, quads[path[1]] = buffered
+            else:
+                try:
+                    st = os.stat(path[1])
+                except OSError:
+                    # This tile doesn't exist or some other error with the stat
+                    # call. Move on.
+                    continue
+                quad_mtime = st[stat.ST_MTIME]
+                sizes[path[1]] = st[stat.ST_SIZE]
             # The tile exists, so we need to use it in our rendering of this
             # composite tile
             quadPath_filtered.append(path)
@@ -947,16 +1150,41 @@ class TileSet(object):
             logging.warning("Tile %s was requested for render, but no children were found! This is probably a bug", imgpath)
             return
 
+        # This tile's hash is made of its children's stamps. If none of them
+        # changed since it was written, it hasn't either, and keeps its own
+        # stamp for its parent to see the same
+        digest = None
+        if group is not None and self.hashes is not None:
+            try:
+                digest = hashlib.md5(repr([(path[0], self.hashes.get_stamp(path[1]))
+                        for path in quadPath_filtered])).digest()
+            except OSError:
+                # a child's file is missing, so there's no telling whether
+                # it changed
+                pass
+            else:
+                if self.hashes.unchanged(group, imgpath, digest) is not None:
+                    return
+
         #logging.debug("writing out compositetile {0}".format(imgpath))
 
         # Create the actual image now
-        img = Image.new("RGBA", (384, 384), self.options['bgcolor'])
+        img = Image.new("RGBA", (self.tilesize, self.tilesize), self.options['bgcolor'])
 		
         # we'll use paste (NOT alpha_over) for quadtree generation because
         # this is just straight image stitching, not alpha blending
 
         for path in quadPath_filtered:
+            if path[1] in quads:
+                img.paste(quads[path[1]], path[0])
+                continue
             try:
+                # single color tiles need no decoding or resizing
+                color = self._get_uniform_color(path[1], sizes[path[1]])
+                if color is not None:
+                    img.paste(color, path[0] + (path[0][0] + half, path[0][1] + half))
+                    continue
+
                 #quad = Image.open(path[1]).resize((192,192), Image.ANTIALIAS)
                 src = Image.open(path[1])
                 # optimizeimg may have converted them to a palette image in the meantime
@@ -964,7 +1192,7 @@ class TileSet(object):
                     src = src.convert("RGBA")
                 src.load()
 
-                quad = Image.new("RGBA", (192, 192), self.options['bgcolor'])
+                quad = Image.new("RGBA", (half, half), self.options['bgcolor'])
                 resize_half(quad, src)
                 img.paste(quad, path[0])
             except Exception, e:
@@ -976,23 +1204,12 @@ class TileSet(object):
                     logging.error("While attempting to delete corrupt image %s, an error was encountered. You will need to delete it yourself. Error was '%s'", path[1], e)
 
         # Save it
-        with FileReplacer(imgpath, capabilities=self.fs_caps) as tmppath:
-            if imgformat == 'jpg':
-                img.save(tmppath, "jpeg", quality=self.options['imgquality'], subsampling=0)
-            else: # png
-                img.save(tmppath, "png")
+        self._save_tile(img, imgpath, max_mtime)
+        if digest is not None:
+            self.hashes.record(group, imgpath, digest)
 
-            if self.options['optimizeimg']:
-                optimize_image(tmppath, imgformat, self.options['optimizeimg'])
-
-            try:
-                os.utime(tmppath, (max_mtime, max_mtime))
-            except OSError, e:
-                # Ignore errno ENOENT: file does not exist. Due to a race
-                # condition, two processes could conceivably try and update
-                # the same temp file at the same time
-                if e.errno != errno.ENOENT:
-                    raise
+        if name != "base":
+            self._keep_quadrant(imgpath, img, max_mtime, quadrants)
 
     def _render_rendertile(self, tile):
         """Renders the given render-tile.
@@ -1042,25 +1259,46 @@ class TileSet(object):
         #logging.debug("writing out worldtile {0}".format(imgpath))
 
         # Compile this image
-        tileimg = Image.new("RGBA", (384, 384), self.options['bgcolor'])
+        tileimg = Image.new("RGBA", (self.tilesize, self.tilesize), self.options['bgcolor'])
+
+        # Each render_loop call below loads its chunk and the chunks around
+        # it. Keep the chunks of this tile and their neighbours loaded across
+        # the calls, so each is only asked of the regionset once.
+        chunkxs = [chunk[2] for chunk in chunks]
+        chunkzs = [chunk[4] for chunk in chunks]
+        chunkcache = c_overviewer.ChunkCache(self.regionset,
+                min(chunkxs) - 1, min(chunkzs) - 1, max(chunkxs) + 1, max(chunkzs) + 1)
+
+        # Starting the render mode's primitives is only done once per
+        # process, every section of every tile then reuses it
+        if self.rendermode is None:
+            try:
+                self.rendermode = c_overviewer.RenderMode(self.options['rendermode'],
+                        self.world, self.textures)
+            except Exception, e:
+                logging.error("Could not set up the rendermode for %s. This is likely a render primitive option error.", self.options['name'])
+                logging.error("Full error was:", exc_info=1)
+                sys.exit(1)
 
         colstart = tile.col
         rowstart = tile.row
-        # col colstart will get drawn on the image starting at x coordinates -(384/2)
-        # row rowstart will get drawn on the image starting at y coordinates -(192/2)
+        half = self.tilesize // 2
+        quarter = self.tilesize // 4
+        # col colstart will get drawn on the image starting at x coordinates -(tilesize/2)
+        # row rowstart will get drawn on the image starting at y coordinates -(tilesize/4)
         max_chunk_mtime = 0
         for col, row, chunkx, chunky, chunkz, chunk_mtime in chunks:
-            xpos = -192 + (col-colstart)*192
-            ypos = -96 + (row-rowstart)*96 + (16-1 - chunky)*192
+            xpos = -half + (col-colstart)*half
+            ypos = -quarter + (row-rowstart)*quarter + (16-1 - chunky)*half
 
             if chunk_mtime > max_chunk_mtime:
                 max_chunk_mtime = chunk_mtime
 
             # draw the chunk!
             try:
-                c_overviewer.render_loop(self.world, self.regionset, chunkx, chunky,
+                c_overviewer.render_loop(self.world, chunkcache, chunkx, chunky,
                         chunkz, tileimg, xpos, ypos,
-                        self.options['rendermode'], self.textures)
+                        self.rendermode, self.textures)
             except nbt.CorruptionError:
                 # A warning and traceback was already printed by world.py's
                 # get_chunk()
@@ -1086,17 +1324,93 @@ class TileSet(object):
             #draw.text((96,48), "C: %s,%s" % (chunkx, chunkz), fill='red')
             #draw.text((96,96), "c,r: %s,%s" % (col, row), fill='red')
 
+        # Skip the write if the tile came out the same as last time. The file
+        # keeps its mtime, so its parent sees it's unchanged as well
+        digest = None
+        if self.hashes is not None:
+            group = self.get_work_group(tile.path)
+            digest = hashlib.md5(tileimg.tobytes()).digest()
+            mtime = self.hashes.unchanged(group, imgpath, digest)
+            if mtime is not None:
+                self._keep_quadrant(imgpath, tileimg, mtime)
+                return
+
         # Save them
+        self._save_tile(tileimg, imgpath, max_chunk_mtime)
+        if digest is not None:
+            self.hashes.record(group, imgpath, digest)
+
+        self._keep_quadrant(imgpath, tileimg, max_chunk_mtime)
+
+    def _save_tile(self, img, imgpath, mtime):
+        """Saves the tile image to imgpath, and gives it the given mtime.
+
+        Tiles of a single color, like the empty ones at the edges of the map,
+        are only encoded and optimized the first time. After that the file
+        from the first time is written again, see self.uniform_tiles.
+
+        """
+        colors = img.getcolors(1)
+        uniform = None
+        if colors:
+            uniform = self.uniform_tiles.get(colors[0][1])
+
         with FileReplacer(imgpath, capabilities=self.fs_caps) as tmppath:
-            if self.imgextension == 'jpg':
-                tileimg.save(tmppath, "jpeg", quality=self.options['imgquality'], subsampling=0)
-            else: # png
-                tileimg.save(tmppath, "png")
+            if uniform:
+                with open(tmppath, "wb") as f:
+                    f.write(uniform[0])
+            else:
+                if self.imgextension == 'jpg':
+                    img.save(tmppath, "jpeg", quality=self.options['imgquality'], subsampling=0)
+                else: # png
+                    img.save(tmppath, "png")
 
-            if self.options['optimizeimg']:
-                optimize_image(tmppath, self.imgextension, self.options['optimizeimg'])
-            
-            os.utime(tmppath, (max_chunk_mtime, max_chunk_mtime))
+                if self.options['optimizeimg']:
+                    optimize_image(tmppath, self.imgextension, self.options['optimizeimg'])
+
+                if colors and len(self.uniform_tiles) < 16:
+                    with open(tmppath, "rb") as f:
+                        data = f.read()
+                    # the color it reads back as, for _get_uniform_color()
+                    decoded = Image.open(tmppath).convert("RGBA").getcolors(1)
+                    self.uniform_tiles[colors[0][1]] = (data, decoded and decoded[0][1])
+
+            try:
+                os.utime(tmppath, (mtime, mtime))
+            except OSError, e:
+                # Ignore errno ENOENT: file does not exist. Due to a race
+                # condition, two processes could conceivably try and update
+                # the same temp file at the same time
+                if e.errno != errno.ENOENT:
+                    raise
+
+    def _get_uniform_color(self, imgpath, size):
+        """Returns the color the tile at imgpath, which is size bytes long,
+        reads back as if it's one of the single color tiles _save_tile() wrote,
+        or None"""
+        for data, color in self.uniform_tiles.itervalues():
+            if color is not None and len(data) == size:
+                with open(imgpath, "rb") as f:
+                    if f.read(size + 1) == data:
+                        return color
+        return None
+
+    def _keep_quadrant(self, imgpath, img, mtime, quadrants=None):
+        """Keeps the half size image of a tile that was just written to
+        imgpath in quadrants, which defaults to self.quadrants, for
+        _render_compositetile() to use when it renders the tile's parent. The
+        image is the one from before it was saved, so for jpeg or with lossy
+        optimizers the parent is built from slightly better data than it would
+        be from disk.
+
+        """
+        if quadrants is None:
+            quadrants = self.quadrants
+            if quadrants is None:
+                return
+        quad = Image.new("RGBA", (self.tilesize // 2, self.tilesize // 2), self.options['bgcolor'])
+        resize_half(quad, img)
+        quadrants[imgpath] = (mtime, quad)
 
     def _iterate_and_check_tiles(self, path):
         """A generator function over all tiles that should exist in the subtree
@@ -1256,6 +1570,136 @@ class TileSet(object):
                 logging.debug("Found a subtree that shouldn't exist. Deleting it: %s", dirpath)
                 shutil.rmtree(dirpath)
 
+class TileHashStore(object):
+    """The hashes of a tileset's tiles as they were last written, kept on disk
+    between renders. A tile that renders to the same hash as before needn't
+    be written again, and as its file is left alone, its parent can tell it
+    didn't change either.
+
+    Each entry also holds the stamp of the tile's file once written: its
+    size, mtime, inode and ctime. Tiles are written to a new file that is
+    renamed into place, so any rewrite of a tile changes its stamp, even one
+    with the same size and mtime. An entry only counts while the file still
+    has its stamp.
+
+    The entries are kept in one file per work group (see
+    TileSet.get_work_group()) in the directory dirname, written by save()
+    when the group's CompositeJob is done. The render-tiles of a group can
+    be taken by other processes, which write the entries they recorded to
+    files of their own with flush() once they're done. Those are merged into
+    the group's file the next time it is saved. settings is whatever else
+    the tiles depend on: files saved with other settings are ignored.
+
+    """
+    version = 2
+
+    def __init__(self, dirname, settings):
+        self.dirname = dirname
+        self.settings = settings
+        # maps work groups to their entries: {imgpath: (stamp, digest)}
+        self._groups = {}
+        # the entries recorded for each group since it was last saved
+        self._recorded = {}
+
+    def _get_name(self, group):
+        return "".join(str(x) for x in group) or "base"
+
+    def _get_filenames(self, group):
+        """Returns the group's file, and the files other processes wrote
+        for it"""
+        name = self._get_name(group)
+        others = glob.glob(os.path.join(self.dirname, name + "-*.dat"))
+        return os.path.join(self.dirname, name + ".dat"), others
+
+    def _read(self, filename):
+        try:
+            with open(filename, "rb") as f:
+                data = cPickle.load(f)
+            if data["version"] == self.version and data["settings"] == self.settings:
+                return data["tiles"]
+        except Exception:
+            if os.path.exists(filename):
+                logging.warning("The tile hashes in %s couldn't be read. Ignoring them.", filename)
+                logging.debug("Full traceback:", exc_info=1)
+        return {}
+
+    def _write(self, filename, entries, capabilities):
+        try:
+            os.makedirs(self.dirname)
+        except OSError, e:
+            # Another process may have just created it
+            if e.errno != errno.EEXIST:
+                raise
+        data = dict(version=self.version, settings=self.settings, tiles=entries)
+        with FileReplacer(filename, capabilities=capabilities) as tmpname:
+            with open(tmpname, "wb") as f:
+                cPickle.dump(data, f, cPickle.HIGHEST_PROTOCOL)
+
+    def _get_entries(self, group):
+        entries = self._groups.get(group)
+        if entries is None:
+            filename, others = self._get_filenames(group)
+            entries = self._groups[group] = self._read(filename)
+            for other in others:
+                entries.update(self._read(other))
+        return entries
+
+    @staticmethod
+    def get_stamp(imgpath):
+        """Returns the stamp of the given file. Raises OSError if there is no
+        such file."""
+        st = os.stat(imgpath)
+        return st.st_size, st.st_mtime, st.st_ino, st.st_ctime
+
+    def unchanged(self, group, imgpath, digest):
+        """If the tile at imgpath is the one written with the given digest,
+        returns its mtime. Otherwise returns None."""
+        entry = self._get_entries(group).get(imgpath)
+        if entry is None or entry[1] != digest:
+            return None
+        try:
+            if self.get_stamp(imgpath) != entry[0]:
+                return None
+        except OSError:
+            return None
+        return entry[0][1]
+
+    def record(self, group, imgpath, digest):
+        """Records the digest of the tile that was just written to imgpath"""
+        entry = (self.get_stamp(imgpath), digest)
+        self._get_entries(group)[imgpath] = entry
+        self._recorded.setdefault(group, {})[imgpath] = entry
+
+    def save(self, group, capabilities=default_caps):
+        """Writes out the group's file, once the group is done, with the
+        entries other processes wrote for it merged in. Lets go of the
+        group's entries."""
+        recorded = self._recorded.pop(group, None)
+        self._groups.pop(group, None)
+        if not recorded:
+            return
+        filename, others = self._get_filenames(group)
+        entries = self._read(filename)
+        for other in others:
+            entries.update(self._read(other))
+        entries.update(recorded)
+        self._write(filename, entries, capabilities)
+        for other in others:
+            try:
+                os.remove(other)
+            except OSError:
+                pass
+
+    def flush(self, capabilities=default_caps):
+        """Writes the entries recorded for groups that weren't saved to
+        files of this process's own, for save() to merge in"""
+        for group, recorded in self._recorded.iteritems():
+            filename = os.path.join(self.dirname, "%s-%s-%d.dat" % (self._get_name(group),
+                    platform.node(), os.getpid()))
+            self._write(filename, recorded, capabilities)
+        self._recorded = {}
+        self._groups = {}
+
 ##
 ## Functions for converting (x, z) to (col, row) and back
 ##
@@ -1309,6 +1753,29 @@ def get_tiles_by_chunk(chunkcol, chunkrow):
 
     return product(colrange, rowrange)
 
+def get_tiles_by_chunks(chunkcols, chunkrows):
+    """Array version of get_tiles_by_chunk(). Takes numpy arrays of chunk
+    columns and rows, and returns three arrays (index, tilecols, tilerows)
+    with one item per chunk and render tile it touches, where index is the
+    position of the chunk in the given arrays.
+
+    """
+    tilecols = chunkcols - chunkcols % 2
+    tilerows = chunkrows - chunkrows % 4
+
+    # Consider every chunk against the two columns and ten rows of tiles it
+    # can touch. Only chunks in an even column span the first column, and
+    # only chunks in a row divisible by 4 touch the first row.
+    cols = tilecols[:,None] + numpy.array([-2, 0])
+    rows = tilerows[:,None] + 4 * numpy.arange(-1, 9)
+    colmask = numpy.ones(cols.shape, dtype=bool)
+    colmask[:,0] = chunkcols % 2 == 0
+    rowmask = numpy.ones(rows.shape, dtype=bool)
+    rowmask[:,0] = chunkrows % 4 == 0
+
+    index, colidx, rowidx = numpy.nonzero(colmask[:,:,None] & rowmask[:,None,:])
+    return index, cols[index, colidx], rows[index, rowidx]
+
 def get_chunks_by_tile(tile, regionset):
     """Get chunk sections that are relevant to the given render-tile. Only
     returns chunk sections that are in chunks that actually exist according to
@@ -1429,6 +1896,13 @@ class RendertileSet(object):
 
         self._add_helper(self.children, list(reversed(path)))
 
+    def update(self, paths):
+        """Marks every leaf node path in the given iterable as in this set
+
+        """
+        for path in paths:
+            self.add(path)
+
     def _add_helper(self, children, path):
         """Recursive helper for add()
         """
@@ -1590,6 +2064,248 @@ class RendertileSet(object):
             logging.error("Please report this to the developers: RendertileSet num_tiles_all=%r, count_all=%r, children=%r", self.num_tiles, num, self.children)
         return num
 
+    def count_level(self, level):
+        """Returns the number of tiles in this set at the given level,
+        counting implicitly marked upper-tiles. Level 0 is the base tile.
+
+        """
+        if level == 0:
+            return 1 if self else 0
+        return sum(1 for _ in self.iterate(level))
+
+def _unique_sorted(keys):
+    """Returns the distinct values of an already sorted numpy array"""
+    if len(keys) == 0:
+        return keys
+    mask = numpy.empty(len(keys), dtype=bool)
+    mask[0] = True
+    numpy.not_equal(keys[1:], keys[:-1], out=mask[1:])
+    return keys[mask]
+
+class ArrayRendertileSet(object):
+    """A drop-in alternative to RendertileSet, holding the same set of
+    render-tiles in a sorted numpy array instead of a tree of lists.
+
+    Each render-tile is stored as its path read as a base-4 number. Since the
+    path digits alternate between the x and y halving of the map, this is the
+    Morton (Z-order) code of the tile, and all the tiles under an upper-tile
+    form one contiguous run of the array. The upper-tiles at a given level
+    are then just the distinct keys shifted right by two bits per level, so
+    counting, querying and traversing the set are whole-array operations.
+
+    Paths added one at a time with add() are buffered and merged into the
+    array the next time the set is read. Use update() or add_keys() to add
+    many tiles at once.
+
+    """
+    __slots__ = ("depth", "_keys", "_pending")
+
+    # children offsets used by distance_sort(), by child number
+    _child_dx = numpy.array([-1, 1, -1, 1], dtype=numpy.int64)
+    _child_dy = numpy.array([-1, -1, 1, 1], dtype=numpy.int64)
+
+    def __init__(self, depth):
+        """Initialize a new, empty set of tiles for a tree of the given depth
+
+        """
+        # keys are 2 bits per level, and must fit in an int64
+        if not 0 < depth <= 31:
+            raise ValueError("ArrayRendertileSet depth must be between 1 and 31")
+        self.depth = depth
+        self._keys = numpy.zeros(0, dtype=numpy.int64)
+        self._pending = []
+
+    def add(self, path):
+        """Marks the requested leaf node as in this set
+
+        Path is an iterable of integers representing the path to the leaf node
+        that is to be added to the set
+
+        """
+        path = list(path)
+        assert len(path) == self.depth
+
+        key = 0
+        for p in path:
+            key = (key << 2) | p
+        self._pending.append(key)
+
+    def update(self, paths):
+        """Marks every leaf node path in the given iterable as in this set.
+        Paths may also be given as an array with one row per path.
+
+        """
+        paths = numpy.asarray(paths, dtype=numpy.int64).reshape(-1, self.depth)
+        self.add_keys(paths.dot(4 ** numpy.arange(self.depth - 1, -1, -1, dtype=numpy.int64)))
+
+    def add_keys(self, keys):
+        """Marks the leaf nodes with the given packed keys as in this set.
+        Keys are paths read as base-4 numbers, most significant digit first.
+
+        """
+        self._merge(numpy.asarray(keys, dtype=numpy.int64).ravel())
+
+    def _merge(self, keys=None):
+        """Merges any pending and given keys into the sorted key array and
+        returns it
+
+        """
+        parts = [self._keys]
+        if self._pending:
+            parts.append(numpy.array(self._pending, dtype=numpy.int64))
+            self._pending = []
+        if keys is not None and len(keys):
+            parts.append(keys)
+        if len(parts) > 1:
+            self._keys = numpy.unique(numpy.concatenate(parts))
+        return self._keys
+
+    def _level_keys(self, level):
+        """Returns the sorted keys of the tiles at the given level"""
+        return _unique_sorted(self._merge() >> (2 * (self.depth - level)))
+
+    def __iter__(self):
+        return self.iterate()
+
+    def iterate(self, level=None, robin=False, offset=(0,0)):
+        """Returns an iterator over every tile in this set, in the same order
+        and with the same arguments as RendertileSet.iterate()
+
+        """
+        if level is None:
+            level = self.depth
+        elif not (level > 0 and level <= self.depth):
+            raise ValueError("Level parameter must be between 1 and %s" % self.depth)
+
+        return self._traverse([level], robin, offset)
+
+    def posttraversal(self, robin=False, offset=(0,0)):
+        """Returns an iterator over tile paths for every tile in the set,
+        including the implicitly marked upper-tiles, in the same order as
+        RendertileSet.posttraversal()
+
+        """
+        if not self:
+            return iter(())
+        return chain(self._traverse(range(1, self.depth + 1), robin, offset), [()])
+
+    def _traverse(self, levels, robin, offset):
+        """Returns an iterator over the paths of the tiles at the given
+        levels, in post-traversal order.
+
+        RendertileSet visits the children of each node in distance_sort()
+        order. Here the rank of each tile among its siblings in that order is
+        computed level by level for all tiles at once, and the tiles are then
+        sorted by their ranks along the path, with upper-tiles after their
+        children.
+
+        """
+        maxlevel = max(levels)
+        keys = self._level_keys(maxlevel)
+        if len(keys) == 0:
+            return iter(())
+
+        shifts = 2 * numpy.arange(maxlevel - 1, -1, -1, dtype=numpy.int64)
+        digits = ((keys[:,None] >> shifts) & 3).astype(numpy.uint8)
+        ranks = numpy.empty_like(digits)
+
+        off_x = numpy.empty(len(keys), dtype=numpy.int64)
+        off_y = numpy.empty(len(keys), dtype=numpy.int64)
+        off_x.fill(offset[0])
+        off_y.fill(offset[1])
+        childnums = numpy.arange(4)
+        for i in xrange(maxlevel):
+            d = digits[:,i]
+            # distance_sort() sorts siblings by x*x + y*y, where x is
+            # 2*off_x + dx. Between siblings that only differs by the term
+            # off_x*dx + off_y*dy, and ties keep the child number order.
+            dist = off_x[:,None] * self._child_dx + off_y[:,None] * self._child_dy
+            own = dist[numpy.arange(len(d)), d][:,None]
+            ranks[:,i] = ((dist < own) | ((dist == own) & (childnums < d[:,None]))).sum(axis=1)
+            off_x = off_x * 2 + self._child_dx[d]
+            off_y = off_y * 2 + self._child_dy[d]
+
+        # Collect each wanted tile from the rows of its first descendant,
+        # with the ranks below its own level past any child's rank
+        alldigits = []
+        allranks = []
+        alllevels = []
+        for level in levels:
+            first = numpy.flatnonzero(numpy.concatenate(([True],
+                numpy.diff(keys >> (2 * (maxlevel - level))) != 0)))
+            levelranks = ranks[first]
+            levelranks[:,level:] = 4
+            alldigits.append(digits[first])
+            allranks.append(levelranks)
+            alllevels.append(numpy.empty(len(first), dtype=numpy.intp))
+            alllevels[-1].fill(level)
+        digits = numpy.concatenate(alldigits)
+        ranks = numpy.concatenate(allranks)
+        levels = numpy.concatenate(alllevels)
+
+        order = numpy.lexsort(ranks.T[::-1])
+        digits = digits[order]
+        levels = levels[order]
+        if not robin:
+            return self._iterate_paths(digits, levels)
+
+        # Only the top-level subtrees are interleaved, as in RendertileSet
+        bounds = numpy.searchsorted(ranks[order,0], [1, 2, 3])
+        return roundrobin([self._iterate_paths(d, l) for d, l in
+                izip(numpy.split(digits, bounds), numpy.split(levels, bounds)) if len(d)])
+
+    @staticmethod
+    def _iterate_paths(digits, levels, blocksize=4096):
+        """Yields path tuples from rows of digits, truncated to each level"""
+        for start in xrange(0, len(digits), blocksize):
+            for row, level in izip(digits[start:start+blocksize].tolist(),
+                                   levels[start:start+blocksize].tolist()):
+                yield tuple(row[:level])
+
+    def query_path(self, path):
+        """Queries for the state of the given tile in the tree.
+
+        Returns True for items in the set, False otherwise. Works for
+        rendertiles as well as upper tiles (which are True if they have a
+        descendent that is in the set)
+
+        """
+        keys = self._merge()
+        shift = 2 * (self.depth - len(path))
+        prefix = 0
+        for p in path:
+            prefix = (prefix << 2) | p
+        i = numpy.searchsorted(keys, prefix << shift)
+        return bool(i < len(keys) and keys[i] < (prefix + 1) << shift)
+
+    def __nonzero__(self):
+        """Returns True if any tile is in the set"""
+        return len(self._merge()) > 0
+
+    def count(self):
+        """Returns the total number of render-tiles in this set.
+
+        """
+        return len(self._merge())
+
+    def count_all(self):
+        """Returns the total number of render-tiles plus implicitly marked
+        upper-tiles in this set
+
+        """
+        if not self:
+            return 0
+        return 1 + sum(len(self._level_keys(level)) for level in xrange(1, self.depth + 1))
+
+    def count_level(self, level):
+        """Returns the number of tiles in this set at the given level, like
+        RendertileSet.count_level()
+
+        """
+        if level == 0:
+            return 1 if self else 0
+        return len(self._level_keys(level))
+
 def distance_sort(children, (off_x, off_y)):
     order = []
     for child, (dx, dy) in izip(children, [(-1,-1), (1,-1), (-1,1), (1,1)]):
@@ -1599,6 +2315,24 @@ def distance_sort(children, (off_x, off_y)):
 
     return sorted(order, key=lambda (_, (x,y)): x*x + y*y)
 
+def compute_tile_keys(cols, rows, depth):
+    """Array version of RenderTile.compute_path(). Takes numpy arrays of tile
+    columns and rows, and returns the tiles' paths packed into the int64 keys
+    used by ArrayRendertileSet.
+
+    """
+    # Each path digit picks the right half of the remaining area with its low
+    # bit and the bottom half with its high bit, so the key is the tile's x
+    # and y index counted from the top-left of the map with their bits
+    # interleaved.
+    xs = (numpy.asarray(cols, dtype=numpy.int64) + 2**depth) // 2
+    ys = (numpy.asarray(rows, dtype=numpy.int64) + 2*2**depth) // 4
+    keys = numpy.zeros(xs.shape, dtype=numpy.int64)
+    for bit in xrange(depth):
+        keys |= ((xs >> bit) & 1) << (2*bit)
+        keys |= ((ys >> bit) & 1) << (2*bit + 1)
+    return keys
+
 class RenderTile(object):
     """A simple container class that represents a single render-tile.
 
@@ -14,6 +14,7 @@
 #    with the Overviewer.  If not, see <http://www.gnu.org/licenses/>.
 
 import functools
+import itertools
 import os
 import os.path
 import logging
@@ -22,11 +23,14 @@ import time
 import random
 import re
 import locale
+import platform
+import cPickle
 
 import numpy
 
 from . import nbt
 from . import cache
+from .files import FileReplacer, default_caps
 
 """
 This module has routines for extracting information about available worlds
@@ -227,6 +231,17 @@ class World(object):
 
         return spawnX, spawnY, spawnZ
 
+# The only parts of a chunk that the renderer reads. Everything else
+# (entities, tile ticks, heightmaps...) is skipped over by the NBT reader
+# unless get_chunk() is asked for the entities.
+_render_tagpaths = ("Level/Sections", "Level/Biomes")
+
+# Region files are memory-mapped, so that worker processes share the page
+# cache. Not on Windows though, where a mapped file can't be truncated by the
+# server that owns it. Elsewhere, regions written to since the render started
+# are read without mmap, see nbt.MCRFileReader.
+_mmap_regions = platform.system() != "Windows"
+
 class RegionSet(object):
     """This object is the gateway to a particular Minecraft dimension within a
     world. It corresponds to a set of region files containing the actual
@@ -252,6 +267,8 @@ class RegionSet(object):
         in-memory.
 
         """
+        # region files modified after this aren't memory-mapped
+        self.start_time = time.time()
         self.regiondir = os.path.normpath(regiondir)
         self.rel = os.path.normpath(rel)
         logging.debug("regiondir is %r" % self.regiondir)
@@ -273,7 +290,8 @@ class RegionSet(object):
         self.regionfiles = {}
 
         # This holds a cache of open regionfile objects
-        self.regioncache = cache.LRUCache(size=16, destructor=lambda regionobj: regionobj.close())
+        self.regioncache = cache.LRUCache(size=16, destructor=lambda regionobj: regionobj.close(),
+                name="RegionFileCache")
         
         for x, y, regionfile in self._iterate_regionfiles():
             # regionfile is a pathname
@@ -284,9 +302,10 @@ class RegionSet(object):
 
     # Re-initialize upon unpickling
     def __getstate__(self):
-        return (self.regiondir, self.rel)
+        return (self.regiondir, self.rel, self.start_time)
     def __setstate__(self, state):
-        return self.__init__(*state)
+        self.__init__(*state[:2])
+        self.start_time = state[2]
 
     def __repr__(self):
         return "<RegionSet regiondir=%r>" % self.regiondir
@@ -307,12 +326,15 @@ class RegionSet(object):
         try:
             return self.regioncache[regionfilename]
         except KeyError:
-            region = nbt.load_region(regionfilename)
+            # a region that changed since the render started may be
+            # being written to, and get truncated under the mapping
+            use_mmap = _mmap_regions and os.path.getmtime(regionfilename) < self.start_time
+            region = nbt.load_region(regionfilename, use_mmap=use_mmap)
             self.regioncache[regionfilename] = region
             return region
     
     #@log_other_exceptions
-    def get_chunk(self, x, z):
+    def get_chunk(self, x, z, entities=False):
         """Returns a dictionary object representing the "Level" NBT Compound
         structure for a chunk given its x, z coordinates. The coordinates given
         are chunk coordinates. Raises ChunkDoesntExist exception if the given
@@ -321,6 +343,10 @@ class RegionSet(object):
         The returned dictionary corresponds to the "Level" structure in the
         chunk file, with a few changes:
 
+        * Only the Sections and Biomes tags are read, unless entities is
+          True, in which case the whole structure (including Entities and
+          TileEntities) is read
+
         * The Biomes array is transformed into a 16x16 numpy array
 
         * For each chunk section:
@@ -348,7 +374,7 @@ class RegionSet(object):
         while True:
             try:
                 region = self._get_regionobj(regionfile)
-                data = region.load_chunk(x, z)
+                data = region.load_chunk(x, z, None if entities else _render_tagpaths)
             except nbt.CorruptionError, e:
                 tries -= 1
                 if tries > 0:
@@ -464,14 +490,9 @@ class RegionSet(object):
         
         """
 
-        for (regionx, regiony), (regionfile, filemtime) in self.regionfiles.iteritems():
-            try:
-                mcr = self._get_regionobj(regionfile)
-            except nbt.CorruptRegionError:
-                logging.warning("Found a corrupt region file at %s,%s in %s, Skipping it.", regionx, regiony, self.regiondir)
-                continue
-            for chunkx, chunky in mcr.get_chunks():
-                yield chunkx+32*regionx, chunky+32*regiony, mcr.get_chunk_timestamp(chunkx, chunky)
+        for xs, zs, mtimes in self.iterate_chunk_arrays():
+            for chunk in itertools.izip(xs.tolist(), zs.tolist(), mtimes.tolist()):
+                yield chunk
 
     def iterate_newer_chunks(self, mtime):
         """Returns an iterator over all chunk metadata in this world. Iterates
@@ -480,19 +501,62 @@ class RegionSet(object):
         
         """
 
+        for xs, zs, mtimes in self.iterate_newer_chunk_arrays(mtime):
+            for chunk in itertools.izip(xs.tolist(), zs.tolist(), mtimes.tolist()):
+                yield chunk
+
+    def iterate_chunk_arrays(self, scanindex=None):
+        """Like iterate_chunks(), but iterates over one (x,z,mtime) tuple of
+        numpy arrays per region file, so whole regions can be processed at
+        once. See iterate_newer_chunk_arrays() for scanindex.
+
+        """
+        return self.iterate_newer_chunk_arrays(None, scanindex)
+
+    def iterate_newer_chunk_arrays(self, mtime, scanindex=None):
+        """Like iterate_newer_chunks(), but iterates over one (x,z,mtime)
+        tuple of numpy arrays per region file. An mtime of None includes every
+        region.
+
+        scanindex, if given, is a ChunkScanIndex. Region files it has seen
+        before, unchanged, are not opened; their chunks come from the index.
+        If the index is trusted, such regions are skipped entirely when
+        looking for newer chunks, and of the regions that did change only
+        the chunks whose timestamps changed are returned.
+
+        """
+
         for (regionx, regiony), (regionfile, filemtime) in self.regionfiles.iteritems():
+            chunks = previous = None
+            if scanindex is not None:
+                try:
+                    stamp, chunks, previous = scanindex.lookup(regionfile)
+                except OSError:
+                    # deleted since we listed the directory
+                    continue
+                if chunks is not None and mtime is not None and scanindex.trusted:
+                    continue
+
             """ SKIP LOADING A REGION WHICH HAS NOT BEEN MODIFIED! """
-            if (filemtime < mtime):
+            if mtime is not None and filemtime < mtime:
                 continue
 
-            try:
-                mcr = self._get_regionobj(regionfile)
-            except nbt.CorruptRegionError:
-                logging.warning("Found a corrupt region file at %s,%s in %s, Skipping it.", regionx, regiony, self.regiondir)
-                continue
+            if chunks is None:
+                try:
+                    mcr = self._get_regionobj(regionfile)
+                except nbt.CorruptRegionError:
+                    logging.warning("Found a corrupt region file at %s,%s in %s, Skipping it.", regionx, regiony, self.regiondir)
+                    continue
+                chunks = mcr.get_chunk_info()
+
+                if scanindex is not None:
+                    scanindex.record(regionfile, stamp, chunks)
+                    if mtime is not None and scanindex.trusted and previous is not None:
+                        chunks = _changed_chunks(chunks, previous)
 
-            for chunkx, chunky in mcr.get_chunks():
-                yield chunkx+32*regionx, chunky+32*regiony, mcr.get_chunk_timestamp(chunkx, chunky)
+            xs, zs, mtimes = chunks
+            if len(xs):
+                yield xs + 32*regionx, zs + 32*regiony, mtimes
 
     def get_chunk_mtime(self, x, z):
         """Returns a chunk's mtime, or False if the chunk does not exist.  This
@@ -559,12 +623,16 @@ class RegionSetWrapper(object):
         return self._r.get_type()
     def get_biome_data(self, x, z):
         return self._r.get_biome_data(x,z)
-    def get_chunk(self, x, z):
-        return self._r.get_chunk(x,z)
+    def get_chunk(self, x, z, entities=False):
+        return self._r.get_chunk(x,z,entities)
     def iterate_chunks(self):
         return self._r.iterate_chunks()
     def iterate_newer_chunks(self,filemtime):
         return self._r.iterate_newer_chunks(filemtime)
+    def iterate_chunk_arrays(self, scanindex=None):
+        return self._r.iterate_chunk_arrays(scanindex)
+    def iterate_newer_chunk_arrays(self,filemtime,scanindex=None):
+        return self._r.iterate_newer_chunk_arrays(filemtime,scanindex)
     def get_chunk_mtime(self, x, z):
         return self._r.get_chunk_mtime(x,z)
     
@@ -618,9 +686,9 @@ class RotatedRegionSet(RegionSetWrapper):
     def __setstate__(self, args):
         self.__init__(args[0], args[1])
     
-    def get_chunk(self, x, z):
+    def get_chunk(self, x, z, entities=False):
         x,z = self.unrotate(x,z)
-        chunk_data = dict(super(RotatedRegionSet, self).get_chunk(x,z))
+        chunk_data = dict(super(RotatedRegionSet, self).get_chunk(x,z,entities))
         newsections = []
         for section in chunk_data['Sections']:
             section = dict(section)
@@ -656,6 +724,17 @@ class RotatedRegionSet(RegionSetWrapper):
             x,z = self.rotate(x,z)
             yield x,z,mtime
 
+    # the rotation functions work just as well on whole arrays
+    def iterate_chunk_arrays(self, scanindex=None):
+        for xs,zs,mtimes in super(RotatedRegionSet, self).iterate_chunk_arrays(scanindex):
+            xs,zs = self.rotate(xs,zs)
+            yield xs,zs,mtimes
+
+    def iterate_newer_chunk_arrays(self, filemtime, scanindex=None):
+        for xs,zs,mtimes in super(RotatedRegionSet, self).iterate_newer_chunk_arrays(filemtime, scanindex):
+            xs,zs = self.rotate(xs,zs)
+            yield xs,zs,mtimes
+
 class CroppedRegionSet(RegionSetWrapper):
     def __init__(self, rsetobj, xmin, zmin, xmax, zmax):
         super(CroppedRegionSet, self).__init__(rsetobj)
@@ -664,12 +743,12 @@ class CroppedRegionSet(RegionSetWrapper):
         self.zmin = zmin//16
         self.zmax = zmax//16
 
-    def get_chunk(self,x,z):
+    def get_chunk(self,x,z,entities=False):
         if (
                 self.xmin <= x <= self.xmax and
                 self.zmin <= z <= self.zmax
                 ):
-            return super(CroppedRegionSet, self).get_chunk(x,z)
+            return super(CroppedRegionSet, self).get_chunk(x,z,entities)
         else:
             raise ChunkDoesntExist("This chunk is out of the requested bounds")
 
@@ -687,6 +766,19 @@ class CroppedRegionSet(RegionSetWrapper):
                     self.zmin <= z <= self.zmax
                 )
 
+    def iterate_chunk_arrays(self, scanindex=None):
+        return self._crop_arrays(super(CroppedRegionSet,self).iterate_chunk_arrays(scanindex))
+
+    def iterate_newer_chunk_arrays(self, filemtime, scanindex=None):
+        return self._crop_arrays(super(CroppedRegionSet,self).iterate_newer_chunk_arrays(filemtime, scanindex))
+
+    def _crop_arrays(self, chunk_arrays):
+        for xs,zs,mtimes in chunk_arrays:
+            inside = ((self.xmin <= xs) & (xs <= self.xmax) &
+                      (self.zmin <= zs) & (zs <= self.zmax))
+            if inside.any():
+                yield xs[inside], zs[inside], mtimes[inside]
+
     def get_chunk_mtime(self,x,z):
         if (
                 self.xmin <= x <= self.xmax and
@@ -730,26 +822,111 @@ class CachedRegionSet(RegionSetWrapper):
 
         self.key = s
 
-    def get_chunk(self, x, z):
-        key = hashlib.md5(repr((self.key, x, z))).hexdigest()
-        for i, cache in enumerate(self.caches):
-            try:
-                retval = cache[key]
-                # This did have it, no need to re-add it to this cache, just
-                # the ones before it
-                i -= 1
+    def get_chunk(self, x, z, entities=False):
+        key = (self.key, x, z, entities)
+        caches = self.caches
+        for i, cache in enumerate(caches):
+            retval = cache.get(key)
+            if retval is not None:
                 break
-            except KeyError:
-                pass
         else:
-            retval = super(CachedRegionSet, self).get_chunk(x,z)
+            i = len(caches)
+            retval = super(CachedRegionSet, self).get_chunk(x,z,entities)
 
         # Now add retval to all the caches that didn't have it, all the caches
-        # up to and including index i
-        for cache in self.caches[:i+1]:
+        # before the one that did
+        for cache in caches[:i]:
             cache[key] = retval
 
         return retval
+
+def _changed_chunks(chunks, previous):
+    """Takes the (x,z,mtime) arrays of a region's chunks, and returns only
+    those that are new or have a different mtime than in previous"""
+    xs, zs, mtimes = chunks
+    prevxs, prevzs, prevmtimes = previous
+    known = numpy.zeros(1024, dtype=bool)
+    known[prevxs + prevzs*32] = True
+    known_mtimes = numpy.zeros(1024, dtype=prevmtimes.dtype)
+    known_mtimes[prevxs + prevzs*32] = prevmtimes
+
+    slots = xs + zs*32
+    changed = ~known[slots] | (known_mtimes[slots] != mtimes)
+    return xs[changed], zs[changed], mtimes[changed]
+
+class ChunkScanIndex(object):
+    """A record of the region files seen by chunk scans, kept on disk between
+    runs. For each region file it holds the file's size and mtime, and the
+    (x,z,mtime) arrays of the chunks in it (in region coordinates), so a
+    region whose file hasn't changed needn't be opened again.
+
+    rendertime is the last render time of the map the index belongs to. If
+    the index was saved with that same render time, the render that made it
+    finished, and the index is trusted: regions it has seen unchanged hold
+    nothing that needs rendering.
+
+    """
+    version = 1
+
+    def __init__(self, filename, rendertime):
+        self.filename = filename
+        self._regions = {}
+        saved_rendertime = None
+        try:
+            with open(filename, "rb") as f:
+                data = cPickle.load(f)
+            if data["version"] == self.version:
+                self._regions = data["regions"]
+                saved_rendertime = data["rendertime"]
+        except Exception:
+            if os.path.exists(filename):
+                logging.warning("The chunk scan index %s couldn't be read. Ignoring it.", filename)
+                logging.debug("Full traceback:", exc_info=1)
+        self.trusted = bool(self._regions) and saved_rendertime == rendertime
+
+        # the entries that get saved: every region looked up this time
+        self._seen = {}
+
+    def lookup(self, regionfile):
+        """Returns (stamp, chunks, previous) for the given region file. stamp
+        identifies the file as it is now, to be handed back to record().
+        chunks is the recorded (x,z,mtime) arrays if the file is unchanged
+        since it was recorded, or else None. previous is the recorded arrays
+        whether or not it changed, or None if it was never recorded.
+
+        Raises OSError if the file is gone.
+
+        """
+        key = os.path.abspath(regionfile)
+        # stat before the header is read, so a file changing in between
+        # looks changed next time, rather than the other way around
+        st = os.stat(regionfile)
+        stamp = (st.st_size, st.st_mtime)
+
+        entry = self._regions.get(key)
+        if entry is None:
+            return stamp, None, None
+        previous = tuple(a.astype(numpy.int64) for a in entry[1:])
+        if entry[0] != stamp:
+            return stamp, None, previous
+        self._seen[key] = entry
+        return stamp, previous, previous
+
+    def record(self, regionfile, stamp, chunks):
+        """Records the (x,z,mtime) arrays read from the given region file,
+        with the stamp lookup() returned for it."""
+        xs, zs, mtimes = chunks
+        self._seen[os.path.abspath(regionfile)] = (stamp, xs.astype(numpy.uint8),
+                zs.astype(numpy.uint8), mtimes.astype(numpy.int32))
+
+    def save(self, rendertime, capabilities=default_caps):
+        """Writes out every region looked up since this index was loaded,
+        tagged with the render time the map will have once this render
+        finishes."""
+        data = dict(version=self.version, rendertime=rendertime, regions=self._seen)
+        with FileReplacer(self.filename, capabilities=capabilities) as tmpname:
+            with open(tmpname, "wb") as f:
+                cPickle.dump(data, f, cPickle.HIGHEST_PROTOCOL)
         
 
 def get_save_dir():
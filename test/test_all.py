@@ -8,10 +8,16 @@ sys.path.insert(0, os.path.join(os.getcwd(), os.pardir))
 
 # Import unit test cases or suites here
 from test_tileobj import TileTest
-from test_rendertileset import RendertileSetTest
+from test_rendertileset import RendertileSetTest, ArrayRendertileSetTest
 from test_settings import SettingsTest
 from test_tileset import TilesetTest
 from test_cache import TestLRU
+from test_nbt import NBTReaderTest, MCRFileReaderTest
+from test_regionset import RegionSetTest
+from test_render_loop import ChunkCacheTest, RenderModeTest, NetherTest, SectionSkipTest
+from test_dispatcher import DispatcherTest
+from test_textures import TexturesTest
+from test_composite import CompositeTest
 
 # DISABLE THIS BLOCK TO GET LOG OUTPUT FROM TILESET FOR DEBUGGING
 if 0:
@@ -1,4 +1,5 @@
 import unittest
+import cPickle
 
 from overviewer_core import cache
 
@@ -54,3 +55,24 @@ class TestLRU(unittest.TestCase):
         self.assertEquals(self.lru[4], 'asdf')
         self.assertEquals(self.lru[5], 'asdf')
         self.assertEquals(self.lru[6], 'asdf')
+
+    def test_get(self):
+        self.lru[1] = 2
+        self.assertEquals(self.lru.get(1), 2)
+        self.assertEquals(self.lru.get(3), None)
+        self.assertEquals(self.lru.get(3, 'default'), 'default')
+        self.assertEquals((self.lru.hits, self.lru.misses), (1, 2))
+
+    def test_stats(self):
+        lru = cache.LRUCache(size=2, name="test_stats")
+        for i in range(4):
+            lru[i] = i
+        self.assertEquals(lru[3], 3)
+        self.assertRaises(KeyError, lru.__getitem__, 0)
+        self.assertEquals(lru.evictions, 2)
+        self.assertEquals(cache.get_stats()["test_stats"], (1, 1, 2))
+
+        # unpickled copies start empty, but keep their name
+        copy = cPickle.loads(cPickle.dumps(lru, -1))
+        self.assertEquals((copy.size, copy.name), (2, "test_stats"))
+        self.assertEquals(cache.get_stats()["test_stats"], (1, 1, 2))
@@ -0,0 +1,86 @@
+import unittest
+import logging
+import timeit
+
+import numpy
+from PIL import Image
+
+from overviewer_core import c_overviewer
+
+def make_image(rand, size, mode="RGBA"):
+    """An image with runs of fully transparent and fully opaque pixels, like
+    a tile or block sprite has, and some partly transparent ones"""
+    w, h = size
+    data = rand.randint(0, 256, (h, w, 4)).astype(numpy.uint8)
+    alpha = rand.choice([0, 255, 1], (h, w // 4 + 1), p=[0.4, 0.4, 0.2])
+    alpha = numpy.repeat(alpha, 4, axis=1)[:, :w]
+    data[:, :, 3] = numpy.where(alpha == 1, data[:, :, 3], alpha)
+    img = Image.fromarray(data, "RGBA")
+    if mode == "L":
+        return img.split()[3]
+    return img
+
+class CompositeTest(unittest.TestCase):
+    def setUp(self):
+        self.simd = c_overviewer.use_simd()
+        self.rand = numpy.random.RandomState(1)
+
+    def tearDown(self):
+        c_overviewer.use_simd(self.simd is not None)
+
+    def _both(self, func):
+        """Runs func with the plain and the vector kernels, and returns both
+        results"""
+        c_overviewer.use_simd(False)
+        self.assertEqual(c_overviewer.use_simd(), None)
+        plain = func()
+        c_overviewer.use_simd(True)
+        return plain, func()
+
+    def test_resize_half(self):
+        for size in ((384, 384), (30, 22), (7, 5)):
+            src = make_image(self.rand, size)
+            def resize():
+                dest = Image.new("RGBA", (size[0] // 2, size[1] // 2))
+                c_overviewer.resize_half(dest, src)
+                return dest.tobytes()
+            plain, simd = self._both(resize)
+            self.assertEqual(plain, simd)
+
+            data = numpy.asarray(src, dtype=numpy.uint32)[:size[1] // 2 * 2, :size[0] // 2 * 2]
+            expected = (data[::2, ::2] + data[1::2, ::2] + data[::2, 1::2] + data[1::2, 1::2]) >> 2
+            self.assertEqual(plain, expected.astype(numpy.uint8).tobytes())
+
+    def test_alpha_over(self):
+        dest = make_image(self.rand, (384, 384))
+        for size, pos in (((24, 24), (5, 7)), ((24, 24), (-3, 370)), ((33, 17), (100, -5))):
+            src = make_image(self.rand, size)
+            for mask in (src, make_image(self.rand, size, "L")):
+                def blend():
+                    img = dest.copy()
+                    c_overviewer.alpha_over(img, src, pos, mask)
+                    return img.tobytes()
+                plain, simd = self._both(blend)
+                self.assertEqual(plain, simd)
+                self.assertNotEqual(plain, dest.tobytes())
+
+    def test_benchmark(self):
+        """Times both kernels on whole tiles"""
+        if self.simd is None:
+            self.skipTest("c_overviewer has no vector kernels")
+        src = make_image(self.rand, (384, 384))
+        tile = make_image(self.rand, (384, 384))
+        def run():
+            half = Image.new("RGBA", (192, 192))
+            img = tile.copy()
+            times = (timeit.timeit(lambda: c_overviewer.resize_half(half, src), number=20) / 20,
+                     timeit.timeit(lambda: c_overviewer.alpha_over(img, src, (0, 0), src), number=20) / 20)
+            return times, half.tobytes(), img.tobytes()
+        plain, simd = self._both(run)
+        self.assertEqual(plain[1:], simd[1:])
+        for name, plain_time, simd_time in zip(("resize_half", "alpha_over"), plain[0], simd[0]):
+            logging.info("%s on a 384x384 tile: %.3fms plain, %.3fms %s",
+                    name, plain_time * 1000, simd_time * 1000, self.simd)
+
+if __name__ == "__main__":
+    unittest.main()
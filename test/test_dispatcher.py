@@ -0,0 +1,181 @@
+import unittest
+import os
+import tempfile
+
+from itertools import product
+
+from overviewer_core import dispatcher, observer
+
+class FakeTileset(object):
+    """A worker with a render phase of tiles, and a second phase where each
+    tile depends on its four children, like the tiles of a TileSet"""
+    def __init__(self, depth, logfile=None):
+        self.depth = depth
+        self.done = []
+        # worker processes record their work here
+        self.logfile = logfile
+
+    def get_num_phases(self):
+        return 2
+
+    def get_phase_length(self, phase):
+        if phase == 0:
+            return 4**self.depth
+        return sum(4**d for d in range(self.depth + 1))
+
+    def iterate_work_items(self, phase):
+        if phase == 0:
+            for path in product(range(4), repeat=self.depth):
+                yield path, []
+        else:
+            for depth in reversed(range(self.depth + 1)):
+                for path in product(range(4), repeat=depth):
+                    if depth == self.depth:
+                        yield path, []
+                    else:
+                        yield path, [path + (c,) for c in range(4)]
+
+    def get_work_group(self, workitem):
+        return workitem[:1]
+
+    def do_work(self, workitem):
+        if self.logfile:
+            with open(self.logfile, "a") as f:
+                f.write("%r\n" % (workitem,))
+        else:
+            self.done.append(workitem)
+
+class DelayedDispatcher(dispatcher.Dispatcher):
+    """Only finishes jobs a few dispatch calls after they were dispatched,
+    and in reverse order, like a pool of busy workers"""
+    def __init__(self):
+        super(DelayedDispatcher, self).__init__()
+        self.running = []
+
+    def dispatch(self, tileset, workitem):
+        if tileset is not None:
+            self.running.append((tileset, workitem))
+            if len(self.running) < 5:
+                return []
+        finished = self.running[::-1]
+        self.running = []
+        for tileset, workitem in finished:
+            tileset.do_work(workitem)
+        return finished
+
+class DispatcherTest(unittest.TestCase):
+    def _render(self, dispatch, tilesets):
+        dispatch.render_all(tilesets, observer.Observer())
+        dispatch.close()
+
+    def _check(self, tilesets):
+        for tileset in tilesets:
+            render = tileset.done[:4**tileset.depth]
+            composite = tileset.done[4**tileset.depth:]
+            self.assertEqual(sorted(render), sorted(product(range(4), repeat=tileset.depth)))
+            self.assertEqual(len(composite), tileset.get_phase_length(1))
+            # every tile comes after its children
+            seen = set()
+            for path in composite:
+                if len(path) < tileset.depth:
+                    for c in range(4):
+                        self.assertTrue(path + (c,) in seen)
+                seen.add(path)
+
+    def test_dispatcher(self):
+        tilesets = [FakeTileset(3)]
+        self._render(dispatcher.Dispatcher(), tilesets)
+        self._check(tilesets)
+
+    def test_dependencies(self):
+        tilesets = [FakeTileset(3), FakeTileset(2)]
+        self._render(DelayedDispatcher(), tilesets)
+        self._check(tilesets)
+
+    def test_pipelining(self):
+        order = []
+        class LoggedTileset(FakeTileset):
+            def do_work(self, workitem):
+                order.append((self, workitem))
+                super(LoggedTileset, self).do_work(workitem)
+
+        big, small = LoggedTileset(3), LoggedTileset(1)
+        self._render(DelayedDispatcher(), [big, small])
+        self._check([big, small])
+        # the small tileset doesn't wait for the big one to finish its
+        # render phase before starting the next
+        self.assertTrue(order.index((small, ())) < order.index((big, big.done[63])))
+
+    def test_multiprocessing(self):
+        fd, logfile = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            tileset = FakeTileset(3, logfile)
+            dispatch = dispatcher.MultiprocessingDispatcher(local_procs=2)
+            self._render(dispatch, [tileset])
+            # cheap jobs get batched
+            self.assertTrue(dispatch.batch_size > 1)
+            self.assertEqual(len(dispatch.get_cache_stats()), 2)
+            with open(logfile) as f:
+                tileset.done = [eval(line) for line in f]
+            self._check([tileset])
+        finally:
+            os.unlink(logfile)
+
+    def test_work_groups(self):
+        # play the part of two workers ourselves
+        dispatch = dispatcher.MultiprocessingDispatcher(local_procs=0)
+        tileset = FakeTileset(2)
+        dispatch.setup_tilesets([tileset])
+        for worker in ("a", "b"):
+            dispatch.result_queue.put(("start", worker))
+        while dispatch.num_workers < 2:
+            dispatch._handle_messages()
+
+        # interleaved, like posttraversal(robin=True) does
+        jobs = [(group, i) for i in range(4) for group in range(2)]
+        for path in jobs:
+            dispatch.dispatch(tileset, path)
+        dispatch.dispatch(None, None)
+
+        finished = []
+        done = []
+        def take(worker):
+            tv, batch = dispatch.manager.get_job_queue(worker).get(True, 5)
+            return [workitem for ti, workitem in batch]
+        def finish(worker, workitem):
+            dispatch.result_queue.put(("done", worker, 1.0, [(0, workitem, None)]))
+            done.append(workitem)
+            while len(finished) < len(done):
+                finished.extend(dispatch._handle_messages())
+
+        # each worker got one of the two groups
+        a = take("a") + take("a")
+        b = take("b") + take("b")
+        group_a, group_b = a[0][0], b[0][0]
+        self.assertEqual(a, [(group_a, 0), (group_a, 1)])
+        self.assertEqual(b, [(group_b, 0), (group_b, 1)])
+        self.assertNotEqual(group_a, group_b)
+
+        # a finishes the rest of its group first...
+        finish("a", a[0])
+        finish("a", a[1])
+        a = take("a") + take("a")
+        self.assertEqual(a, [(group_a, 2), (group_a, 3)])
+        # ...then runs dry and steals the last of b's jobs
+        finish("a", a[0])
+        finish("a", a[1])
+        self.assertEqual(take("a"), [(group_b, 3)])
+        finish("a", (group_b, 3))
+        self.assertEqual(take("a"), [(group_b, 2)])
+        finish("a", (group_b, 2))
+        finish("b", b[0])
+        finish("b", b[1])
+        self.assertEqual(sorted(finished), sorted((tileset, path) for path in jobs))
+
+        for worker in ("a", "b"):
+            dispatch.result_queue.put(("exit", worker, worker, {}, {}))
+        dispatch.close()
+
+if __name__ == "__main__":
+    unittest.main()
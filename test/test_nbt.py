@@ -0,0 +1,252 @@
+import unittest
+
+import os
+import glob
+import tempfile
+import gzip
+import zlib
+import struct
+import StringIO
+
+from overviewer_core import nbt
+
+# helpers to write out small nbt files, so we don't need the test worlds
+# just to exercise the reader
+def _string(s):
+    s = s.encode("UTF-8")
+    return struct.pack(">H", len(s)) + s
+
+def _tag(tagtype, name, payload):
+    return chr(tagtype) + _string(name) + payload
+
+def _compound(*tags):
+    return "".join(tags) + "\x00"
+
+def _list(tagtype, payloads):
+    return chr(tagtype) + struct.pack(">I", len(payloads)) + "".join(payloads)
+
+def make_chunk_nbt():
+    sections = []
+    for y in range(2):
+        sections.append(_compound(
+            _tag(1, u"Y", struct.pack("b", y)),
+            _tag(7, u"Blocks", struct.pack(">I", 4096) + chr(y + 1) * 4096),
+            _tag(7, u"Data", struct.pack(">I", 2048) + "\x12" * 2048),
+            _tag(7, u"SkyLight", struct.pack(">I", 2048) + "\xff" * 2048),
+            _tag(7, u"BlockLight", struct.pack(">I", 2048) + "\x00" * 2048),
+        ))
+    entity = _compound(
+        _tag(8, u"id", _string(u"Sign")),
+        _tag(8, u"Text1", _string(u"caf\xe9 \u2603")),
+        _tag(3, u"x", struct.pack(">i", -12345)),
+        _tag(2, u"y", struct.pack(">h", -64)),
+        _tag(4, u"z", struct.pack(">q", -(1 << 40))),
+        _tag(4, u"big", struct.pack(">q", (1 << 62) + 5)),
+        _tag(5, u"f", struct.pack(">f", 0.1)),
+        _tag(6, u"d", struct.pack(">d", -2.5e-300)),
+        _tag(9, u"Motion", _list(6, [struct.pack(">d", v) for v in (0.5, -1.0, 3.0)])),
+    )
+    level = _compound(
+        _tag(3, u"xPos", struct.pack(">i", 3)),
+        _tag(3, u"zPos", struct.pack(">i", -7)),
+        _tag(4, u"LastUpdate", struct.pack(">q", 123456789)),
+        _tag(7, u"Biomes", struct.pack(">I", 256) + "\x04" * 256),
+        _tag(11, u"HeightMap", struct.pack(">I", 256) + struct.pack(">256i", *range(-128, 128))),
+        _tag(9, u"Sections", _list(10, sections)),
+        _tag(9, u"TileEntities", _list(10, [entity])),
+        _tag(9, u"Entities", _list(0, [])),
+        _tag(9, u"TileTicks", _list(10, [])),
+    )
+    return _tag(10, u"", _compound(_tag(10, u"Level", level)))
+
+def _gzip(data):
+    out = StringIO.StringIO()
+    f = gzip.GzipFile(fileobj=out, mode="wb")
+    f.write(data)
+    f.close()
+    return out.getvalue()
+
+def make_region(chunks):
+    """Builds a region file from a {(x, z): (data, timestamp, compression)}
+    dict, with the nbt data already compressed"""
+    locations = [0] * 1024
+    timestamps = [0] * 1024
+    sectors = []
+    for (x, z), (data, timestamp, compression) in sorted(chunks.items()):
+        payload = struct.pack(">IB", len(data) + 1, compression) + data
+        payload += "\x00" * (-len(payload) % 4096)
+        locations[x + z * 32] = ((2 + len(sectors)) << 8) | (len(payload) // 4096)
+        timestamps[x + z * 32] = timestamp
+        sectors.append(payload)
+    return struct.pack(">1024I", *locations) + struct.pack(">1024i", *timestamps) + "".join(sectors)
+
+class NBTReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.c_nbt_read = nbt._c_nbt_read
+
+    def tearDown(self):
+        nbt._c_nbt_read = self.c_nbt_read
+
+    def _read(self, data, use_c, is_gzip=False, tagpaths=None):
+        """Read the raw nbt data with the given decoder"""
+        nbt._c_nbt_read = self.c_nbt_read if use_c else None
+        if is_gzip:
+            data = _gzip(data)
+        else:
+            data = zlib.compress(data)
+        return nbt.NBTFileReader(StringIO.StringIO(data), is_gzip=is_gzip).read_all(tagpaths)
+
+    def _assertSameTree(self, a, b):
+        self.assertEquals(type(a), type(b))
+        if isinstance(a, dict):
+            self.assertEquals(sorted((k, type(k)) for k in a),
+                              sorted((k, type(k)) for k in b))
+            for k in a:
+                self._assertSameTree(a[k], b[k])
+        elif isinstance(a, (list, tuple)):
+            self.assertEquals(len(a), len(b))
+            for x, y in zip(a, b):
+                self._assertSameTree(x, y)
+        else:
+            self.assertEquals(a, b)
+
+    def test_python_reader(self):
+        name, data = self._read(make_chunk_nbt(), False)
+        self.assertEquals(name, u"")
+        level = data[u"Level"]
+        self.assertEquals(level["zPos"], -7)
+        self.assertEquals(len(level["Sections"]), 2)
+        self.assertEquals(level["Sections"][1]["Blocks"], "\x02" * 4096)
+        self.assertEquals(level["HeightMap"], tuple(range(-128, 128)))
+        self.assertEquals(level["TileEntities"][0]["Text1"], u"caf\xe9 \u2603")
+        self.assertEquals(level["TileEntities"][0]["z"], -(1 << 40))
+        self.assertEquals(level["Entities"], [])
+
+    def test_tagpaths(self):
+        data = make_chunk_nbt()
+        for use_c in set([self.c_nbt_read is not None, False]):
+            for is_gzip in (False, True):
+                full = self._read(data, use_c, is_gzip)[1]["Level"]
+
+                level = self._read(data, use_c, is_gzip, ("Level/Sections", "Level/Biomes"))[1]["Level"]
+                self.assertEquals(sorted(level.keys()), ["Biomes", "Sections"])
+                self._assertSameTree(level["Sections"], full["Sections"])
+                self.assertEquals(level["Biomes"], full["Biomes"])
+
+                # paths into lists apply to each compound in them, and a
+                # parent path wins over its children
+                level = self._read(data, use_c, is_gzip,
+                        ("Level/Sections/Y", "Level/TileEntities/Motion",
+                         "Level/zPos", "Level/TileEntities"))[1]["Level"]
+                self.assertEquals(sorted(level.keys()), ["Sections", "TileEntities", "zPos"])
+                self.assertEquals(level["Sections"], [{"Y": 0}, {"Y": 1}])
+                self._assertSameTree(level["TileEntities"], full["TileEntities"])
+                self.assertEquals(level["zPos"], -7)
+
+                self.assertEquals(self._read(data, use_c, is_gzip, ()), (u"", {}))
+
+    @unittest.skipIf(nbt._c_nbt_read is None, "c_overviewer has no nbt decoder")
+    def test_c_parity(self):
+        data = make_chunk_nbt()
+        for is_gzip in (False, True):
+            self._assertSameTree(self._read(data, True, is_gzip),
+                                 self._read(data, False, is_gzip))
+
+    @unittest.skipIf(nbt._c_nbt_read is None, "c_overviewer has no nbt decoder")
+    def test_c_corrupt(self):
+        data = make_chunk_nbt()
+        for use_c in (True, False):
+            # truncated in the middle of the root tag name
+            self.assertRaises(nbt.CorruptNBTError, self._read, data[:2], use_c)
+            # truncated in the middle of an int
+            self.assertRaises(nbt.CorruptNBTError, self._read, data[:20], use_c)
+            # root is not a compound
+            self.assertRaises(nbt.CorruptNBTError, self._read, "\x08" + data[1:], use_c)
+
+    @unittest.skipIf(nbt._c_nbt_read is None or not glob.glob("test/data/worlds/*"),
+                     "test worlds or nbt decoder missing")
+    def test_c_parity_worlds(self):
+        for path in glob.glob("test/data/worlds/*/*.dat"):
+            nbt._c_nbt_read = self.c_nbt_read
+            c_tree = nbt.load(path)
+            nbt._c_nbt_read = None
+            self._assertSameTree(c_tree, nbt.load(path))
+
+        for path in glob.glob("test/data/worlds/*/region/*.mc[ar]"):
+            region = nbt.load_region(path)
+            for x, z in region.get_chunks():
+                nbt._c_nbt_read = self.c_nbt_read
+                c_tree = region.load_chunk(x, z)
+                nbt._c_nbt_read = None
+                self._assertSameTree(c_tree, region.load_chunk(x, z))
+            region.close()
+
+class MCRFileReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.data = make_chunk_nbt()
+        self.chunks = {
+            (0, 0): (zlib.compress(self.data), 1316728885, 2),
+            (3, 1): (_gzip(self.data), 1316728886, 1),
+            (31, 31): (zlib.compress(self.data), -5, 2),
+        }
+        fd, self.path = tempfile.mkstemp(suffix=".mca")
+        os.write(fd, make_region(self.chunks))
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def test_read(self):
+        expected = nbt.NBTFileReader(StringIO.StringIO(zlib.compress(self.data)), is_gzip=False).read_all()
+        for use_mmap in (False, True):
+            region = nbt.load_region(self.path, use_mmap=use_mmap)
+            self.assertEquals(sorted(region.get_chunks()), sorted(self.chunks.keys()))
+            for (x, z), (_, timestamp, _) in self.chunks.iteritems():
+                self.assertTrue(region.chunk_exists(x, z))
+                self.assertEquals(region.get_chunk_timestamp(x, z), timestamp)
+                self.assertEquals(type(region.get_chunk_timestamp(x, z)), int)
+                self.assertEquals(region.load_chunk(x, z), expected)
+                # global coordinates wrap around
+                self.assertEquals(region.load_chunk(x - 64, z + 32, ("Level/zPos",)),
+                                  (u"", {u"Level": {u"zPos": -7}}))
+            self.assertFalse(region.chunk_exists(1, 0))
+            self.assertEquals(region.load_chunk(1, 0), None)
+            region.close()
+
+    def test_chunk_info(self):
+        region = nbt.load_region(self.path)
+        xs, zs, mtimes = region.get_chunk_info()
+        self.assertEquals(zip(xs.tolist(), zs.tolist()), region.get_chunks())
+        self.assertEquals(zip(xs.tolist(), zs.tolist(), mtimes.tolist()),
+                          [(0, 0, 1316728885), (3, 1, 1316728886), (31, 31, -5)])
+        region.close()
+
+    def test_corrupt(self):
+        for use_mmap in (False, True):
+            for size in (0, 4096, 8000):
+                with open(self.path, "wb") as f:
+                    f.write("\x00" * size)
+                self.assertRaises(nbt.CorruptRegionError, nbt.load_region, self.path, use_mmap=use_mmap)
+
+            # a chunk pointing past the end of the file
+            with open(self.path, "wb") as f:
+                f.write(make_region(self.chunks)[:3 * 4096 + 100])
+            region = nbt.load_region(self.path, use_mmap=use_mmap)
+            self.assertTrue(region.load_chunk(0, 0))
+            self.assertRaises(nbt.CorruptRegionError, region.load_chunk, 3, 1)
+            self.assertRaises(nbt.CorruptChunkError, region.load_chunk, 31, 31)
+            region.close()
+
+    def test_truncated_while_mapped(self):
+        region = nbt.load_region(self.path, use_mmap=True)
+        with open(self.path, "r+b") as f:
+            f.truncate(3 * 4096 + 100)
+        # the chunks past the new end are read from the file, not the mapping
+        self.assertTrue(region.load_chunk(0, 0))
+        self.assertEquals(region._map, None)
+        self.assertRaises(nbt.CorruptRegionError, region.load_chunk, 3, 1)
+        self.assertRaises(nbt.CorruptChunkError, region.load_chunk, 31, 31)
+        region.close()
+
+if __name__ == "__main__":
+    unittest.main()
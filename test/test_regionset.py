@@ -0,0 +1,124 @@
+import unittest
+
+import os
+import shutil
+import tempfile
+import zlib
+
+from overviewer_core import world
+from overviewer_core import cache
+from test_nbt import make_chunk_nbt, make_region
+
+class RegionSetTest(unittest.TestCase):
+    def setUp(self):
+        self.worlddir = tempfile.mkdtemp(prefix="OVTEST")
+        os.mkdir(os.path.join(self.worlddir, "region"))
+        self.chunks = set()
+        for rx, rz, chunks in [(0, 0, [(0, 0, 100), (5, 3, 200)]),
+                               (-1, 2, [(31, 0, 300)]),
+                               (1, -1, [])]:
+            self._write_region(rx, rz, chunks)
+            self.chunks.update((x + 32*rx, z + 32*rz, mtime) for x, z, mtime in chunks)
+        self.rset = world.RegionSet(os.path.join(self.worlddir, "region"), "region")
+
+    def _write_region(self, rx, rz, chunks, filemtime=1000):
+        data = zlib.compress(make_chunk_nbt())
+        path = os.path.join(self.worlddir, "region", "r.%d.%d.mca" % (rx, rz))
+        with open(path, "wb") as f:
+            f.write(make_region(dict(((x, z), (data, mtime, 2)) for x, z, mtime in chunks)))
+        os.utime(path, (filemtime, filemtime))
+
+    def tearDown(self):
+        shutil.rmtree(self.worlddir)
+
+    def _flatten(self, chunk_arrays):
+        chunks = []
+        for xs, zs, mtimes in chunk_arrays:
+            self.assertTrue(len(xs) == len(zs) == len(mtimes) > 0)
+            chunks.extend(zip(xs.tolist(), zs.tolist(), mtimes.tolist()))
+        return chunks
+
+    def test_iterate(self):
+        self.assertEquals(set(self.rset.iterate_chunks()), self.chunks)
+        self.assertEquals(set(self._flatten(self.rset.iterate_chunk_arrays())), self.chunks)
+        self.assertEquals(set(self.rset.iterate_newer_chunks(0)), self.chunks)
+        self.assertEquals(set(self._flatten(self.rset.iterate_newer_chunk_arrays(0))), self.chunks)
+        self.assertEquals(list(self.rset.iterate_newer_chunk_arrays(2**40)), [])
+
+    def test_wrappers(self):
+        for north_dir in range(4):
+            rset = world.RotatedRegionSet(self.rset, north_dir)
+            self.assertEquals(set(self._flatten(rset.iterate_chunk_arrays())),
+                              set(rset.iterate_chunks()))
+        rset = world.CroppedRegionSet(self.rset, -16, 0, 100, 100)
+        self.assertEquals(set(self._flatten(rset.iterate_chunk_arrays())),
+                          set([(0, 0, 100), (5, 3, 200)]))
+        self.assertEquals(set(self._flatten(rset.iterate_chunk_arrays())),
+                          set(rset.iterate_chunks()))
+
+    def test_scanindex(self):
+        indexpath = os.path.join(self.worlddir, "chunkscan.dat")
+        opened = []
+        def get_regionobj(regionfile, _get_regionobj=self.rset._get_regionobj):
+            opened.append(os.path.basename(regionfile))
+            return _get_regionobj(regionfile)
+        self.rset._get_regionobj = get_regionobj
+
+        # a missing index is just empty
+        index = world.ChunkScanIndex(indexpath, 0)
+        self.assertFalse(index.trusted)
+        self.assertEquals(set(self._flatten(self.rset.iterate_chunk_arrays(index))), self.chunks)
+        self.assertEquals(len(opened), 3)
+        index.save(300)
+
+        # only trusted by the render it was saved for
+        self.assertFalse(world.ChunkScanIndex(indexpath, 200).trusted)
+        index = world.ChunkScanIndex(indexpath, 300)
+        self.assertTrue(index.trusted)
+        del opened[:]
+        self.assertEquals(set(self._flatten(self.rset.iterate_chunk_arrays(index))), self.chunks)
+        self.assertEquals(list(self.rset.iterate_newer_chunk_arrays(300, index)), [])
+        self.assertEquals(opened, [])
+
+        # change one chunk and add another; only those two come back
+        self._write_region(0, 0, [(0, 0, 100), (5, 3, 400), (6, 3, 50)], 2000)
+        self.rset.regioncache = cache.LRUCache(size=16)
+        index = world.ChunkScanIndex(indexpath, 300)
+        self.assertEquals(set(self._flatten(self.rset.iterate_newer_chunk_arrays(300, index))),
+                          set([(5, 3, 400), (6, 3, 50)]))
+        self.assertEquals(opened, ["r.0.0.mca"])
+        index.save(400)
+
+        # an untrusted index still saves reading unchanged regions, but
+        # falls back to comparing file mtimes
+        del opened[:]
+        index = world.ChunkScanIndex(indexpath, 300)
+        self.assertEquals(set(self._flatten(self.rset.iterate_newer_chunk_arrays(300, index))),
+                          set([(0, 0, 100), (5, 3, 400), (6, 3, 50), (-1, 64, 300)]))
+        self.assertEquals(opened, [])
+
+        # garbage is ignored
+        with open(indexpath, "wb") as f:
+            f.write("garbage")
+        self.assertFalse(world.ChunkScanIndex(indexpath, 400).trusted)
+
+    def test_cached(self):
+        first = cache.LRUCache(size=1)
+        second = cache.LRUCache(size=10)
+        rset = world.CachedRegionSet(self.rset, [first, second])
+        chunk = rset.get_chunk(0, 0)
+        self.assertEquals((first.misses, second.misses), (1, 1))
+
+        # a hit in the second layer is put back in the first
+        rset.get_chunk(5, 3)
+        self.assertTrue(rset.get_chunk(0, 0) is chunk)
+        self.assertEquals((first.hits, second.hits), (0, 1))
+        self.assertTrue(rset.get_chunk(0, 0) is chunk)
+        self.assertEquals((first.hits, second.hits), (1, 1))
+
+        # chunks with entities are cached separately
+        self.assertTrue("TileEntities" in rset.get_chunk(0, 0, entities=True))
+        self.assertFalse("TileEntities" in rset.get_chunk(0, 0))
+
+if __name__ == "__main__":
+    unittest.main()
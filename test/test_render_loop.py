@@ -0,0 +1,223 @@
+import unittest
+
+import numpy
+from PIL import Image
+
+from overviewer_core import c_overviewer, textures, world, rendermodes, tileset
+
+class FakeRegionset(object):
+    """Counts get_chunk calls. Chunks with x == 1 don't exist."""
+    def __init__(self):
+        self.calls = []
+
+    def get_chunk(self, x, z):
+        self.calls.append((x, z))
+        if x == 1:
+            raise world.ChunkDoesntExist("Chunk %s,%s doesn't exist" % (x, z))
+        sections = []
+        for y in range(2):
+            sections.append(dict(Y=y,
+                Blocks=numpy.ones((16,16,16), dtype=numpy.uint16),
+                Data=numpy.zeros((16,16,16), dtype=numpy.uint8),
+                SkyLight=numpy.zeros((16,16,16), dtype=numpy.uint8),
+                BlockLight=numpy.zeros((16,16,16), dtype=numpy.uint8)))
+        return dict(Sections=sections, Biomes=numpy.zeros((16,16), dtype=numpy.uint8))
+
+class FakeTextures(object):
+    # no textures, so nothing is drawn but every chunk is still read
+    blockmap = [None] * (textures.max_blockid * textures.max_data)
+    biome_grass_texture = None
+    texture_size = 24
+
+    def __init__(self):
+        self.loads = 0
+
+    def _load(self):
+        self.loads += 1
+        return None
+    load_foliage_color = load_grass_color = load_water_color = _load
+
+class ChunkCacheTest(unittest.TestCase):
+    def _render(self, regionset, chunkx, chunky, chunkz):
+        img = Image.new("RGBA", (384, 384))
+        # the nether mode looks at every neighbouring chunk
+        c_overviewer.render_loop(None, regionset, chunkx, chunky, chunkz, img,
+                0, 0, [rendermodes.Nether()], FakeTextures())
+
+    def test_shared_chunks(self):
+        regionset = FakeRegionset()
+        cache = c_overviewer.ChunkCache(regionset, -1, -1, 1, 1)
+        for y in range(2):
+            self._render(cache, 0, y, 0)
+        self.assertEqual(sorted(regionset.calls),
+                sorted((x, z) for x in (-1, 0, 1) for z in (-1, 0, 1)))
+
+        # chunks outside the cache are still loaded each time
+        del regionset.calls[:]
+        for y in range(2):
+            self._render(cache, -1, y, 0)
+        self.assertEqual(sorted(regionset.calls), [(-2, -1), (-2, -1), (-2, 0), (-2, 0), (-2, 1), (-2, 1)])
+
+    def test_missing_chunk(self):
+        regionset = FakeRegionset()
+        cache = c_overviewer.ChunkCache(regionset, -1, -1, 1, 1)
+        self._render(cache, 0, 0, 0)
+        # a missing chunk that is required still raises every time
+        for _ in range(2):
+            self.assertRaises(world.ChunkDoesntExist, self._render, cache, 1, 0, 0)
+
+    def test_bounds(self):
+        self.assertRaises(ValueError, c_overviewer.ChunkCache, FakeRegionset(), 0, 0, -1, 0)
+        self.assertRaises(ValueError, c_overviewer.ChunkCache, FakeRegionset(), 0, 0, 1000, 1000)
+
+class RenderModeTest(unittest.TestCase):
+    def _render(self, mode, tex):
+        img = Image.new("RGBA", (384, 384))
+        for y in range(2):
+            c_overviewer.render_loop(None, FakeRegionset(), 0, y, 0, img,
+                    0, 0, mode, tex)
+
+    def test_start_once(self):
+        """The base primitive loads its color tables when started"""
+        tex = FakeTextures()
+        self._render([rendermodes.Base()], tex)
+        self.assertEqual(tex.loads, 6)
+
+        tex = FakeTextures()
+        mode = c_overviewer.RenderMode([rendermodes.Base()], None, tex)
+        self.assertEqual(tex.loads, 3)
+        self._render(mode, tex)
+        self._render(mode, tex)
+        self.assertEqual(tex.loads, 3)
+
+    def test_bad_mode(self):
+        self.assertRaises(TypeError, c_overviewer.RenderMode, None, None, FakeTextures())
+        self.assertRaises(TypeError, c_overviewer.RenderMode,
+                [rendermodes.Base(biomes="yes")], None, FakeTextures())
+
+class LayeredRegionset(FakeRegionset):
+    """Chunks with a mix of blocks, but with the layers of each section that
+    hide its neighbours all stone, except for the side layers of some
+    chunks, so only some sections are covered"""
+    def get_chunk(self, x, z):
+        chunk = super(LayeredRegionset, self).get_chunk(x, z)
+        rand = numpy.random.RandomState((x * 31 + z) % 1000)
+        for section in chunk["Sections"]:
+            # Blocks is indexed [y, z, x]
+            blocks = rand.choice([0, 1, 3, 20], (16, 16, 16), p=[0.7, 0.1, 0.1, 0.1]).astype(numpy.uint16)
+            blocks[0, :, :] = 1
+            if (x + z) % 3:
+                blocks[:, :, 15] = 1
+            if (x - z) % 3:
+                blocks[:, 0, :] = 1
+            section["Blocks"] = blocks
+        return chunk
+
+    def get_chunk_mtime(self, x, z):
+        return x != 1
+
+class SpriteTextures(FakeTextures):
+    def __init__(self, texture_size=24):
+        super(SpriteTextures, self).__init__()
+        tex = textures.Textures(texturesize=texture_size)
+        self.texture_size = texture_size
+        self.get_face_masks = tex.get_face_masks
+        self.get_color_sprite = tex.get_color_sprite
+        self.blockmap = list(self.blockmap)
+        for blockid, color in ((1, (128, 128, 128)), (3, (130, 90, 40)), (20, (200, 220, 255))):
+            face = Image.new("RGBA", (16, 16), color + (255,))
+            self.blockmap[blockid * textures.max_data] = \
+                tex.generate_texture_tuple(tex.build_block(face, face))
+
+class NetherRegionset(FakeRegionset):
+    """Chunks up to the nether roof: bedrock at the top, with netherrack
+    under it that the nether primitive hides. In chunks with x > 0 half the
+    columns have stone right under the roof, which stays."""
+    def get_chunk(self, x, z):
+        chunk = super(NetherRegionset, self).get_chunk(x, z)
+        sections = []
+        for y in range(8):
+            section = dict(chunk["Sections"][0], Y=y)
+            # Blocks is indexed [y, z, x]
+            blocks = numpy.ones((16, 16, 16), dtype=numpy.uint16)
+            if y == 7:
+                blocks[15] = 7
+                blocks[8:15] = 87
+                if x > 0:
+                    blocks[14, :, ::2] = 1
+            section["Blocks"] = blocks
+            sections.append(section)
+        chunk["Sections"] = sections
+        return chunk
+
+class NetherTextures(SpriteTextures):
+    def __init__(self):
+        super(NetherTextures, self).__init__()
+        tex = textures.Textures()
+        for blockid, color in ((7, (20, 20, 20)), (87, (120, 30, 30))):
+            face = Image.new("RGBA", (16, 16), color + (255,))
+            self.blockmap[blockid * textures.max_data] = \
+                tex.generate_texture_tuple(tex.build_block(face, face))
+
+class NetherTest(unittest.TestCase):
+    def _render(self, chunkx, mode, tex):
+        img = Image.new("RGBA", (384, 384))
+        c_overviewer.render_loop(None, NetherRegionset(), chunkx, 7, 0, img,
+                96, 0, mode, tex)
+        return img.tobytes()
+
+    def test_reused_mode(self):
+        """A RenderMode used for several chunks hides the roof of each one
+        like a new mode does"""
+        tex = NetherTextures()
+        primitives = [rendermodes.Base(), rendermodes.Nether()]
+        mode = c_overviewer.RenderMode(primitives, None, tex)
+        for chunkx in (0, 2, 0):
+            fresh = self._render(chunkx, c_overviewer.RenderMode(primitives, None, tex), tex)
+            self.assertEqual(self._render(chunkx, mode, tex), fresh)
+        self.assertNotEqual(self._render(0, mode, tex), self._render(2, mode, tex))
+
+class SectionSkipTest(unittest.TestCase):
+    def _render_tile(self, mode, texture_size=24):
+        """Renders a tile the way TileSet does, returning the image and how
+        many sections were skipped"""
+        regionset = LayeredRegionset()
+        # a tile where the two sections of the chunks in the middle show
+        tile = tileset.RenderTile(0, 24, ())
+        tilesize = 16 * texture_size
+        half, quarter = tilesize // 2, tilesize // 4
+        img = Image.new("RGBA", (tilesize, tilesize))
+        tex = SpriteTextures(texture_size)
+        skipped = c_overviewer.get_render_stats()["sections skipped"]
+        for col, row, chunkx, chunky, chunkz, _ in tileset.get_chunks_by_tile(tile, regionset):
+            c_overviewer.render_loop(None, regionset, chunkx, chunky, chunkz, img,
+                    -half + (col - tile.col) * half,
+                    -quarter + (row - tile.row) * quarter + (16 - 1 - chunky) * half,
+                    mode, tex)
+        return img, c_overviewer.get_render_stats()["sections skipped"] - skipped
+
+    def test_same_image(self):
+        img, skipped = self._render_tile([rendermodes.Base()])
+        self.assertTrue(skipped > 0)
+        self.assertTrue(img.getbbox())
+
+        # hide can hide any block, so its modes skip nothing
+        full_img, skipped = self._render_tile([rendermodes.Base(), rendermodes.Hide()])
+        self.assertEqual(skipped, 0)
+        self.assertEqual(img.tobytes(), full_img.tobytes())
+
+    def test_texture_size(self):
+        img, _ = self._render_tile([rendermodes.Base()])
+        for size in (12, 48):
+            scaled, _ = self._render_tile([rendermodes.Base(), rendermodes.SmoothLighting(),
+                    rendermodes.EdgeLines()], size)
+            self.assertEqual(scaled.size, (16 * size, 16 * size))
+            # the blocks land in the same places, just at another scale
+            self.assertEqual(scaled.getbbox(), tuple(v * size // 24 for v in img.getbbox()))
+
+    def test_no_base(self):
+        img, skipped = self._render_tile([rendermodes.ClearBase()])
+        self.assertEqual(skipped, 0)
+
+if __name__ == "__main__":
+    unittest.main()
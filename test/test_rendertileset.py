@@ -1,11 +1,14 @@
 import unittest
+import random
 
 from itertools import chain, izip
 
-from overviewer_core.tileset import iterate_base4, RendertileSet
+from overviewer_core.tileset import iterate_base4, RendertileSet, ArrayRendertileSet
 from overviewer_core.util import roundrobin
 
 class RendertileSetTest(unittest.TestCase):
+    tileset_class = RendertileSet
+
     # If you change this definition, you must also change the hard-coded
     # results list in test_posttraverse()
     tile_paths = frozenset([
@@ -94,7 +97,7 @@ class RendertileSetTest(unittest.TestCase):
     tile_paths_posttraversal_robin = list(roundrobin(tile_paths_posttraversal_lists)) + [()]
 
     def setUp(self):
-        self.tree = RendertileSet(3)
+        self.tree = self.tileset_class(3)
         for t in self.tile_paths:
             self.tree.add(t)
 
@@ -139,7 +142,7 @@ class RendertileSetTest(unittest.TestCase):
         self.assertRaises(AssertionError, self.test_iterate)
 
         # If something was supposed to be returned but wasn't
-        tree = RendertileSet(3)
+        tree = self.tileset_class(3)
         c = len(self.tile_paths) // 2
         for t in self.tile_paths:
             tree.add(t)
@@ -155,7 +158,7 @@ class RendertileSetTest(unittest.TestCase):
     def test_bool(self):
         "Tests the boolean status of a node"
         self.assertTrue(self.tree)
-        t = RendertileSet(3)
+        t = self.tileset_class(3)
         self.assertFalse(t)
         t.add((0,0,0))
         self.assertTrue(t)
@@ -223,5 +226,43 @@ class RendertileSetTest(unittest.TestCase):
         c = self.tree.count_all()
         self.assertEqual(c, 35)
 
+    def test_update(self):
+        tree = self.tileset_class(3)
+        tree.update(sorted(self.tile_paths))
+        self.assertEqual(list(tree.posttraversal()), self.tile_paths_posttraversal)
+        tree.update([])
+        self.assertEqual(tree.count(), len(self.tile_paths))
+
+class ArrayRendertileSetTest(RendertileSetTest):
+    tileset_class = ArrayRendertileSet
+
+    def test_add_keys(self):
+        tree = ArrayRendertileSet(3)
+        tree.add_keys([(p[0] << 4) | (p[1] << 2) | p[2] for p in self.tile_paths])
+        self.assertEqual(list(tree.posttraversal(robin=True)), self.tile_paths_posttraversal_robin)
+
+    def test_same_as_tree(self):
+        """Compare against RendertileSet on a larger random tree, away from
+        the center"""
+        rand = random.Random(1)
+        paths = [tuple(rand.randrange(4) for _ in range(6)) for _ in range(500)]
+        tree = RendertileSet(6)
+        tree.update(paths)
+        arraytree = ArrayRendertileSet(6)
+        arraytree.update(paths)
+
+        self.assertEqual(arraytree.count(), tree.count())
+        self.assertEqual(arraytree.count_all(), tree.count_all())
+        for offset in [(0,0), (3,-2)]:
+            for robin in (False, True):
+                self.assertEqual(list(arraytree.posttraversal(robin=robin, offset=offset)),
+                                 list(tree.posttraversal(robin=robin, offset=offset)))
+                for level in range(1, 7):
+                    self.assertEqual(list(arraytree.iterate(level, robin=robin, offset=offset)),
+                                     list(tree.iterate(level, robin=robin, offset=offset)))
+        for path in paths[:50]:
+            for level in range(7):
+                self.assertEqual(arraytree.query_path(path[:level]), tree.query_path(path[:level]))
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,222 @@
+import unittest
+import os
+import tempfile
+import shutil
+import zipfile
+import pickle
+import zlib
+import StringIO
+
+from PIL import Image
+
+from overviewer_core import textures
+
+def make_textures():
+    """Returns a Textures object with a few made-up block sprites, as if
+    generate() had been called"""
+    tex = textures.Textures()
+    tex.biome_grass_texture = Image.new("RGBA", (24, 24), (10, 200, 10, 255))
+    tex.blockmap = [None] * (textures.max_blockid * textures.max_data)
+    for i, color in [(1, (100, 100, 100, 255)), (20, (200, 200, 255, 30)), (len(tex.blockmap) - 1, (1, 2, 3, 4))]:
+        img = Image.new("RGBA", (24, 24), color)
+        img.putpixel((5, 7), (255, 0, 0, 0))
+        tex.blockmap[i] = tex.generate_texture_tuple(img)
+    tex.generated = True
+    return tex
+
+def fake_find_file(self, filename, mode="rb", verbose=False):
+    """Stands in for Textures.find_file, making up a texture for every
+    filename"""
+    seed = zlib.crc32(filename) & 0xffffff
+    img = Image.new("RGBA", (16, 16), (seed & 0xff, (seed >> 8) & 0xff, seed >> 16, 255))
+    img.putpixel((seed % 16, 3), (0, 0, 0, 0))
+    out = StringIO.StringIO()
+    img.save(out, "PNG")
+    out.seek(0)
+    self.sources.add(filename)
+    return out
+
+class TexturesTest(unittest.TestCase):
+    def setUp(self):
+        self.paths = []
+
+    def tearDown(self):
+        for path in self.paths:
+            textures._atlases.pop(path, None)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _assertSameSprites(self, a, b):
+        self.assertEqual(a.biome_grass_texture.tobytes(), b.biome_grass_texture.tobytes())
+        self.assertEqual(len(a.blockmap), len(b.blockmap))
+        for x, y in zip(a.blockmap, b.blockmap):
+            if x is None:
+                self.assertEqual(y, None)
+            else:
+                self.assertEqual([img.mode for img in x], [img.mode for img in y])
+                self.assertEqual([img.tobytes() for img in x], [img.tobytes() for img in y])
+
+    def test_pickle(self):
+        tex = make_textures()
+        copy = pickle.loads(pickle.dumps(tex, 2))
+        self.paths.append(tex.atlas_path)
+        self.assertTrue(os.path.exists(tex.atlas_path))
+        self._assertSameSprites(tex, copy)
+
+        # every copy in a process shares the same sprites
+        other = pickle.loads(pickle.dumps(tex, 2))
+        self.assertTrue(other.blockmap is copy.blockmap)
+
+    def test_load_atlas(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.paths.append(path)
+        tex = textures.Textures()
+        self.assertFalse(tex.load_atlas(path))
+        with open(path, "wb") as f:
+            f.write("not an atlas")
+        self.assertFalse(tex.load_atlas(path))
+        self.assertFalse(tex.load_atlas(path + ".missing"))
+
+        make_textures().save_atlas(path)
+        self.assertTrue(tex.load_atlas(path))
+        self._assertSameSprites(make_textures(), tex)
+
+    def test_sources(self):
+        fd, source = tempfile.mkstemp()
+        os.write(fd, "a texture")
+        os.close(fd)
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.paths.extend([source, path])
+
+        tex = make_textures()
+        tex.sources.add(source)
+        tex.save_atlas(path)
+        # atlases are only read once per process
+        textures._atlases.pop(path, None)
+        with open(source, "wb") as f:
+            f.write("a changed texture")
+        self.assertFalse(textures.Textures().load_atlas(path))
+
+    def test_override_dirs(self):
+        texturepath = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, texturepath)
+        os.mkdir(os.path.join(texturepath, "item"))
+        os.utime(os.path.join(texturepath, "item"), (1, 1))
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.paths.append(path)
+
+        tex = make_textures()
+        tex.find_file_local_path = texturepath
+        self.assertTrue(os.path.join(texturepath, "item") in tex.get_override_dirs())
+        tex.save_atlas(path)
+        textures._atlases.pop(path, None)
+        self.assertTrue(textures.Textures(texturepath).load_atlas(path))
+
+        # a texture added to the texture path may replace one from the jar
+        open(os.path.join(texturepath, "item", "chest.png"), "wb").close()
+        textures._atlases.pop(path, None)
+        self.assertFalse(textures.Textures(texturepath).load_atlas(path))
+
+    def test_cache(self):
+        cachedir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cachedir)
+        tex = make_textures()
+        cachepath = os.path.join(cachedir, "textures-%s.atlas" % tex.get_cache_key())
+        self.paths.append(cachepath)
+        tex.save_atlas(cachepath)
+
+        # generate() would fail without any texture files around
+        cached = textures.Textures()
+        cached.generate(cachedir)
+        self.assertTrue(cached.generated)
+        self.assertEqual(cached.atlas_path, cachepath)
+        self._assertSameSprites(tex, cached)
+
+        # other options need other sprites
+        self.assertNotEqual(textures.Textures(northdirection=1).get_cache_key(), tex.get_cache_key())
+        self.assertNotEqual(textures.Textures(bgcolor=(0, 0, 0, 0)).get_cache_key(), tex.get_cache_key())
+        self.assertNotEqual(textures.Textures(texturesize=48).get_cache_key(), tex.get_cache_key())
+
+    def _generate(self, tex, processes=1):
+        # generates tex with made up texture files and a sample of the blocks,
+        # which is plenty and a lot faster
+        find_file = textures.Textures.find_file
+        randint = textures.randint
+        generators = textures.blockmap_generators
+        textures.Textures.find_file = fake_find_file
+        textures.randint = lambda a, b: a
+        textures.blockmap_generators = dict(sorted(generators.items())[::10])
+        try:
+            tex.generate(processes=processes)
+        finally:
+            textures.Textures.find_file = find_file
+            textures.randint = randint
+            textures.blockmap_generators = generators
+        self.assertTrue(any(tex.blockmap))
+        return tex
+
+    def test_parallel_generate(self):
+        serial = self._generate(textures.Textures())
+        parallel = self._generate(textures.Textures(), processes=2)
+        self._assertSameSprites(serial, parallel)
+        self.assertEqual(serial.sources, parallel.sources)
+
+    def test_texture_size(self):
+        self.assertRaises(ValueError, textures.Textures, texturesize=26)
+        self.assertRaises(ValueError, textures.Textures, texturesize=4)
+
+        for size in (12, 48):
+            tex = self._generate(textures.Textures(texturesize=size))
+            for sprite in tex.blockmap:
+                if sprite is not None:
+                    self.assertEqual([img.size for img in sprite], [(size, size)] * len(sprite))
+            self.assertEqual([m.size for m in tex.get_face_masks()], [(size, size)] * 3)
+
+            # the faces of a full block cover every pixel of its outline,
+            # so neighbouring blocks tile without gaps
+            face = Image.new("RGBA", (16, 16), (200, 100, 50, 255))
+            block = tex.build_block(face, face)
+            self.assertEqual(block.getpixel((size // 2, 0))[3], 255)
+            self.assertEqual(block.getpixel((size // 2, size - 1))[3], 255)
+            self.assertEqual(block.getpixel((0, size // 2))[3], 255)
+            self.assertEqual(block.getpixel((size - 1, size // 2))[3], 255)
+
+    def test_find_file(self):
+        packdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, packdir)
+        os.makedirs(os.path.join(packdir, "misc"))
+        with open(os.path.join(packdir, "misc", "a.png"), "wb") as f:
+            f.write("a")
+        pack = zipfile.ZipFile(os.path.join(packdir, "pack.zip"), "w")
+        pack.writestr("assets/minecraft/textures/environment/b.png", "b")
+        pack.close()
+
+        listdir = os.listdir
+        listed = []
+        def counting_listdir(path):
+            listed.append(path)
+            return listdir(path)
+        os.listdir = counting_listdir
+        try:
+            tex = textures.Textures(texturepath=packdir)
+            self.assertEqual(tex.find_file("a.png").read(), "a")
+            self.assertTrue(os.path.join(packdir, "misc", "a.png") in tex.sources)
+            # every directory is only read once, and found files aren't
+            # searched for again
+            self.assertEqual(len(listed), len(set(listed)))
+            del listed[:]
+            self.assertEqual(tex.find_file("a.png").read(), "a")
+            self.assertEqual(listed, [])
+
+            tex = textures.Textures(texturepath=os.path.join(packdir, "pack.zip"))
+            self.assertEqual(tex.find_file("b.png").read(), "b")
+            self.assertEqual(tex.find_file("b.png").read(), "b")
+            self.assertEqual(tex.sources, set([os.path.join(packdir, "pack.zip")]))
+        finally:
+            os.listdir = listdir
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,9 @@
 import unittest
 
-from overviewer_core.tileset import iterate_base4, RenderTile
+import numpy
+
+from overviewer_core.tileset import iterate_base4, RenderTile, get_tiles_by_chunk, \
+        get_tiles_by_chunks, compute_tile_keys
 
 items = [
         ((-4,-8), (0,0)),
@@ -58,5 +61,27 @@ class TileTest(unittest.TestCase):
             self.assertEqual(t.path, path)
 
 
+    def test_compute_tile_keys(self):
+        """Tests the array version of compute_path against compute_path"""
+        for depth in (2, 5):
+            tiles = [RenderTile.from_path(path) for path in iterate_base4(depth)]
+            keys = compute_tile_keys(numpy.array([t.col for t in tiles]),
+                                     numpy.array([t.row for t in tiles]), depth)
+            for tile, key in zip(tiles, keys.tolist()):
+                self.assertEqual(key, sum(p << 2*(depth-1-i) for i, p in enumerate(tile.path)))
+
+    def test_get_tiles_by_chunks(self):
+        """Tests the array version of get_tiles_by_chunk against
+        get_tiles_by_chunk"""
+        cols, rows = numpy.mgrid[-9:9, -9:9]
+        cols = cols.ravel()
+        rows = rows.ravel()
+        index, tilecols, tilerows = get_tiles_by_chunks(cols, rows)
+        for i, (col, row) in enumerate(zip(cols.tolist(), rows.tolist())):
+            this = index == i
+            self.assertEqual(sorted(zip(tilecols[this].tolist(), tilerows[this].tolist())),
+                             sorted(get_tiles_by_chunk(col, row)))
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -6,7 +6,11 @@ import os
 import os.path
 import random
 
+import numpy
+from PIL import Image
+
 from overviewer_core import tileset
+from overviewer_core.files import FileReplacer
 
 # Supporing data
 # chunks list: chunkx, chunkz mapping to chunkmtime
@@ -57,6 +61,13 @@ class FakeRegionset(object):
         for (x,z),mtime in self.chunks.iteritems():
             yield x,z,mtime
 
+    def iterate_chunk_arrays(self, scanindex=None):
+        xs, zs, mtimes = zip(*self.iterate_chunks())
+        yield numpy.array(xs), numpy.array(zs), numpy.array(mtimes)
+
+    def iterate_newer_chunk_arrays(self, filemtime, scanindex=None):
+        return self.iterate_chunk_arrays(scanindex)
+
     def get_chunk_mtime(self, x, z):
         try:
             return self.chunks[x,z]
@@ -113,6 +124,16 @@ def create_fakedir(outputdir, tiles):
 
 # The test cases
 ################
+def iterate_tiles(ts):
+    """Returns the paths of the tiles in the work items of the tileset,
+    including those of the upper-tiles gathered in CompositeJobs"""
+    for item, _ in ts.iterate_work_items(0):
+        if isinstance(item, tileset.CompositeJob):
+            for tilepath in item.tiles:
+                yield tilepath
+        else:
+            yield item
+
 class TilesetTest(unittest.TestCase):
     def setUp(self):
         # Set up the region set
@@ -165,7 +186,7 @@ class TilesetTest(unittest.TestCase):
         parent tiles, and compares that to the output of ts.iterate_work_items().
 
         """
-        paths = set(x[0] for x in ts.iterate_work_items(0))
+        paths = set(iterate_tiles(ts))
 
         # Get what tiles we expect to be returned
         expected = get_tile_set(chunks)
@@ -181,7 +202,13 @@ class TilesetTest(unittest.TestCase):
     def test_get_phase_length(self):
         ts = self.get_tileset({'renderchecks': 2}, self.get_outputdir())
         self.assertEqual(ts.get_num_phases(), 1)
-        self.assertEqual(ts.get_phase_length(0), len(get_tile_set(chunks)))
+        self.assertEqual(ts.get_phase_length(0), len(list(ts.iterate_work_items(0))))
+
+        # with tile checks it's every render-tile and job root of the tree,
+        # which has jobs at levels 2 and 0
+        ts = self.get_tileset({'renderchecks': 1}, self.get_outputdir())
+        self.assertEqual(ts.get_phase_length(0), 4**5 + 4**2 + 1)
+        self.assertTrue(len(list(ts.iterate_work_items(0))) <= ts.get_phase_length(0))
 
     def test_forcerender_iterate(self):
         """Tests that a rendercheck mode 2 iteration returns every render-tile
@@ -268,10 +295,214 @@ class TilesetTest(unittest.TestCase):
         ts = self.get_tileset({'renderchecks': 1}, outputdir)
 
         # Now see if it's right
-        paths = set(x[0] for x in ts.iterate_work_items(0))
+        paths = set(iterate_tiles(ts))
         expected = set(outdated_tiles) | set(additional)
         for tilepath in paths:
             self.assertTrue(tilepath in expected, "%s was not expected to be returned. Expected %s" % (tilepath, expected))
 
         for tilepath in expected:
             self.assertTrue(tilepath in paths, "%s was expected to be returned but wasn't: %s" % (tilepath, paths))
+
+    def test_composite_quadrants(self):
+        """Upper-tiles use the children this process wrote without reading
+        them from disk"""
+        outputdir = self.get_outputdir()
+        ts = self.get_tileset({'renderchecks': 2}, outputdir)
+        colors = [(255, 0, 0, 255), (0, 255, 0, 255), (0, 0, 255, 255), (255, 255, 255, 255)]
+        os.mkdir(os.path.join(outputdir, "0"))
+        for i, color in enumerate(colors[:3]):
+            path = os.path.join(outputdir, "0", "%d.png" % i)
+            Image.new("RGBA", (384, 384), color).save(path)
+            os.utime(path, (10, 10))
+
+        # 0/3.png is only in memory, since nothing was written for it
+        child = os.path.join(outputdir, "0", "3.png")
+        ts._keep_quadrant(child, Image.new("RGBA", (384, 384), colors[3]), 20)
+        ts.do_work((0,))
+        imgpath = os.path.join(outputdir, "0.png")
+        img = Image.open(imgpath).convert("RGBA")
+        self.assertEqual([img.getpixel(xy) for xy in ((0, 0), (192, 0), (0, 192), (192, 192))], colors)
+        self.assertEqual(os.stat(imgpath).st_mtime, 20)
+        self.assertEqual(ts.quadrants.get(child), None)
+
+        # and 0.png is kept for the base tile in turn
+        os.unlink(imgpath)
+        ts.do_work(())
+        img = Image.open(os.path.join(outputdir, "base.png")).convert("RGBA")
+        self.assertEqual([img.getpixel(xy) for xy in ((0, 0), (96, 0), (0, 96), (96, 96))], colors)
+
+        # without the cache every child is read from disk
+        ts = self.get_tileset({'renderchecks': 2, 'compositecache': 0}, outputdir)
+        ts.do_work((0,))
+        img = Image.open(imgpath).convert("RGBA")
+        self.assertEqual(img.getpixel((192, 192)), (0, 0, 0, 255))
+
+    def test_uniform_tiles(self):
+        """Single color tiles are encoded once, and read back without
+        decoding"""
+        outputdir = self.get_outputdir()
+        ts = self.get_tileset({'renderchecks': 2}, outputdir)
+        os.mkdir(os.path.join(outputdir, "0"))
+        empty = Image.new("RGBA", (384, 384), (0, 0, 0, 0))
+        paths = [os.path.join(outputdir, "0", "%d.png" % i) for i in range(4)]
+        for i, path in enumerate(paths[:3]):
+            ts._save_tile(empty, path, 10 + i)
+            self.assertEqual(os.stat(path).st_mtime, 10 + i)
+        self.assertEqual(ts.uniform_tiles.keys(), [(0, 0, 0, 0)])
+        data = [open(path, "rb").read() for path in paths[:3]]
+        self.assertEqual(data, [ts.uniform_tiles[(0, 0, 0, 0)][0]] * 3)
+
+        # tiles with more than one color are not kept
+        mixed = empty.copy()
+        mixed.putpixel((5, 5), (255, 0, 0, 255))
+        ts._save_tile(mixed, paths[3], 20)
+        self.assertEqual(len(ts.uniform_tiles), 1)
+        self.assertEqual(ts._get_uniform_color(paths[0], len(data[0])), (0, 0, 0, 0))
+        self.assertEqual(ts._get_uniform_color(paths[3], os.stat(paths[3]).st_size), None)
+
+        ts.do_work((0,))
+        img = Image.open(os.path.join(outputdir, "0.png")).convert("RGBA")
+        self.assertEqual([img.getpixel(xy) for xy in ((0, 0), (192, 0), (0, 192), (194, 194))],
+                [(0, 0, 0, 0)] * 3 + [(63, 0, 0, 63)])
+
+    def test_tile_hashes(self):
+        """Upper-tiles whose children are unchanged aren't written again"""
+        outputdir = self.get_outputdir()
+        os.makedirs(os.path.join(outputdir, "0", "1", "2"))
+        child = os.path.join(outputdir, "0", "1", "2", "0.png")
+        Image.new("RGBA", (384, 384), (255, 0, 0, 255)).save(child)
+        os.utime(child, (10, 10))
+        job = tileset.CompositeJob((0, 1), ((0, 1, 2), (0, 1)))
+        paths = [os.path.join(outputdir, "0", "1", "2.png"), os.path.join(outputdir, "0", "1.png")]
+
+        options = {'renderchecks': 2, 'tilehashes': True}
+        ts = self.get_tileset(options, outputdir)
+        ts.do_work(job)
+        self.assertTrue(os.path.exists(os.path.join(outputdir, "tilehashes", "01.dat")))
+        inodes = [os.stat(path).st_ino for path in paths]
+
+        # the next render leaves them be
+        ts = self.get_tileset(options, outputdir)
+        ts.do_work(job)
+        self.assertEqual([os.stat(path).st_ino for path in paths], inodes)
+
+        # but not once the child is rewritten, even to the same size and
+        # mtime
+        size = os.stat(child).st_size
+        with FileReplacer(child) as tmppath:
+            Image.new("RGBA", (384, 384), (0, 255, 0, 255)).save(tmppath, "png")
+            os.utime(tmppath, (10, 10))
+        self.assertEqual(os.stat(child).st_size, size)
+        ts = self.get_tileset(options, outputdir)
+        ts.do_work(job)
+        img = Image.open(paths[1]).convert("RGBA")
+        self.assertEqual(img.getpixel((48, 192 + 48)), (0, 255, 0, 255))
+
+        # nor with other settings
+        inodes = [os.stat(path).st_ino for path in paths]
+        ts = self.get_tileset(dict(options, bgcolor='#ffffff'), outputdir)
+        ts.do_work(job)
+        self.assertNotEqual([os.stat(path).st_ino for path in paths], inodes)
+        ts = self.get_tileset(dict(options, bgcolor='#ffffff', rendermode='lighting'), outputdir)
+        self.assertEqual(ts.hashes.unchanged((0, 1), paths[1], "x"), None)
+        self.assertEqual(ts.hashes._get_entries((0, 1)), {})
+
+        # nor once the tile itself was changed since
+        ts = self.get_tileset(dict(options, bgcolor='#ffffff'), outputdir)
+        store = ts.hashes
+        digest = store._get_entries((0, 1))[paths[0]][1]
+        self.assertEqual(store.unchanged((0, 1), paths[0], digest), 10)
+        self.assertEqual(store.unchanged((0, 1), paths[0], "other"), None)
+        os.utime(paths[0], (30, 30))
+        self.assertEqual(store.unchanged((0, 1), paths[0], digest), None)
+
+    def test_tile_hashes_merge(self):
+        """Hashes of a group recorded in different processes all get saved"""
+        outputdir = self.get_outputdir()
+        ts = self.get_tileset({'tilehashes': True}, outputdir)
+        paths = [os.path.join(outputdir, "%d.png" % i) for i in range(2)]
+        stores = []
+        for path in paths:
+            open(path, "wb").close()
+            store = tileset.TileHashStore(os.path.join(outputdir, "tilehashes"),
+                    ts._get_hash_settings())
+            store.record((0, 1), path, path)
+            stores.append(store)
+        # a worker process writes its own file when it finishes, the job's
+        # process then merges that in when the group's composite job is done
+        stores[0].flush(ts.fs_caps)
+        self.assertEqual(stores[0]._groups, {})
+        self.assertEqual(len(os.listdir(os.path.join(outputdir, "tilehashes"))), 1)
+        stores[1].save((0, 1), ts.fs_caps)
+        self.assertEqual(stores[1]._groups, {})
+        self.assertEqual(len(os.listdir(os.path.join(outputdir, "tilehashes"))), 1)
+
+        store = tileset.TileHashStore(os.path.join(outputdir, "tilehashes"),
+                ts._get_hash_settings())
+        for path in paths:
+            self.assertEqual(store.unchanged((0, 1), path, path), os.stat(path).st_mtime)
+
+    def test_composite_jobs(self):
+        """Upper-tiles are rendered a few levels at a time, after the work
+        items below them"""
+        ts = self.get_tileset({'renderchecks': 2}, self.get_outputdir())
+        ts.composite_levels = 2
+        self.assertEqual(ts.treedepth, 5)
+        items = list(ts.iterate_work_items(0))
+        self.assertEqual(ts.get_phase_length(0), len(items))
+
+        seen = set()
+        for item, deps in items:
+            for dep in deps:
+                self.assertTrue(dep in seen)
+            seen.add(item)
+            if not isinstance(item, tileset.CompositeJob):
+                self.assertEqual(len(item), 5)
+                self.assertEqual(deps, [])
+                continue
+
+            # the jobs are rooted at levels 3 and 1, and the base tile, and
+            # reach down to the level of the next jobs
+            below = {0: 1, 1: 3, 3: 5}[len(item.root)]
+            self.assertEqual(item.tiles[-1], item.root)
+            for tilepath in item.tiles:
+                self.assertEqual(tilepath[:len(item.root)], item.root)
+                self.assertTrue(len(tilepath) < below)
+            for dep in deps:
+                self.assertEqual(len(getattr(dep, "root", dep)), below)
+            self.assertEqual(ts.get_work_group(item), item.root)
+        self.assertEqual(items[-1][0].root, ())
+        self.assertEqual(set(iterate_tiles(ts)), set(get_tile_set(chunks)))
+
+    def test_composite_job_groups(self):
+        """Each CompositeJob is the last work item of a work group of its
+        own, whatever the number of levels in a job"""
+        for levels in (1, 2, 3, 4):
+            ts = self.get_tileset({'renderchecks': 2}, self.get_outputdir())
+            ts.composite_levels = levels
+            groups = {}
+            for item, _ in ts.iterate_work_items(0):
+                group = ts.get_work_group(item)
+                self.assertFalse(group in groups, "%s is in a finished group" % (item,))
+                if isinstance(item, tileset.CompositeJob):
+                    groups[group] = item
+            for item, _ in ts.iterate_work_items(0):
+                self.assertTrue(ts.get_work_group(item) in groups)
+
+    def test_composite_job_render(self):
+        """The tiles of a CompositeJob are built from each other, without the
+        cache"""
+        outputdir = self.get_outputdir()
+        ts = self.get_tileset({'renderchecks': 2, 'compositecache': 0}, outputdir)
+        os.makedirs(os.path.join(outputdir, "0", "1"))
+        path = os.path.join(outputdir, "0", "1", "2.png")
+        Image.new("RGBA", (384, 384), (255, 0, 0, 255)).save(path)
+        os.utime(path, (10, 10))
+
+        ts.do_work(tileset.CompositeJob((0,), ((0, 1), (0,))))
+        os.unlink(os.path.join(outputdir, "0", "1.png"))
+        ts.do_work(tileset.CompositeJob((), ((),)))
+        img = Image.open(os.path.join(outputdir, "0.png")).convert("RGBA")
+        self.assertEqual(img.getpixel((192 + 48, 96)), (255, 0, 0, 255))
+        self.assertEqual(img.getpixel((0, 0)), (0, 0, 0, 255))
+        self.assertEqual(os.stat(os.path.join(outputdir, "0.png")).st_mtime, 10)